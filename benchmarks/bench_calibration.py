@@ -0,0 +1,97 @@
+"""
+Micro-benchmark of the lever/actuator mapping for the three channels of a twin-engine hull: the linear
+utils.map_value called per channel (before) against calibration lookup tables mapping the vector of
+channels in one call (after), with a linear and a shaped (deadband, expo, piecewise) calibration. For
+reference, the shaped curves are also evaluated per sample, which is what the tables save.
+
+Usage: python benchmarks/bench_calibration.py [--seconds N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+# pylint: disable=wrong-import-position
+from calibration import Calibration
+from utils import map_value
+
+CHANNELS = ("rudder", "throttle_port", "throttle_starboard")
+
+SHAPED = {
+    "rudder": {"deadband": 3, "expo": 0.4, "reversed": True},
+    "throttle": {
+        "deadband": 5,
+        "points": [[-100, 1200], [-10, 1450], [0, 1500], [10, 1550], [100, 1900]],
+    },
+}
+
+
+def measure(run, samples, seconds):
+    """
+    :return: CPU nanoseconds per channel value
+    """
+    run(samples)  # warm up
+    start = time.process_time()
+    rounds = 0
+    while time.process_time() - start < seconds:
+        run(samples)
+        rounds += 1
+    elapsed = time.process_time() - start
+    return elapsed / (rounds * len(samples) * len(CHANNELS)) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    samples = [[rng.uniform(-100.0, 100.0) for _ in CHANNELS] for _ in range(10_000)]
+
+    def scalar(samples):
+        for rudder, port, starboard in samples:
+            map_value(rudder, -100, 100, 1100, 1900)
+            map_value(port, -100, 100, 1100, 1900)
+            map_value(starboard, -100, 100, 1100, 1900)
+
+    def vector(calibration):
+        mapper = calibration.mapper(CHANNELS)
+
+        def run(samples):
+            for pcts in samples:
+                mapper(pcts)
+
+        return run
+
+    def evaluated(calibration):
+        curves = [calibration.curve(name) for name in CHANNELS]
+
+        def run(samples):
+            for pcts in samples:
+                [
+                    round(curve.interpolate(curve.shape(pct)))
+                    for curve, pct in zip(curves, pcts)
+                ]
+
+        return run
+
+    shaped = Calibration(SHAPED)
+    results = [
+        ("map_value, linear", measure(scalar, samples, args.seconds)),
+        ("table, linear", measure(vector(Calibration()), samples, args.seconds)),
+        ("table, shaped", measure(vector(shaped), samples, args.seconds)),
+        ("evaluated, shaped", measure(evaluated(shaped), samples, args.seconds)),
+    ]
+
+    print(f"{len(samples)} samples of {len(CHANNELS)} channels")
+    print(f"{'mapping':<20}{'ns/value':>10}")
+    for name, ns in results:
+        print(f"{name:<20}{ns:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
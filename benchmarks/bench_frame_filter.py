@@ -0,0 +1,113 @@
+"""
+Micro-benchmark of the receive path on a recorded-like stream: pymavlink decoding every frame
+(parse_buffer, before) against FrameParser decoding only the message types the connector publishes (after).
+
+The stream mixes the five default telemetry streams with the other traffic an ArduPilot rover sends
+(SERVO_OUTPUT_RAW, MEMINFO, POWER_STATUS, MISSION_CURRENT, ...), roughly at their default stream rates.
+
+Usage: python benchmarks/bench_frame_filter.py [--seconds N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+# pylint: disable=wrong-import-position
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+
+from framing import FrameParser
+
+WANTED = ("HEARTBEAT", "RC_CHANNELS", "VFR_HUD", "RAW_IMU", "AHRS", "VIBRATION")
+
+
+class _Connection:
+    """The parts of a mavutil connection FrameParser uses."""
+
+    first_byte = False
+
+    def __init__(self):
+        self.mav = mavlink2.MAVLink(None)
+
+    def post_message(self, msg):
+        pass
+
+
+def one_second_of_traffic(mav):
+    """
+    :return: Bytes of about one second of a rover's default telemetry
+    """
+    frames = []
+    for tick in range(50):
+        t = tick * 20
+        frames += [
+            mav.raw_imu_encode(t, -888, 17, -459, 0, 0, 0, 0, 0, 0, 0, 3369),
+            mav.vfr_hud_encode(0.0, 0.017, 293, 0, 0.0, -0.007),
+            mav.attitude_encode(t, 0.01, 0.02, 1.5, 0.0, 0.0, 0.0),
+            mav.servo_output_raw_encode(t, 0, *([1500] * 8)),
+            mav.rc_channels_encode(t, 16, *([1500] * 18), 255),
+        ]
+        if tick % 5 == 0:
+            frames += [
+                mav.ahrs_encode(-0.0002, 0.00002, 0.0002, 0.0, 0.0, 0.0001, 1.0),
+                mav.vibration_encode(t, 0.009, 0.0066, 0.0069, 0, 0, 0),
+                mav.global_position_int_encode(
+                    t, 577000000, 119000000, 0, 0, 0, 0, 0, 0
+                ),
+                mav.gps_raw_int_encode(
+                    t, 3, 577000000, 119000000, 0, 65535, 65535, 0, 0, 12
+                ),
+                mav.nav_controller_output_encode(0, 0, 0, 0, 0, 0, 0, 0),
+            ]
+        if tick % 25 == 0:
+            frames += [
+                mav.heartbeat_encode(10, 3, 129, 0, 4),
+                mav.sys_status_encode(0, 0, 0, 500, 12000, -1, 80, 0, 0, 0, 0, 0, 0),
+                mav.meminfo_encode(2048, 60000),
+                mav.power_status_encode(5000, 0, 0),
+                mav.mission_current_encode(0),
+            ]
+
+    return b"".join(bytes(msg.pack(mav)) for msg in frames), len(frames)
+
+
+def measure(parse, data, seconds):
+    """
+    :return: (CPU microseconds per second of traffic, messages returned per second of traffic)
+    """
+    parse(data)  # warm up
+    start = time.process_time()
+    count = 0
+    rounds = 0
+    while time.process_time() - start < seconds:
+        count += len(parse(data))
+        rounds += 1
+    elapsed = time.process_time() - start
+    return elapsed / rounds * 1e6, count / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    data, frame_count = one_second_of_traffic(mavlink2.MAVLink(None, srcSystem=1))
+    reference = mavlink2.MAVLink(None)
+    filtering = FrameParser(
+        _Connection(),
+        [getattr(mavlink2, f"MAVLINK_MSG_ID_{msg_type}") for msg_type in WANTED],
+    )
+
+    before_us, before_count = measure(reference.parse_buffer, data, args.seconds)
+    after_us, after_count = measure(filtering.parse, data, args.seconds)
+
+    print(f"{frame_count} frames, {len(data)} bytes per second of traffic")
+    print(f"{'path':<24}{'CPU us/s':>10}{'msgs':>7}")
+    print(f"{'decode all (pymavlink)':<24}{before_us:>10.0f}{before_count:>7.0f}")
+    print(f"{'filtered (FrameParser)':<24}{after_us:>10.0f}{after_count:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
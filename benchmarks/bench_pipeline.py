@@ -0,0 +1,534 @@
+"""
+End-to-end benchmark of the connector pipeline: bin/main.py runs as a child process between a loopback
+MAVLink vehicle and a local Zenoh peer, both played by this script.
+
+Telemetry path: RAW_IMU frames carrying their send time in time_usec are streamed to the connector's UDP
+endpoint, decoded, mapped to protobuf, enclosed and put on Zenoh, and taken by a subscriber here, which
+measures the latency from send to receipt.
+Control path: engine lever positions are put on Zenoh one at a time, mapped through the calibration by the
+connector and sent as RC_CHANNELS_OVERRIDE, and the time until the vehicle sees the override carrying the
+lever's PWM value is measured.
+With --replay the connector reads a recording (see --record of main.py) instead, as fast as possible by
+default, and only the telemetry throughput and CPU are measured.
+
+Reports messages per second, p50/p99 latency and the connector's CPU time per message, read from
+/proc/<pid>/stat (Linux only) in clock ticks of usually 10 ms, so keep the phases long. Results are written as JSON, --compare prints the change against an earlier
+result, e.g. of the previous release.
+
+Usage: python benchmarks/bench_pipeline.py [--rate HZ] [--seconds N] [--samples N] [--output PATH]
+    [--compare BASELINE] [--replay PATH[@SPEED]] [--connector-args "--runtime asyncio"]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+os.environ.setdefault("MAVLINK20", "1")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+# pylint: disable=wrong-import-position
+import keelson
+import zenoh
+from pymavlink import mavutil
+
+from keelson.payloads.Experimental_FlightControllerTelemetry_pb2 import RawIMU
+from keelson.payloads.TimestampedFloat_pb2 import TimestampedFloat
+
+from calibration import load_calibration
+from main import LEVER_FULL_SCALE
+
+MAIN = os.path.join(os.path.dirname(__file__), "..", "bin", "main.py")
+REALM = "bench"
+ENTITY = "boat"
+ENGINE_LEVER_SOURCE = "arduino/right/azimuth/vertical/on_change"
+STARTUP_TIMEOUT = 30.0
+CONTROL_TIMEOUT = 1.0  # seconds a lever position may take to show up in an override
+DRAIN = 1.0  # seconds given to the connector to finish the last messages of a phase
+
+
+def percentile(values, q):
+    """
+    :param values: Sorted list
+    :param q: Quantile within 0-1
+    :return: The nearest-rank quantile, None if values is empty
+    """
+    if not values:
+        return None
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def cpu_seconds(pid):
+    """
+    :return: User plus system CPU seconds used by the process so far, None where /proc is not available
+    """
+    try:
+        with open(f"/proc/{pid}/stat", encoding="ascii") as fh:
+            # the command name in parentheses may contain spaces, the counters follow it
+            fields = fh.read().rpartition(")")[2].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class LoopbackVehicle:
+    """
+    An armed autopilot on a UDP loopback endpoint: sends heartbeats, acknowledges commands and collects
+    the RC overrides it receives.
+    """
+
+    def __init__(self, port):
+        self.connection = mavutil.mavlink_connection(
+            f"udpout:127.0.0.1:{port}", source_system=1, source_component=1
+        )
+        self.overrides = []
+        self.__send_lock = threading.Lock()
+        self.__override = threading.Condition()
+        self.__stop = threading.Event()
+        self.__threads = [
+            threading.Thread(target=self.__heartbeat, daemon=True),
+            threading.Thread(target=self.__receive, daemon=True),
+        ]
+        for thread in self.__threads:
+            thread.start()
+
+    def send(self, send_function, *args):
+        with self.__send_lock:
+            send_function(*args)
+
+    def send_raw_imu(self):
+        mav = self.connection.mav
+        self.send(mav.raw_imu_send, time.time_ns() // 1000, 1, 2, 3, 4, 5, 6, 7, 8, 9)
+
+    def wait_override(self, since, pwm, timeout):
+        """
+        :param since: Index into overrides to search from
+        :param pwm: PWM value one of the channels must carry
+        :return: (receive time, index after the override) or None on timeout
+        """
+        deadline = time.monotonic() + timeout
+        with self.__override:
+            while True:
+                for index in range(since, len(self.overrides)):
+                    received_at, channels = self.overrides[index]
+                    if any(abs(value - pwm) <= 1 for value in channels):
+                        return received_at, index + 1
+                since = len(self.overrides)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.__override.wait(remaining):
+                    return None
+
+    def stop(self):
+        self.__stop.set()
+        for thread in self.__threads:
+            thread.join(1.0)
+        self.connection.close()
+
+    def __heartbeat(self):
+        mav = self.connection.mav
+        while not self.__stop.is_set():
+            self.send(
+                mav.heartbeat_send,
+                mavutil.mavlink.MAV_TYPE_SURFACE_BOAT,
+                mavutil.mavlink.MAV_AUTOPILOT_ARDUPILOTMEGA,
+                mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED,
+                0,
+                0,
+            )
+            self.__stop.wait(1.0)
+
+    def __receive(self):
+        mav = self.connection.mav
+        while not self.__stop.is_set():
+            msg = self.connection.recv_match(blocking=True, timeout=0.2)
+            if msg is None:
+                continue
+            msg_type = msg.get_type()
+            if msg_type == "RC_CHANNELS_OVERRIDE":
+                channels = [getattr(msg, f"chan{i}_raw") for i in range(1, 9)]
+                with self.__override:
+                    self.overrides.append((time.perf_counter(), channels))
+                    self.__override.notify_all()
+            elif msg_type == "COMMAND_LONG":
+                self.send(
+                    mav.command_ack_send,
+                    msg.command,
+                    mavutil.mavlink.MAV_RESULT_ACCEPTED,
+                )
+
+
+class TelemetrySink:
+    """
+    Zenoh subscriber counting the telemetry samples of the connector and the latency of the RAW_IMU ones.
+    """
+
+    def __init__(self, session):
+        self.__lock = threading.Lock()
+        self.__reset()
+        self.__subscriber = session.declare_subscriber(f"{REALM}/**", self.__on_sample)
+
+    def close(self):
+        self.__subscriber.undeclare()
+
+    def __reset(self):
+        self.received = 0
+        self.latencies_us = []
+        self.first = None
+        self.last = None
+
+    def take(self):
+        """
+        :return: (samples, RAW_IMU latencies in microseconds, first and last receive time) since the last take
+        """
+        with self.__lock:
+            taken = (self.received, self.latencies_us, self.first, self.last)
+            self.__reset()
+        return taken
+
+    def __on_sample(self, sample):
+        now = time.perf_counter()
+        now_us = time.time_ns() // 1000
+        key = str(sample.key_expr)
+        if "/flight_controller_telemetry_" not in key:
+            return
+        latency = None
+        if key.endswith("_rawimu/speedybee"):
+            payload = RawIMU.FromString(keelson.uncover(sample.payload)[2])
+            latency = now_us - payload.time_usec
+        with self.__lock:
+            self.received += 1
+            if self.first is None:
+                self.first = now
+            self.last = now
+            if latency is not None:
+                self.latencies_us.append(latency)
+
+
+def latency_summary(latencies_s):
+    ordered = sorted(latencies_s)
+    return {
+        "p50_ms": _ms(percentile(ordered, 0.5)),
+        "p99_ms": _ms(percentile(ordered, 0.99)),
+        "max_ms": _ms(ordered[-1] if ordered else None),
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1e3, 3) if seconds is not None else None
+
+
+def _per_message_us(cpu, count):
+    return round(cpu / count * 1e6, 1) if cpu is not None and count else None
+
+
+def run_telemetry(vehicle, sink, pid, rate, seconds):
+    """
+    Stream RAW_IMU at the given rate, 0 for as fast as possible, and measure what the connector publishes.
+    """
+    sink.take()
+    cpu_before = cpu_seconds(pid)
+    started = time.perf_counter()
+    sent = 0
+    next_send = started
+    while True:
+        now = time.perf_counter()
+        if now - started >= seconds:
+            break
+        if rate:
+            if next_send > now:
+                time.sleep(next_send - now)
+            next_send += 1.0 / rate
+        vehicle.send_raw_imu()
+        sent += 1
+    elapsed = time.perf_counter() - started
+    time.sleep(DRAIN)
+    cpu_after = cpu_seconds(pid)
+    received, latencies_us, _, _ = sink.take()
+    cpu = cpu_after - cpu_before if cpu_before is not None else None
+
+    return {
+        "sent": sent,
+        "received": received,
+        "lost": max(sent - received, 0),
+        "msgs_per_s": round(received / elapsed, 1),
+        **latency_summary([latency / 1e6 for latency in latencies_us]),
+        "cpu_s": round(cpu, 3) if cpu is not None else None,
+        "cpu_us_per_msg": _per_message_us(cpu, received),
+    }
+
+
+def run_control(session, vehicle, pid, samples):
+    """
+    Put engine lever positions one at a time and wait for each to come back as an RC override.
+    """
+    to_pwm = load_calibration().curve("throttle")
+    key = keelson.construct_pub_sub_key(
+        realm=REALM,
+        entity_id=ENTITY,
+        subject="lever_position_pct",
+        source_id=ENGINE_LEVER_SOURCE,
+    )
+    publisher = session.declare_publisher(key)
+    payload = TimestampedFloat()
+
+    latencies = []
+    lost = 0
+    cpu_before = cpu_seconds(pid)
+    started = time.perf_counter()
+    for i in range(samples):
+        # alternate the sign and stay off center, so every sample changes the throttle channels
+        position = (10 + i % 90) * (1 if i % 2 else -1)
+        pwm = to_pwm(position * 100 / LEVER_FULL_SCALE)
+        payload.timestamp.FromNanoseconds(time.time_ns())
+        payload.value = position
+        since = len(vehicle.overrides)
+        sent_at = time.perf_counter()
+        publisher.put(keelson.enclose(payload.SerializeToString()))
+        override = vehicle.wait_override(since, pwm, CONTROL_TIMEOUT)
+        if override is None:
+            lost += 1
+        else:
+            latencies.append(override[0] - sent_at)
+    elapsed = time.perf_counter() - started
+    cpu_after = cpu_seconds(pid)
+    publisher.undeclare()
+    cpu = cpu_after - cpu_before if cpu_before is not None else None
+
+    return {
+        "sent": samples,
+        "applied": len(latencies),
+        "lost": lost,
+        "msgs_per_s": round(len(latencies) / elapsed, 1),
+        **latency_summary(latencies),
+        "cpu_s": round(cpu, 3) if cpu is not None else None,
+        "cpu_us_per_msg": _per_message_us(cpu, samples),
+    }
+
+
+def run_replay(sink, pid, seconds):
+    """
+    Measure the telemetry published while the connector replays a recording, until it has been quiet for
+    DRAIN seconds or seconds passed.
+    """
+    cpu_before = cpu_seconds(pid)
+    started = time.monotonic()
+    seen = 0
+    quiet_since = time.monotonic()
+    while time.monotonic() - started < seconds:
+        time.sleep(0.1)
+        count = sink.received
+        if count != seen:
+            seen, quiet_since = count, time.monotonic()
+        elif seen and time.monotonic() - quiet_since >= DRAIN:
+            break
+    cpu_after = cpu_seconds(pid)
+    received, _, first, last = sink.take()
+    cpu = cpu_after - cpu_before if cpu_before is not None else None
+    elapsed = last - first if received > 1 else None
+
+    return {
+        "received": received,
+        "msgs_per_s": round(received / elapsed, 1) if elapsed else None,
+        "cpu_s": round(cpu, 3) if cpu is not None else None,
+        "cpu_us_per_msg": _per_message_us(cpu, received),
+    }
+
+
+def start_connector(device, zenoh_port, args):
+    command = [
+        sys.executable,
+        MAIN,
+        "-r",
+        REALM,
+        "-e",
+        ENTITY,
+        "-di",
+        device,
+        "--connect",
+        f"tcp/127.0.0.1:{zenoh_port}",
+        "--log-level",
+        "40",
+        "--telemetry",
+        *args.telemetry,
+        "--max-override-rate",
+        str(args.max_override_rate),
+        "-sub",
+        "start",
+        *shlex.split(args.connector_args),
+    ]
+    return subprocess.Popen(command)  # pylint: disable=consider-using-with
+
+
+def wait_for_telemetry(vehicle, sink, connector):
+    """
+    Feed the connector until its first telemetry sample arrives.
+    """
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while sink.received == 0:
+        if connector.poll() is not None:
+            raise RuntimeError(f"Connector exited with {connector.returncode}")
+        if time.monotonic() > deadline:
+            raise RuntimeError("No telemetry from the connector, is Zenoh reachable?")
+        if vehicle is not None:
+            vehicle.send_raw_imu()
+        time.sleep(0.05)
+    time.sleep(1.0)  # let the connector arm and settle
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, baseline):
+    """
+    Print every measurement of result next to the baseline's, with the change in percent.
+    """
+    print(f"\n{'measurement':<34}{'baseline':>12}{'current':>12}{'change':>9}")
+    for phase in ("telemetry", "control", "replay"):
+        current, before = result.get(phase), baseline.get(phase)
+        if not current or not before:
+            continue
+        for name, value in current.items():
+            old = before.get(name)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+                continue
+            change = f"{(value - old) / old * 100:+.1f}%" if old else ""
+            print(f"{phase + '.' + name:<34}{old:>12}{value:>12}{change:>9}")
+
+
+def benchmark(args, session):
+    """
+    Run the connector against the loopback vehicle, or on the recording, and measure it.
+    :return: JSON serializable result
+    """
+    sink = TelemetrySink(session)
+
+    result = {
+        "benchmark": "pipeline",
+        "revision": git_revision(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            name: getattr(args, name)
+            for name in (
+                "rate",
+                "seconds",
+                "samples",
+                "max_override_rate",
+                "telemetry",
+                "replay",
+                "connector_args",
+            )
+        },
+    }
+
+    vehicle = None
+    if args.replay:
+        replay = args.replay if "@" in args.replay else f"{args.replay}@max"
+        connector = start_connector(f"replay:{replay}", args.zenoh_port, args)
+    else:
+        vehicle = LoopbackVehicle(args.mavlink_port)
+        connector = start_connector(
+            f"udpin:127.0.0.1:{args.mavlink_port}", args.zenoh_port, args
+        )
+
+    try:
+        if args.replay:
+            # the first sample is counted in, the replay starts as soon as the connector opens the link
+            wait = time.monotonic() + STARTUP_TIMEOUT
+            while sink.received == 0 and time.monotonic() < wait:
+                time.sleep(0.05)
+            result["replay"] = run_replay(
+                sink, connector.pid, STARTUP_TIMEOUT + args.seconds
+            )
+        else:
+            wait_for_telemetry(vehicle, sink, connector)
+            result["telemetry"] = run_telemetry(
+                vehicle, sink, connector.pid, args.rate, args.seconds
+            )
+            result["control"] = run_control(
+                session, vehicle, connector.pid, args.samples
+            )
+    finally:
+        connector.terminate()
+        try:
+            connector.wait(5.0)
+        except subprocess.TimeoutExpired:
+            connector.kill()
+        if vehicle is not None:
+            vehicle.stop()
+        sink.close()
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=1000.0,
+        help="RAW_IMU per second, 0 as fast as possible",
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=10.0, help="Length of the telemetry phase"
+    )
+    parser.add_argument(
+        "--samples", type=int, default=500, help="Lever positions of the control phase"
+    )
+    parser.add_argument("--max-override-rate", type=float, default=1000.0)
+    parser.add_argument("--telemetry", nargs="+", default=["RAW_IMU"])
+    parser.add_argument(
+        "--replay", metavar="PATH[@SPEED]", help="Benchmark the replay of a recording"
+    )
+    parser.add_argument(
+        "--connector-args", default="", help="Extra arguments for main.py"
+    )
+    parser.add_argument("--mavlink-port", type=int, default=14660)
+    parser.add_argument("--zenoh-port", type=int, default=7460)
+    parser.add_argument("--output", default="bench_pipeline.json")
+    parser.add_argument(
+        "--compare", metavar="BASELINE", help="Earlier result to compare with"
+    )
+    args = parser.parse_args()
+
+    conf = zenoh.Config()
+    conf.insert_json5(
+        zenoh.config.LISTEN_KEY, json.dumps([f"tcp/127.0.0.1:{args.zenoh_port}"])
+    )
+    conf.insert_json5("scouting/multicast/enabled", "false")
+    session = zenoh.open(conf)
+    try:
+        result = benchmark(args, session)
+    finally:
+        session.close()
+
+    print(json.dumps(result, indent=2))
+    with open(args.output, "w", encoding="utf-8") as fh:
+        json.dump(result, fh, indent=2)
+        fh.write("\n")
+    print(f"Written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            compare(result, json.load(fh))
+
+
+if __name__ == "__main__":
+    main()
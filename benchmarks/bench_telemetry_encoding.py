@@ -0,0 +1,146 @@
+"""
+Micro-benchmark of the per-sample telemetry encoding path of every telemetry registry entry:
+    fresh     a fresh payload message plus keelson.enclose, as before pooling
+    envelope  a fresh payload message plus the reusable EnvelopeWriter
+    pooled    the pooled payload and EnvelopeWriter of TelemetryEncoder, as published
+so the gain of reusing the payload message is shown apart from the gain of reusing the envelope.
+
+The paths are timed in interleaved rounds and the best round is reported, so a burst of load on the
+machine does not favour whichever path happened to run at a quiet moment. Also reports the transient
+Python heap allocated while encoding one sample, as traced by tracemalloc. Memory that protobuf allocates
+in its own C arenas is not visible to tracemalloc.
+
+Usage: python benchmarks/bench_telemetry_encoding.py [--samples N] [--rounds N]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+# pylint: disable=wrong-import-position
+import keelson
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+
+from telemetry import TELEMETRY_REGISTRY, EnvelopeWriter, TelemetryEncoder
+
+SAMPLE_MESSAGES = {
+    "VFR_HUD": mavlink2.MAVLink_vfr_hud_message(0.0, 0.017, 293, 0, 0.0, -0.007),
+    "RAW_IMU": mavlink2.MAVLink_raw_imu_message(
+        1854881692, -888, 17, -459, 0, 0, 0, 0, 0, 0, 0, 3369
+    ),
+    "AHRS": mavlink2.MAVLink_ahrs_message(
+        -0.0002, 0.00002, 0.0002, 0.0, 0.0, 0.0001, 1.0
+    ),
+    "VIBRATION": mavlink2.MAVLink_vibration_message(
+        1854900660, 0.009, 0.0066, 0.0069, 0, 0, 0
+    ),
+    "BATTERY_STATUS": mavlink2.MAVLink_battery_status_message(
+        0, 0, 0, 32767, [4966] + [65535] * 9, 44, 229, 41, 93, 0, 1, [0] * 4, 0, 0
+    ),
+    "ATTITUDE": mavlink2.MAVLink_attitude_message(
+        1854881, 0.01, -0.02, 1.57, 0.001, 0.002, 0.003
+    ),
+    "GPS_RAW_INT": mavlink2.MAVLink_gps_raw_int_message(
+        1854881584, 3, 577000000, 118000000, 12000, 120, 180, 15, 29300, 11
+    ),
+    "SERVO_OUTPUT_RAW": mavlink2.MAVLink_servo_output_raw_message(
+        1854881584, 0, *([1500] * 2 + [0] * 14)
+    ),
+    "SCALED_PRESSURE": mavlink2.MAVLink_scaled_pressure_message(
+        1854881, 1019.57, 0.0, 3656, 0
+    ),
+    "SYS_STATUS": mavlink2.MAVLink_sys_status_message(
+        0x3FFFFF, 0x3FFFFF, 0x3FFFFF, 250, 4966, 44, 93, 0, 0, 0, 0, 0, 0
+    ),
+}
+
+
+def encode_fresh(mapping, msg):
+    """The pre-pooling path: new payload message and keelson.enclose per sample."""
+    payload = mapping.proto_class()
+    mapping.fill(msg, payload)
+    return keelson.enclose(payload.SerializeToString())
+
+
+def encode_envelope(mapping, writer, msg):
+    """New payload message per sample, reusable envelope."""
+    payload = mapping.proto_class()
+    mapping.fill(msg, payload)
+    return writer.enclose(payload.SerializeToString())
+
+
+def time_rounds(encoders, msg, samples, rounds):
+    """
+    Time the encoders in interleaved rounds.
+    :return: List of the best microseconds per sample of each encoder
+    """
+    for encode in encoders:
+        for _ in range(100):  # warm up caches and grow reusable buffers
+            encode(msg)
+
+    per_round = max(1, samples // rounds)
+    best = [float("inf")] * len(encoders)
+    for _ in range(rounds):
+        for i, encode in enumerate(encoders):
+            start = time.perf_counter()
+            for _ in range(per_round):
+                encode(msg)
+            best[i] = min(best[i], (time.perf_counter() - start) / per_round * 1e6)
+
+    return best
+
+
+def transient_bytes(encode, msg, samples=1000):
+    """
+    :return: Mean transient bytes allocated per sample
+    """
+    tracemalloc.start()
+    transient = 0
+    for _ in range(samples):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        encode(msg)
+        transient += tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    return transient / samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--samples", type=int, default=200000, help="Samples per path and stream"
+    )
+    parser.add_argument(
+        "--rounds", type=int, default=20, help="Interleaved rounds the samples span"
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'stream':<18}{'fresh us':>10}{'envelope us':>13}{'pooled us':>11}"
+        f"{'fresh B':>9}{'envelope B':>12}{'pooled B':>10}"
+    )
+    for msg_type, msg in SAMPLE_MESSAGES.items():
+        mapping = TELEMETRY_REGISTRY[msg_type]
+        writer = EnvelopeWriter()
+        fresh = partial(encode_fresh, mapping)
+        envelope = partial(encode_envelope, mapping, writer)
+        pooled = TelemetryEncoder(mapping).encode
+
+        fresh_us, envelope_us, pooled_us = time_rounds(
+            (fresh, envelope, pooled), msg, args.samples, args.rounds
+        )
+        print(
+            f"{msg_type:<18}{fresh_us:>10.2f}{envelope_us:>13.2f}{pooled_us:>11.2f}"
+            f"{transient_bytes(fresh, msg):>9.0f}{transient_bytes(envelope, msg):>12.0f}"
+            f"{transient_bytes(pooled, msg):>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
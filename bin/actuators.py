@@ -0,0 +1,116 @@
+"""
+Actuator queryables: rudder, engine and thruster requests are routed through one dispatch table keyed on
+the full key expressions, built once when the queryables are declared, so a query costs a dict lookup
+instead of re-parsing its selector.
+"""
+
+import logging
+import time
+
+import keelson
+import zenoh
+
+from keelson.payloads.TimestampedFloat_pb2 import TimestampedFloat
+
+# Actuator kind: (procedure, control targets driven per responder side). Side * is the combined
+# request, taking both sides back, 0 is port or bow and 1 is starboard or stern
+ACTUATORS = {
+    "rudder": (
+        "set_rudder_angle_pct",
+        {
+            "*": ("rudder",),
+            "0": ("rudder_port",),
+            "1": ("rudder_starboard",),
+        },
+    ),
+    "engine": (
+        "set_engine_power_pct",
+        {
+            "*": ("throttle",),
+            "0": ("throttle_port",),
+            "1": ("throttle_starboard",),
+        },
+    ),
+    "thruster": (
+        "set_thruster_power_pct",
+        {
+            "*": ("thruster",),
+            "0": ("thruster_bow",),
+            "1": ("thruster_stern",),
+        },
+    ),
+}
+
+
+class ActuatorDispatcher:
+    """
+    Answers actuator queries by setting the control targets routed to their key expression and replying
+    with the setting actually applied, after mixing and clamping to the RC channel limits, as a
+    TimestampedFloat in percent.
+    """
+
+    def __init__(self, target, calibration):
+        """
+        :param target: Boat or AsyncConnector the control targets are set on
+        :param calibration: Calibration mapping the requested percentages to PWM values
+        """
+        self.__target = target
+        self.__calibration = calibration
+        self.__routes = {}
+
+    def add_route(self, key_expr, control_targets):
+        """
+        :param key_expr: Full key expression of the query, e.g. .../rpc/engine/0/set_engine_power_pct
+        :param control_targets: Names of the control targets a query on it sets
+        """
+        self.__routes[key_expr] = tuple(control_targets)
+
+    def handle(self, query):
+        """
+        Queryable callback, runs on Zenoh's threads.
+        """
+        key_expr = str(query.key_expr)
+        control_targets = self.__routes.get(key_expr)
+        if control_targets is None:
+            query.reply_err(f"No actuator at {key_expr}")
+            return
+
+        if query.value is None:
+            query.reply_err("Expected a TimestampedFloat in percent")
+            return
+
+        received_at, enclosed_at, content = keelson.uncover(query.value.payload)
+        requested = TimestampedFloat.FromString(content).value
+        logging.debug(">> [Queryable ACTUATOR] %s: %s %%", key_expr, requested)
+
+        setting = max(-100.0, min(100.0, requested))
+        to_pwm = self.__calibration.to_pwm
+        pwms = {name: to_pwm(name, setting) for name in control_targets}
+        applied = self.__target.set_controls(pwms)
+        if not applied:
+            # no RC channel for the targets, or not connected or RC override switched off
+            query.reply_err(f"Not applied to {', '.join(control_targets)}")
+            return
+
+        payload = TimestampedFloat()
+        payload.timestamp.FromNanoseconds(time.time_ns())
+        payload.value = self.__applied_setting(setting, pwms, applied)
+        query.reply(
+            zenoh.Sample(key_expr, keelson.enclose(payload.SerializeToString()))
+        )
+
+    def __applied_setting(self, setting, pwms, applied):
+        """
+        A channel limit cuts the setting short, the setting applied is the most limited of the targets.
+        :param setting: Requested setting in percent
+        :param pwms: Dict mapping control target name to the PWM value requested
+        :param applied: Dict mapping control target name to the PWM value applied
+        :return: Setting applied in percent
+        """
+        value = setting
+        for name, pwm in applied.items():
+            if pwm != pwms[name]:
+                limited = self.__calibration.to_percent(name, pwm, setting)
+                if abs(limited) < abs(value):
+                    value = limited
+        return value
@@ -0,0 +1,698 @@
+"""
+Asyncio runtime for the connector, an alternative to the threaded Boat and blocking main loop.
+
+Each MAVLink link is read through its non-blocking file descriptor registered with the event loop, Zenoh
+callbacks are bridged into the loop with call_soon_threadsafe, and telemetry publishing, control forwarding,
+RC override keep-alive and health reporting run as cooperative tasks. Several AsyncConnector instances can
+share one loop, so several links run in one process on one thread.
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import Future
+
+from pymavlink import mavutil
+
+from batching import flush_due
+from boat import (
+    COMMAND_CHECK_PERIOD,
+    LINK_SUPERVISION_PERIOD,
+    RECONNECT_INITIAL_BACKOFF,
+    REQUIRED_MESSAGES,
+    ControlAuthority,
+    LinkState,
+    RcAuthority,
+)
+from commands import CommandManager, CommandTimeout, result_name
+from dispatcher import message_id
+from framing import FrameParser
+from link_quality import LinkQualityMonitor, OutboundBackoff
+from log_utils import RateLimitedLog
+from mixer import PWM_MAX, PWM_MIN, Mixer
+from recording import open_connection
+from stream_rates import StreamRateManager
+from vehicle_state import VehicleState
+
+# repeated warnings of the control path, e.g. levers moved while the connector is down
+_limited_log = RateLimitedLog()
+
+
+class AsyncMavlinkLink:
+    """
+    A MAVLink connection read by the event loop whenever its file descriptor becomes readable. A read that
+    fails or returns nothing means the link is lost: the link stops reading and sets lost until reopened.
+    """
+
+    def __init__(self, connection_string, baud=115200, queue_size=1000, recorder=None):
+        """
+        :param connection_string: Connection string for MAVLink, e.g. /dev/ttyACM0 or udpin:0.0.0.0:14550
+        :param baud: Baud rate for serial links
+        :param queue_size: Max number of received messages buffered for the telemetry task, oldest dropped first
+        :param recorder: Optional recording.Recorder every chunk read from the link is written to
+        """
+        self.connection_string = connection_string
+        self.__baud = baud
+        self.__connection = open_connection(connection_string, baud=baud)
+        self.__closed = False
+        self.__recorder = recorder
+        self.__parser = FrameParser(self.__connection)
+        self.__messages = asyncio.Queue(maxsize=queue_size)
+        self.__loop = None
+        self.__fd = None
+        self.state = VehicleState()
+        self.heartbeat = asyncio.Event()
+        self.lost = asyncio.Event()
+        self.received = 0
+        self.dropped = 0
+
+    @property
+    def connection(self):
+        return self.__connection
+
+    @property
+    def queue_depth(self):
+        return self.__messages.qsize()
+
+    def set_message_filter(self, msg_ids):
+        """
+        Only decode the given message IDs, plus the ones the connector relies on.
+        :param msg_ids: Iterable of MAVLink message IDs, None decodes every message
+        """
+        if msg_ids is not None:
+            msg_ids = set(msg_ids).union(
+                message_id(msg_type) for msg_type in REQUIRED_MESSAGES
+            )
+        self.__parser.msg_ids = msg_ids
+
+    def skipped_message_ids(self, src_system=None):
+        """
+        :param src_system: Only report the frames of this MAVLink system ID
+        :return: The message IDs of the frames skipped by the message filter and not forwarded raw so far
+        """
+        return self.__parser.skipped_message_ids(src_system)
+
+    def set_raw_forwarder(self, forwarder):
+        """
+        Hand the valid frames of the message IDs a forwarder wants to it untouched, as in MavlinkIO.
+        :param forwarder: passthrough.RawFramePublisher, None stops forwarding
+        """
+        self.__parser.raw_forwarder = forwarder
+
+    def frame_stats(self):
+        """
+        :return: Dict with the number of decoded, skipped and malformed frames
+        """
+        return {
+            "decoded": self.__parser.decoded,
+            "skipped": self.__parser.skipped,
+            "errors": self.__parser.errors,
+        }
+
+    def sequence_stats(self):
+        """
+        :return: Dict mapping (system ID, component ID) to a dict with the received and lost frames and bytes
+        """
+        return self.__parser.sequence_stats()
+
+    def open(self):
+        """
+        Start reading the link on the running event loop.
+        """
+        if self.__connection.fd is None:
+            raise RuntimeError(
+                f"{self.connection_string} has no file descriptor the event loop can watch"
+            )
+        self.__loop = asyncio.get_running_loop()
+        self.__fd = self.__connection.fd
+        self.__loop.add_reader(self.__fd, self.__on_readable)
+
+    def close(self):
+        self.__stop_reading()
+        if not self.__closed:
+            self.__closed = True
+            self.__connection.close()
+
+    def reopen(self):
+        """
+        Close the lost connection and open it again, the message filter, raw forwarder, queued messages and
+        vehicle state are kept. The frame counters start over with the new connection.
+        """
+        self.close()
+        connection = open_connection(self.connection_string, baud=self.__baud)
+        parser = FrameParser(connection)
+        parser.msg_ids = self.__parser.msg_ids
+        parser.raw_forwarder = self.__parser.raw_forwarder
+        self.__connection = connection
+        self.__closed = False
+        self.__parser = parser
+        try:
+            self.open()
+        except Exception:
+            self.close()
+            raise
+        self.lost.clear()
+
+    def __stop_reading(self):
+        if self.__loop is not None:
+            self.__loop.remove_reader(self.__fd)
+            self.__loop = None
+
+    async def get_message(self):
+        """
+        :return: The next received MAVLink message
+        """
+        return await self.__messages.get()
+
+    def get_message_nowait(self):
+        """
+        :return: The next received MAVLink message or None if none is queued
+        """
+        try:
+            return self.__messages.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+
+    def __on_readable(self):
+        connection = self.__connection
+        try:
+            data = connection.recv(4096)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.error("Error reading from %s: %s", self.connection_string, e)
+            data = None
+
+        if not data:
+            # readable but nothing to read: the device went away or the peer closed the connection, stop
+            # watching the descriptor or the loop spins on it
+            self.__stop_reading()
+            self.lost.set()
+            return
+
+        if self.__recorder is not None:
+            self.__recorder.write(data)
+        for msg in self.__parser.parse(data):
+            self.state.update(msg)
+            self.received += 1
+            if msg.get_type() == "HEARTBEAT":
+                self.heartbeat.set()
+
+            if self.__messages.full():
+                self.__messages.get_nowait()
+                self.dropped += 1
+            self.__messages.put_nowait(msg)
+
+
+class AsyncConnector:
+    """
+    Runs telemetry, control, keep-alive and health tasks for one MAVLink link on the event loop.
+    Offers the same set_rudder/set_throttle/set_controls interface as Boat, callable from any thread.
+    """
+
+    def __init__(
+        self,
+        connection_string,
+        baud=115200,
+        max_override_rate_hz=50.0,
+        keep_alive_period=0.5,
+        health_period=10.0,
+        heartbeat_timeout=3.0,
+        max_reconnect_backoff=10.0,
+        stream_rates=None,
+        disable_unused_streams=False,
+        mixer_config=None,
+        link_health_period=1.0,
+        recorder=None,
+    ):
+        """
+        :param connection_string: Connection string for MAVLink
+        :param baud: Baud rate for serial links
+        :param max_override_rate_hz: Max rate at which coalesced rudder/throttle updates are sent as RC overrides
+        :param keep_alive_period: Seconds between re-sends of the current RC override
+        :param health_period: Seconds between health reports
+        :param heartbeat_timeout: Seconds without heartbeat before the link is reported stale
+        :param max_reconnect_backoff: Max seconds between attempts to reopen a lost link, the wait doubles
+            from half a second after every failed attempt
+        :param stream_rates: Optional dict mapping MAVLink message name to the rate in Hz requested from the
+            autopilot, checked at every health report
+        :param disable_unused_streams: Also switch off the streams the message filter skips
+        :param mixer_config: Dict of Mixer arguments mixing the control targets into RC channels, as in Boat
+        :param link_health_period: Seconds between link health samples passed to the link health listeners
+        :param recorder: Optional recording.Recorder the raw MAVLink stream is recorded to
+        """
+        self.__connection_string = connection_string
+        self.__baud = baud
+        self.__keep_alive_period = keep_alive_period
+        self.__health_period = health_period
+        self.__heartbeat_timeout = heartbeat_timeout
+        self.__max_reconnect_backoff = max_reconnect_backoff
+        self.__link = None
+        self.__rc_authority = None
+        self.__loop = None
+        self.__mixer = Mixer(
+            **(mixer_config or {}), tick_interval=1.0 / max_override_rate_hz
+        )
+        self.__targets_changed = None
+        self.__override_active = False
+        self.__stream_rates = (
+            StreamRateManager(self.__request_message_interval, stream_rates)
+            if stream_rates
+            else None
+        )
+        self.__disable_unused_streams = disable_unused_streams
+        self.__command_timeout = 1.0
+        self.__commands = CommandManager(
+            self.__send_command_long, self.__command_timeout
+        )
+        self.__link_quality = LinkQualityMonitor()
+        self.__outbound = OutboundBackoff(
+            self.__link_quality,
+            max_override_rate_hz,
+            self.__commands,
+            self.__command_timeout,
+        )
+        self.__link_health_period = link_health_period
+        self.__link_health_listeners = []
+        self.__link_state = LinkState.CONNECTING
+        self.__link_state_listeners = []
+        self.__recorder = recorder
+        self.__raw_forwarder = None
+
+    @property
+    def link(self):
+        return self.__link
+
+    def link_stats(self):
+        """
+        Counters of the MAVLink link, as Boat.link_stats(). Sends are written directly, so nothing is
+        queued or dropped outbound.
+        :return: Dict with the frame counts, the received and lost frames per source, the dropped messages
+            and the current queue depths, None while not running
+        """
+        link = self.__link
+        if link is None:
+            return None
+        return {
+            "frames": link.frame_stats(),
+            "sequence": link.sequence_stats(),
+            "dropped": {"inbound": link.dropped, "outbound": 0},
+            "queued": {"inbound": link.queue_depth, "outbound": 0},
+        }
+
+    def set_raw_forwarder(self, forwarder):
+        """
+        Forward the untouched frames of the message IDs the forwarder wants, as in Boat. Set before run().
+        :param forwarder: passthrough.RawFramePublisher, None stops forwarding
+        """
+        self.__raw_forwarder = forwarder
+        if self.__link is not None:
+            self.__link.set_raw_forwarder(forwarder)
+
+    def add_link_health_listener(self, listener):
+        """
+        Register a callable invoked with every link health sample, as in Boat. Called on the event loop.
+        """
+        self.__link_health_listeners.append(listener)
+
+    @property
+    def link_state(self):
+        return self.__link_state
+
+    def add_link_state_listener(self, listener):
+        """
+        Register a callable invoked with the new LinkState whenever the link is lost or restored, as in Boat.
+        Called on the event loop.
+        """
+        self.__link_state_listeners.append(listener)
+
+    def submit_command(self, command, *params):
+        """
+        Send a COMMAND_LONG from any thread without waiting for the vehicle to acknowledge it, as
+        Boat.send_command.
+        :param command: MAV_CMD ID, e.g. mavutil.mavlink.MAV_CMD_DO_SET_RELAY
+        :param params: Up to 7 command parameters, missing ones are sent as 0
+        :return: Future resolving to the MAV_RESULT of the COMMAND_ACK or failing with CommandTimeout, or with
+            ConnectionError while the link is lost or the connector not running
+        """
+        loop = self.__loop
+        if loop is None:
+            future = Future()
+            future.set_exception(ConnectionError("connector not running"))
+            return future
+        return asyncio.run_coroutine_threadsafe(
+            self.send_command(command, *params), loop
+        )
+
+    def enable_propulsion(self):
+        """
+        Switch on the power to the motors through the relay, thread-safe.
+        :return: Future resolving to the MAV_RESULT of the COMMAND_ACK
+        """
+        logging.info("ENABLING PROPULSION")
+        return self.submit_command(mavutil.mavlink.MAV_CMD_DO_SET_RELAY, 1, 1)
+
+    def disable_propulsion(self):
+        """
+        Switch off the power to the motors through the relay, thread-safe.
+        :return: Future resolving to the MAV_RESULT of the COMMAND_ACK
+        """
+        logging.info("DISABLING PROPULSION")
+        return self.submit_command(mavutil.mavlink.MAV_CMD_DO_SET_RELAY, 1, 0)
+
+    def set_rudder(self, steering_value):
+        """
+        Set the rudder PWM target, thread-safe.
+        :param steering_value: The PWM value for the steering channel, 1100-1900
+        """
+        self.set_controls({"rudder": steering_value})
+
+    def set_throttle(self, throttle_value):
+        """
+        Set the throttle PWM target, thread-safe.
+        :param throttle_value: The PWM value for the throttle channels, 1100-1900
+        """
+        self.set_controls({"throttle": throttle_value})
+
+    def set_controls(self, targets):
+        """
+        Set several control targets at once, thread-safe.
+        :param targets: Dict mapping control target name, e.g. "throttle_port", to a PWM value within 1100-1900.
+            Setting a combined target (rudder, throttle, thruster) hands its per-side targets back to it
+        :return: Dict mapping the targets applied to the PWM value they drive their RC channels with after
+            mixing and clamping, targets the mixer does not use and invalid values are left out
+        """
+        applied = {}
+        for key, value in targets.items():
+            if not self.__mixer.uses(key):
+                continue
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                _limited_log.warning(
+                    ("invalid", key), "Invalid %s value: %s", key, value
+                )
+                continue
+
+            if not PWM_MIN <= value <= PWM_MAX:
+                _limited_log.warning(
+                    ("out-of-range", key),
+                    "Ignoring out of range %s value: %s",
+                    key,
+                    value,
+                )
+                continue
+            applied[key] = value
+
+        if not applied:
+            return applied
+
+        if self.__loop is None:
+            _limited_log.warning(
+                "not-running", "Connector not running, dropped %s", ", ".join(applied)
+            )
+            return {}
+
+        # Zenoh callbacks run on Zenoh's threads, hand the values over to the loop
+        self.__loop.call_soon_threadsafe(
+            self.__set_targets, self.__mixer.expand(applied)
+        )
+        return self.__mixer.applied(applied)
+
+    def __set_targets(self, targets):
+        self.__mixer.set_inputs(targets)
+        self.__targets_changed.set()
+
+    def __should_allow_rc_override(self):
+        return self.__rc_authority.allows_override()
+
+    def __send(self, send_name, *args):
+        """
+        Write a message to the link, dropped while the link is lost.
+        :param send_name: Name of the send method of the connection's MAVLink object, e.g. command_long_send
+        :param args: Arguments after the target system and component
+        """
+        link = self.__link
+        if link.lost.is_set():
+            _limited_log.warning("link-lost", "Link lost, dropped %s", send_name)
+            return
+
+        connection = link.connection
+        try:
+            getattr(connection.mav, send_name)(
+                connection.target_system, connection.target_component, *args
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.error("Error writing to MAVLink connection: %s", e)
+
+    def __send_override(self):
+        self.__send("rc_channels_override_send", *self.__mixer.mix())
+        self.__override_active = True
+
+    def __send_command_long(self, command, confirmation, *params):
+        self.__send("command_long_send", command, confirmation, *params)
+
+    def __request_message_interval(self, msg_id, interval_us):
+        self.__send_command_long(
+            mavutil.mavlink.MAV_CMD_SET_MESSAGE_INTERVAL,
+            0,
+            msg_id,
+            interval_us,
+            0,
+            0,
+            0,
+            0,
+            0,
+        )
+
+    async def send_command(self, command, *params):
+        """
+        Send a COMMAND_LONG from the event loop and wait for the vehicle to acknowledge it.
+        :param command: MAV_CMD ID, e.g. mavutil.mavlink.MAV_CMD_DO_SET_RELAY
+        :param params: Up to 7 command parameters, missing ones are sent as 0
+        :return: The MAV_RESULT of the COMMAND_ACK, raises CommandTimeout if none arrived and ConnectionError
+            right away while the link is lost
+        """
+        if self.__link.lost.is_set():
+            raise ConnectionError("link lost")
+        return await asyncio.wrap_future(self.__commands.submit(command, *params))
+
+    async def run(self, dispatcher, batches=()):
+        """
+        Open the link and run all tasks until cancelled.
+        :param dispatcher: MessageDispatcher with the telemetry handlers
+        :param batches: Telemetry batches to flush when due
+        """
+        self.__loop = asyncio.get_running_loop()
+        self.__targets_changed = asyncio.Event()
+        self.__link = AsyncMavlinkLink(
+            self.__connection_string, self.__baud, recorder=self.__recorder
+        )
+        self.__link.set_message_filter(dispatcher.message_ids)
+        self.__link.set_raw_forwarder(self.__raw_forwarder)
+        # the same authority as Boat starts with, the RC mode switch is only polled while it is undefined
+        self.__rc_authority = RcAuthority(self.__link.state, ControlAuthority.REMOTE)
+        self.__link.open()
+        logging.info("Connected to vehicle on %s", self.__connection_string)
+
+        try:
+            await asyncio.gather(
+                self.__telemetry(dispatcher, list(batches)),
+                self.__control(),
+                self.__keep_alive(),
+                self.__health(),
+                self.__link_health(),
+                self.__command_retries(),
+                self.__reconnect(),
+                self.__supervise_link(),
+                self.__arm_on_first_heartbeat(),
+            )
+        finally:
+            self.__commands.cancel_all()
+            self.__loop = None
+            self.__link.close()
+
+    async def __arm_on_first_heartbeat(self):
+        await self.__link.heartbeat.wait()
+        logging.info("Heartbeat received from %s", self.__connection_string)
+
+        if self.__stream_rates is not None:
+            self.__stream_rates.apply()
+
+        if not self.__link.state.armed:
+            logging.info("Arming vehicle")
+            try:
+                result = await self.send_command(
+                    mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM, 1
+                )
+            except (CommandTimeout, ConnectionError) as e:
+                logging.error("Arming failed: %s", e)
+                return
+            if result == mavutil.mavlink.MAV_RESULT_ACCEPTED:
+                logging.info("Vehicle armed")
+            else:
+                logging.error("Arming rejected: %s", result_name(result))
+
+    async def __reconnect(self):
+        """
+        Reopen the link whenever it is lost, with exponential backoff while it keeps failing. The backoff starts
+        over once a heartbeat arrived on a reopened link.
+        """
+        link = self.__link
+        backoff = RECONNECT_INITIAL_BACKOFF
+        opened_at = time.monotonic()
+        while True:
+            await link.lost.wait()
+            last_heartbeat = link.state.last_seen("HEARTBEAT")
+            if last_heartbeat is not None and last_heartbeat > opened_at:
+                backoff = RECONNECT_INITIAL_BACKOFF
+            logging.warning("Link %s lost, reconnecting", link.connection_string)
+
+            while link.lost.is_set():
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.__max_reconnect_backoff)
+                try:
+                    link.reopen()
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    logging.warning("Reconnect failed: %s", e)
+
+            opened_at = time.monotonic()
+            logging.info("Reconnected to vehicle on %s", link.connection_string)
+
+    async def __supervise_link(self):
+        """
+        Report the link lost when its heartbeat times out or the connection is lost, and restored once the
+        heartbeat is back.
+        """
+        link = self.__link
+        while True:
+            await asyncio.sleep(LINK_SUPERVISION_PERIOD)
+            heartbeat_age = link.state.age("HEARTBEAT")
+            heartbeat_ok = (
+                not link.lost.is_set()
+                and heartbeat_age is not None
+                and heartbeat_age <= self.__heartbeat_timeout
+            )
+            if heartbeat_ok and self.__link_state != LinkState.CONNECTED:
+                logging.info("Link up, heartbeat received")
+                self.__set_link_state(LinkState.CONNECTED)
+            elif not heartbeat_ok and self.__link_state == LinkState.CONNECTED:
+                logging.warning(
+                    "Link lost, no heartbeat for %s s", self.__heartbeat_timeout
+                )
+                self.__set_link_state(LinkState.LOST)
+
+    def __set_link_state(self, link_state):
+        self.__link_state = link_state
+        for listener in self.__link_state_listeners:
+            try:
+                listener(link_state)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.error("Error in link state listener: %s", e)
+
+    async def __command_retries(self):
+        while True:
+            await asyncio.sleep(COMMAND_CHECK_PERIOD)
+            self.__commands.check_timeouts()
+
+    async def __telemetry(self, dispatcher, batches):
+        link = self.__link
+        dispatch = dispatcher.dispatch
+        handle_ack = self.__commands.handle_ack
+        observe = (
+            self.__stream_rates.observe if self.__stream_rates is not None else None
+        )
+        command_ack = mavutil.mavlink.MAVLINK_MSG_ID_COMMAND_ACK
+        radio_status = mavutil.mavlink.MAVLINK_MSG_ID_RADIO_STATUS
+
+        def handle(msg):
+            if observe is not None:
+                observe(msg)
+            msg_id = msg.get_msgId()
+            if msg_id == command_ack:
+                handle_ack(msg)
+            elif msg_id == radio_status:
+                self.__link_quality.observe_radio(msg)
+                self.__outbound.apply()
+            return dispatch(msg)
+
+        while True:
+            timeout = flush_due(batches)
+            if timeout is None:
+                msg = await link.get_message()
+            else:
+                try:
+                    msg = await asyncio.wait_for(link.get_message(), timeout)
+                except asyncio.TimeoutError:
+                    continue
+
+            handle(msg)
+            # Drain whatever else arrived in the same read without yielding per message
+            while (msg := link.get_message_nowait()) is not None:
+                handle(msg)
+
+    async def __control(self):
+        await self.__link.heartbeat.wait()
+        last_sent = 0.0
+        while True:
+            await self.__targets_changed.wait()
+
+            # Coalesce: updates arriving within the min interval are merged into one frame
+            remaining = (
+                last_sent + self.__outbound.min_override_interval - self.__loop.time()
+            )
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+
+            self.__targets_changed.clear()
+            if self.__should_allow_rc_override():
+                self.__send_override()
+                last_sent = self.__loop.time()
+                if not self.__mixer.settled:
+                    # Slew rate limited channels still moving, tick again
+                    self.__targets_changed.set()
+
+    async def __keep_alive(self):
+        deadline = self.__loop.time() + self.__keep_alive_period
+        while True:
+            await asyncio.sleep(max(0.0, deadline - self.__loop.time()))
+            deadline += self.__keep_alive_period
+            now = self.__loop.time()
+            if deadline < now:
+                # The loop stalled for more than a period, skip the missed keep-alives rather than bursting
+                deadline = now + self.__keep_alive_period
+
+            if self.__override_active and self.__should_allow_rc_override():
+                self.__send_override()
+
+    async def __link_health(self):
+        while True:
+            await asyncio.sleep(self.__link_health_period)
+            health = self.__link_quality.sample(self.link_stats())
+            self.__outbound.apply()
+            for listener in self.__link_health_listeners:
+                try:
+                    listener(health)
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    logging.error("Error in link health listener: %s", e)
+
+    async def __health(self):
+        while True:
+            await asyncio.sleep(self.__health_period)
+            link = self.__link
+            heartbeat_age = link.state.age("HEARTBEAT")
+            logging.info(
+                "Link %s: received %d, dropped %d, queued %d, heartbeat age %s",
+                link.connection_string,
+                link.received,
+                link.dropped,
+                link.queue_depth,
+                "never" if heartbeat_age is None else f"{heartbeat_age:.1f} s",
+            )
+            if heartbeat_age is None or heartbeat_age > self.__heartbeat_timeout:
+                logging.warning("No recent heartbeat on %s", link.connection_string)
+
+            if self.__stream_rates is not None:
+                self.__stream_rates.verify()
+                if self.__disable_unused_streams:
+                    self.__stream_rates.disable(
+                        link.skipped_message_ids(link.connection.target_system)
+                    )
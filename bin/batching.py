@@ -0,0 +1,134 @@
+"""
+Optional batching of telemetry samples into one Zenoh sample per flush window.
+
+A batch is published on its own subject, the stream's subject with a _batch suffix, e.g.
+flight_controller_telemetry_rawimu_batch, so subscribers of the per-sample subject never receive it.
+It is a regular Keelson envelope whose payload is a protobuf message
+
+    message EnvelopeBatch {
+        repeated bytes envelopes = 1;  // the serialized per-sample Keelson envelopes, oldest first
+    }
+
+so every sample keeps its own enclosed_at timestamp. Any protobuf implementation decodes it with that
+schema, or use unpack_batch.
+"""
+
+import time
+
+import keelson
+
+BATCH_SUBJECT_SUFFIX = "_batch"
+
+# key of EnvelopeBatch.envelopes: field number 1, wire type 2 (length-delimited)
+_ENVELOPES_TAG = b"\x0a"
+
+
+def _encode_varint(value):
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def batch_subject(subject):
+    """
+    :param subject: Subject of the per-sample stream, e.g. flight_controller_telemetry_rawimu
+    :return: The subject its batches are published on
+    """
+    return subject + BATCH_SUBJECT_SUFFIX
+
+
+def unpack_batch(payload):
+    """
+    Split the EnvelopeBatch payload of a batch envelope into the per-sample envelopes.
+    :param payload: The payload of the uncovered batch envelope
+    :return: List of serialized per-sample Keelson envelopes
+    """
+    envelopes = []
+    offset = 0
+    while offset < len(payload):
+        if payload[offset : offset + 1] != _ENVELOPES_TAG:
+            raise ValueError(f"Not an EnvelopeBatch, unexpected key at byte {offset}")
+        offset += 1
+        size = 0
+        shift = 0
+        while True:
+            byte = payload[offset]
+            offset += 1
+            size |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        envelopes.append(payload[offset : offset + size])
+        offset += size
+
+    return envelopes
+
+
+class TelemetryBatch:
+    """
+    Accumulates the envelopes of one stream and publishes them together when either the batch is full
+    or the oldest sample has waited for the flush window.
+    """
+
+    def __init__(self, publisher, max_count=50, window=0.1):
+        """
+        :param publisher: Zenoh publisher on the stream's batch subject
+        :param max_count: Flush once this many samples are pending
+        :param window: Flush once the oldest pending sample is this many seconds old
+        """
+        self.__publisher = publisher
+        self.__max_count = max_count
+        self.__window = window
+        self.__parts = []
+        self.__count = 0
+        self.deadline = None
+
+    def add(self, envelope, now=None):
+        """
+        :param envelope: Serialized per-sample Keelson envelope
+        :param now: time.monotonic() of the sample, taken now if not given
+        """
+        if self.deadline is None:
+            self.deadline = (time.monotonic() if now is None else now) + self.__window
+
+        self.__parts.append(_ENVELOPES_TAG + _encode_varint(len(envelope)))
+        self.__parts.append(envelope)
+        self.__count += 1
+
+        if self.__count >= self.__max_count:
+            self.flush()
+
+    def flush(self):
+        """
+        Publish the pending samples, if any, as one envelope holding an EnvelopeBatch.
+        """
+        if not self.__count:
+            return
+
+        self.__publisher.put(keelson.enclose(b"".join(self.__parts)))
+        self.__parts = []
+        self.__count = 0
+        self.deadline = None
+
+
+def flush_due(batches, now=None):
+    """
+    Flush every batch whose window has expired.
+    :param batches: Iterable of TelemetryBatch
+    :param now: time.monotonic(), taken now if not given
+    :return: Seconds until the next pending batch is due, None if no batch has pending samples
+    """
+    now = time.monotonic() if now is None else now
+    next_deadline = None
+    for batch in batches:
+        if batch.deadline is not None and batch.deadline <= now:
+            batch.flush()
+        if batch.deadline is not None and (
+            next_deadline is None or batch.deadline < next_deadline
+        ):
+            next_deadline = batch.deadline
+
+    return None if next_deadline is None else max(0.0, next_deadline - now)
@@ -1,7 +1,34 @@
+import logging
+import threading
 import time
+from concurrent.futures import CancelledError, Future
 from pymavlink import mavutil
 from enum import Enum
 
+from mavlink_io import MavlinkIO
+from vehicle_state import VehicleState, STATE_MESSAGES
+from dispatcher import message_id
+from stream_rates import StreamRateManager
+from coalescer import LatestValueCoalescer
+from scheduler import PeriodicTask
+from commands import CommandManager, CommandTimeout, result_name
+from mixer import Mixer, PWM_MIN, PWM_MAX
+from log_utils import RateLimitedLog
+from link_quality import LinkQualityMonitor, OutboundBackoff
+from recording import open_connection
+
+
+# Message types the boat itself relies on, links filtering by message ID must keep decoding these
+REQUIRED_MESSAGES = STATE_MESSAGES + ('COMMAND_ACK', 'RADIO_STATUS')
+
+LINK_SUPERVISION_PERIOD = 0.5
+RECONNECT_INITIAL_BACKOFF = 0.5
+HEARTBEAT_GRACE = 2.0  # autopilots send heartbeats at 1 Hz
+COMMAND_CHECK_PERIOD = 0.1
+
+# repeated warnings of the control path, e.g. levers moved while RC override is off
+_limited_log = RateLimitedLog()
+
 
 class Status(Enum):
     UNDEFINED = -1
@@ -17,95 +44,376 @@ class ControlAuthority(Enum):
     AUTOMATIC = 2
 
 
+class LinkState(Enum):
+    CONNECTING = 0
+    CONNECTED = 1
+    LOST = 2
+
+
+class RcAuthority:
+    """
+    Decides whether RC overrides may be sent, shared by Boat and the asyncio runtime. Any control authority but
+    MANUAL allows them, the RC mode switch on channel 11 is only consulted while the authority is UNDEFINED or
+    when polled explicitly.
+    """
+
+    def __init__(self, state, authority=ControlAuthority.UNDEFINED):
+        """
+        :param state: VehicleState holding the last RC_CHANNELS
+        :param authority: Initial ControlAuthority
+        """
+        self.__state = state
+        self.authority = authority
+
+    def allows_override(self):
+        """
+        Returns true if we should allow override, i.e. any mode above 0 in our currently defined modes
+        """
+        if self.authority == ControlAuthority.UNDEFINED:
+            self.poll()
+
+        return self.authority.value != 0
+
+    def poll(self):
+        """
+        Poll the state of RC channel 11 from the cached vehicle state
+        """
+        if self.__state.last_seen('RC_CHANNELS') is None:
+            return
+
+        rc_channel_11_value = self.__state.rc_channel(11)
+        if rc_channel_11_value is None:
+            _limited_log.warning('rc-channel-11', "RC Channel 11 value not available in the message.")
+            return
+
+        logging.debug("RC Channel 11 value: %s", rc_channel_11_value)
+        if rc_channel_11_value > 1500 and self.authority != ControlAuthority.REMOTE:
+            self.authority = ControlAuthority.REMOTE
+            logging.info("CONTROL AUTHORITY UPDATED TO REMOTE")
+        elif rc_channel_11_value < 1500 and self.authority != ControlAuthority.MANUAL:
+            self.authority = ControlAuthority.MANUAL
+            logging.info("CONTROL AUTHORITY UPDATED TO MANUAL")
+
+
 class Boat:
-    def __init__(self, connection_string, baud):
+    def __init__(self, connection_string, baud, max_override_rate_hz=50.0, keep_alive_period=0.5,
+                 io=None, target=None, state=None, heartbeat_timeout=3.0, max_reconnect_backoff=10.0,
+                 command_timeout=1.0, command_retries=2, mixer_config=None, link_health_period=1.0,
+                 recorder=None):
         """
         Initialize the boat model with a MAVLink connection.
         :param connection_string: Connection string for MAVLink
+        :param max_override_rate_hz: Max rate at which coalesced rudder/throttle updates are sent as RC overrides
+        :param keep_alive_period: Seconds between re-sends of the current RC override, must stay below RC_OVERRIDE_TIME
+        :param io: Started MavlinkIO of a link shared with other vehicles, the boat then neither opens nor closes
+            the connection and whoever owns the link passes the vehicle's messages to observe()
+        :param target: (system ID, component ID) commands are sent to, taken from the connection if not given
+        :param state: VehicleState to use, e.g. one already holding the vehicle's first heartbeat
+        :param heartbeat_timeout: Seconds without heartbeat after which the link is considered lost and, unless
+            shared, reopened
+        :param max_reconnect_backoff: Max seconds between attempts to reopen a lost link, the wait doubles
+            from half a second after every failed attempt
+        :param command_timeout: Seconds to wait for the COMMAND_ACK of a command before sending it again
+        :param command_retries: Number of times a command is sent again before it is reported as timed out
+        :param mixer_config: Dict of Mixer arguments (matrix, slew_rates, limits) mixing the control targets into
+            RC channels, e.g. from mixer.load_mixer_config(), rudder on 1 and port/starboard throttle on 2/3 if not given
+        :param link_health_period: Seconds between link health samples passed to the link health listeners
+        :param recorder: Optional recording.Recorder the raw MAVLink stream is recorded to, kept across reconnects
         """
         self.__connection_string = connection_string
         self.__baud = baud
-        self.__vehicle = None
+        self.__recorder = recorder
+        self.__message_filter = None
+        self.__raw_forwarder = None
+        self.__vehicle = io.connection if io is not None else None
+        self.__io = io
+        self.__owns_io = io is None
+        # guards swapping the link, sends are dropped while no link is open
+        self.__link_lock = threading.Lock()
+        self.__link_open = io is not None
+        self.__target = target
+        # on a shared link only our own vehicle's heartbeats count
+        self.__heartbeat_source = target[0] if target is not None else None
+        self.__state = state if state is not None else VehicleState(self.__heartbeat_source)
+        self.__control_coalescer = LatestValueCoalescer(self.__flush_control, max_override_rate_hz)
+        self.__keep_alive = PeriodicTask(self.__keep_alive_tick, keep_alive_period, name="rc-override-keep-alive")
+        self.__stream_rates = None
+        self.__stream_rate_check = None
+        self.__stream_rate_report = None
+        self.__disable_unused_streams = False
+        self.__override_active = False
+        self.__heartbeat_timeout = heartbeat_timeout
+        self.__max_reconnect_backoff = max_reconnect_backoff
+        self.__reconnect_backoff = RECONNECT_INITIAL_BACKOFF
+        # the first reconnect attempt waits until the initial connection had its chance
+        self.__next_reconnect = time.monotonic() + heartbeat_timeout
+        self.__link_state = LinkState.CONNECTING
+        self.__link_state_listeners = []
+        self.__supervisor = PeriodicTask(self.__supervise_link, LINK_SUPERVISION_PERIOD, name="link-supervisor")
+        self.__commands = CommandManager(self.__send_command_long, command_timeout, command_retries)
+        self.__command_check = PeriodicTask(self.__commands.check_timeouts, COMMAND_CHECK_PERIOD, name="command-retry")
         self.__connected = False
         self.__heartbeat_received = False
         # self.__allow_rc_override = True ## temporarily disabled as we're using the controlauthority instead
         self.__confirm_commands = False
-        self.__current_rudder_value = 1500  # center point for rc joysticks
-        self.__current_throttle_value = 1500  # center point for rc joysticks
+        self.__mixer = Mixer(**(mixer_config or {}), tick_interval=1.0 / max_override_rate_hz)
+        self.__last_override_sent = 0.0
+        self.__link_quality = LinkQualityMonitor()
+        self.__outbound = OutboundBackoff(self.__link_quality, max_override_rate_hz, self.__commands, command_timeout,
+                                          self.__control_coalescer)
+        self.__link_health_listeners = []
+        self.__link_health = PeriodicTask(self.__sample_link_health, link_health_period, name="link-health")
+        # keeps ticking while slew rate limited channels move towards their targets
+        self.__slew = PeriodicTask(self.__slew_tick, 1.0 / max_override_rate_hz, name="control-slew") \
+            if mixer_config and mixer_config.get('slew_rates') else None
         self.__last_command_sent = None
         self.__mode_switch = None
+        self.__rc_authority = RcAuthority(self.__state)
 
         self.__connect()
 
-        # we could make this more verbose
-        self.__status: Status = Status.ARMED if self.is_armed() else Status.UNDEFINED
+        if self.__state.last_seen('HEARTBEAT') is not None:
+            self.__heartbeat_received = True
+            self.__connected = True
 
-        self.__control_authority: ControlAuthority
+        # we could make this more verbose
+        # armed and flight mode are unknown until the first heartbeat, which wait_for_heartbeat() waits for
+        self.__status: Status = Status.ARMED if self.__heartbeat_received and self.is_armed() else Status.UNDEFINED
 
-        current_flight_mode = self.get_flight_mode()  # this didnt return the correct info from the heartbeat, it's not updated
+        if self.__heartbeat_received:
+            current_flight_mode = self.get_flight_mode()  # this didnt return the correct info from the heartbeat, it's not updated
 
-        # we could use switch here, but then we lock ourselves to python 3.10+
-        if current_flight_mode == 0:
-            self.__control_authority = ControlAuthority.MANUAL
+            # we could use switch here, but then we lock ourselves to python 3.10+
+            if current_flight_mode == 0:
+                self.__rc_authority.authority = ControlAuthority.MANUAL
 
-        elif current_flight_mode == 1:
-            self.__control_authority = ControlAuthority.REMOTE
+            elif current_flight_mode == 1:
+                self.__rc_authority.authority = ControlAuthority.REMOTE
 
-        elif current_flight_mode == 2:
-            self.__control_authority = ControlAuthority.AUTOMATIC
+            elif current_flight_mode == 2:
+                self.__rc_authority.authority = ControlAuthority.AUTOMATIC
 
-        else:
-            self.__control_authority = ControlAuthority.UNDEFINED
+            else:
+                self.__rc_authority.authority = ControlAuthority.UNDEFINED
 
-        self.__control_authority = ControlAuthority.REMOTE
+        self.__rc_authority.authority = ControlAuthority.REMOTE
 
     def get_vehicle(self):
         return self.__vehicle
 
-    def __should_allow_rc_override(self):
+    @property
+    def target_system(self):
+        return self.__target[0] if self.__target else self.__vehicle.target_system
+
+    @property
+    def target_component(self):
+        return self.__target[1] if self.__target else self.__vehicle.target_component
+
+    def get_message(self, timeout=0):
         """
-        Returns true if we should allow override, i.e. any mode above 0 in our currently defined modes
+        Take the next message received by the reader thread.
+        :param timeout: Seconds to wait for a message, 0 returns immediately and None waits forever
+        :return: The next MAVLink message or None if nothing arrived in time
+        """
+        return self.__io.get_message(timeout)
+
+    def set_message_filter(self, msg_ids):
+        """
+        Only decode the given message IDs on the link, plus the ones the boat itself relies on.
+        On a link shared with other vehicles the owner of the link sets the filter instead.
+        :param msg_ids: Iterable of MAVLink message IDs, None decodes every message
+        """
+        if msg_ids is not None:
+            msg_ids = set(msg_ids).union(message_id(msg_type) for msg_type in REQUIRED_MESSAGES)
+        with self.__link_lock:
+            self.__message_filter = msg_ids
+            self.__io.set_message_filter(msg_ids)
+
+    def set_raw_forwarder(self, forwarder):
+        """
+        Forward the untouched frames of the message IDs the forwarder wants, kept across reconnects.
+        On a link shared with other vehicles the owner of the link sets the forwarder instead.
+        :param forwarder: passthrough.RawFramePublisher, None stops forwarding
         """
+        with self.__link_lock:
+            self.__raw_forwarder = forwarder
+            self.__io.set_raw_forwarder(forwarder)
 
-        if self.__control_authority == ControlAuthority.UNDEFINED:
-            self.__poll_rc_mode_switch()
+    def observe(self, msg):
+        """
+        Fold a received message of this vehicle into the boat's state, runs on the reader thread.
+        :param msg: Decoded MAVLink message
+        """
+        self.__state.update(msg)
+        if self.__stream_rates is not None:
+            self.__stream_rates.observe(msg)
+        msg_id = msg.get_msgId()
+        if msg_id == mavutil.mavlink.MAVLINK_MSG_ID_COMMAND_ACK:
+            self.__commands.handle_ack(msg)
+        elif msg_id == mavutil.mavlink.MAVLINK_MSG_ID_RADIO_STATUS:
+            self.__link_quality.observe_radio(msg)
+            self.__outbound.apply()
+
+    def set_stream_rates(self, rates, disable_unused=False, verify_period=5.0):
+        """
+        Request the given stream rates from the autopilot now and again whenever the heartbeat comes back after
+        a gap, and check the achieved rates periodically.
+        :param rates: Dict mapping MAVLink message name to the requested rate in Hz
+        :param disable_unused: Also switch off the streams the message filter skips
+        :param verify_period: Seconds between checks of the achieved rates
+        """
+        if self.__stream_rate_check is not None:
+            self.__stream_rate_check.stop()
+
+        self.__disable_unused_streams = disable_unused
+        # re-applied by the link supervisor, not by the manager's own heartbeat gap detection
+        self.__stream_rates = StreamRateManager(self.__request_message_interval, rates, heartbeat_timeout=None)
+        self.__stream_rates.apply()
+        self.__stream_rate_check = PeriodicTask(self.__check_stream_rates, verify_period, name="stream-rate-check")
+        self.__stream_rate_check.start()
 
-        print(self.__control_authority.value)
+    def stream_rates(self):
+        """
+        Requested and achieved rates as of the last periodic check.
+        :return: Dict mapping message name to a (requested Hz, achieved Hz) tuple, None before the first check
+        """
+        return self.__stream_rate_report
+
+    def link_stats(self):
+        """
+        Counters of the MAVLink link since it was last opened, on a link shared with other vehicles the frame
+        counts, drops and queues are those of the whole link.
+        :return: Dict with the frame counts, the received and lost frames per source (system ID, component ID),
+            the dropped messages and send jobs and the current queue depths
+        """
+        io = self.__io
+        return {
+            'frames': io.frame_stats(),
+            'sequence': io.sequence_stats(self.__heartbeat_source),
+            'dropped': {'inbound': io.dropped_inbound, 'outbound': io.dropped_outbound},
+            'queued': io.queue_depths(),
+        }
 
-        return self.__control_authority.value != 0
+    def add_link_health_listener(self, listener):
+        """
+        Register a callable invoked with every link health sample, a dict with the rolling loss and throughput
+        per source, the last RADIO_STATUS and the outbound back-off factor. Called on the link health thread.
+        """
+        self.__link_health_listeners.append(listener)
+
+    def __sample_link_health(self):
+        health = self.__link_quality.sample(self.link_stats())
+        self.__outbound.apply()
+        for listener in self.__link_health_listeners:
+            try:
+                listener(health)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.error("Error in link health listener: %s", e)
+
+    def send_command(self, command, *params):
+        """
+        Send a COMMAND_LONG without waiting for the vehicle to acknowledge it.
+        :param command: MAV_CMD ID, e.g. mavutil.mavlink.MAV_CMD_DO_SET_RELAY
+        :param params: Up to 7 command parameters, missing ones are sent as 0
+        :return: Future resolving to the MAV_RESULT of the COMMAND_ACK or failing with CommandTimeout, or with
+            ConnectionError right away while the link is being reopened
+        """
+        if not self.__link_open:
+            future = Future()
+            future.set_exception(ConnectionError("link down"))
+            return future
+        return self.__commands.submit(command, *params)
+
+    def __submit(self, send_name, *args):
+        """
+        Queue a send on the current link, dropped while no link is open, i.e. after a failed reconnect.
+        :param send_name: Name of the send method of the connection's MAVLink object, e.g. command_long_send
+        :return: True if queued
+        """
+        with self.__link_lock:
+            if self.__link_open:
+                return self.__io.submit(getattr(self.__vehicle.mav, send_name), *args)
+
+        _limited_log.warning('link-down', "Link down, dropped %s", send_name)
+        return False
+
+    def __send_command_long(self, command, confirmation, *params):
+        self.__submit(
+            'command_long_send',
+            self.target_system, self.target_component,
+            command, confirmation,
+            *params
+        )
+
+    def __command_succeeded(self, future, action):
+        """
+        Block until a command is acknowledged.
+        :return: True if the vehicle accepted the command
+        """
+        try:
+            result = future.result()
+        except (CommandTimeout, CancelledError, ConnectionError) as e:
+            logging.error("%s failed: %s", action, e or 'connection closed')
+            return False
+
+        if result != mavutil.mavlink.MAV_RESULT_ACCEPTED:
+            logging.error("%s rejected: %s", action, result_name(result))
+            return False
+
+        return True
+
+    def __request_message_interval(self, msg_id, interval_us):
+        # fire and forget, the stream rate manager checks the achieved rates and counts rejections
+        self.__send_command_long(
+            mavutil.mavlink.MAV_CMD_SET_MESSAGE_INTERVAL, 0,
+            msg_id, interval_us,
+            0, 0, 0, 0, 0
+        )
+
+    def __check_stream_rates(self):
+        self.__stream_rate_report = self.__stream_rates.verify()
+        if self.__disable_unused_streams:
+            self.__stream_rates.disable(self.__io.skipped_message_ids(self.target_system))
+
+    def __should_allow_rc_override(self):
+        return self.__rc_authority.allows_override()
 
     def __keep_alive_rc_override(self):
         self.__update_steering()
 
+    def __keep_alive_tick(self):
+        """
+        Re-send the current override so ArduPilot does not drop it after RC_OVERRIDE_TIME.
+        Nothing is sent before the first override, so the RC transmitter keeps control until we take it.
+        """
+        if self.__override_active and self.__should_allow_rc_override():
+            self.__keep_alive_rc_override()
+
+    def keep_alive_jitter(self):
+        """
+        Measured lateness of the RC override keep-alive ticks.
+        :return: Dict with ticks, missed deadlines and mean/p99/max jitter in seconds
+        """
+        return self.__keep_alive.jitter()
+
     def check_rc_mode(self):
-        self.__poll_rc_mode_switch()
+        self.__rc_authority.poll()
 
         if self.__should_allow_rc_override():
-            print("Should allow rc override")
+            logging.debug("Should allow rc override")
             self.__keep_alive_rc_override()
 
-    def __poll_rc_mode_switch(self):
-        """
-        Poll the state of RC channel 11
-        """
-        message = self.__vehicle.recv_match(type='RC_CHANNELS', blocking=True, timeout=1)
-        if message:
-            self.rc_channel_11_value = message.chan11_raw if hasattr(message, 'chan11_raw') else None
-            if self.rc_channel_11_value is not None:
-                print(f"RC Channel 11 value: {self.rc_channel_11_value}")
-                if self.rc_channel_11_value > 1500 and self.__control_authority != ControlAuthority.REMOTE:
-                    self.__control_authority = ControlAuthority.REMOTE
-                    print("CONTROL AUTHORITY UPDATED TO REMOTE")
-                elif self.rc_channel_11_value < 1500 and self.__control_authority != ControlAuthority.MANUAL:
-                    self.__control_authority = ControlAuthority.MANUAL
-                    print("CONTROL AUTHORITY UPDATED TO MANUAL")
-            else:
-                print("RC Channel 11 value not available in the message.")
-
     @property
     def heart_beat_received(self):
         return self.__heartbeat_received
 
+    @property
+    def state(self):
+        """
+        The cached vehicle state, continuously updated by the reader thread.
+        """
+        return self.__state
+
     # @property
     # def allow_rc_override(self):
     #     """
@@ -124,36 +432,170 @@ class Boat:
         """
         Establish a MAVLink connection to the vehicle.
         """
-        print("Connecting to vehicle on:", self.__connection_string)
-        self.__vehicle = mavutil.mavlink_connection(self.__connection_string)
+        if self.__owns_io:
+            logging.info("Connecting to vehicle on: %s", self.__connection_string)
+            self.__vehicle, self.__io = self.__open_link()
+            self.__link_open = True
+        self.__control_coalescer.start()
+        self.__keep_alive.start()
+        self.__supervisor.start()
+        self.__command_check.start()
+        self.__link_health.start()
+        if self.__slew is not None:
+            self.__slew.start()
+
+    def __open_link(self):
+        """
+        Open a connection and start its I/O, without making it the boat's link yet.
+        :return: (connection, MavlinkIO)
+        """
+        vehicle = open_connection(self.__connection_string, baud=self.__baud)
+        io = MavlinkIO(vehicle, recorder=self.__recorder)
+        io.set_message_filter(self.__message_filter)
+        io.set_raw_forwarder(self.__raw_forwarder)
+        io.add_listener(self.observe)
+        io.start()
+        return vehicle, io
+
+    def __reopen_link(self):
+        """
+        Open the link again and swap it in for the lost one, e.g. after the USB serial device re-enumerated.
+        If opening fails the lost link is closed anyway and sends are dropped until a reconnect succeeds.
+        """
+        logging.info("Reconnecting to vehicle on: %s", self.__connection_string)
+        try:
+            vehicle, io = self.__open_link()
+        except Exception:
+            self.__close_link()
+            raise
+
+        with self.__link_lock:
+            # the filter or forwarder may have changed while the link was opening
+            io.set_message_filter(self.__message_filter)
+            io.set_raw_forwarder(self.__raw_forwarder)
+            lost = (self.__vehicle, self.__io) if self.__link_open else None
+            # a fresh connection also re-resolves target_system from the next heartbeat
+            self.__vehicle, self.__io = vehicle, io
+            self.__link_open = True
+
+        if lost is not None:
+            self.__stop_link(*lost)
+
+    def __close_link(self):
+        """
+        Stop and close the current link, sends are dropped until a new link is open.
+        """
+        with self.__link_lock:
+            if not self.__link_open:
+                return
+            self.__link_open = False
+            vehicle, io = self.__vehicle, self.__io
+
+        self.__stop_link(vehicle, io)
+
+    @staticmethod
+    def __stop_link(vehicle, io):
+        io.stop()
+        try:
+            vehicle.close()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.error("Error closing link: %s", e)
 
-    def wait_for_heartbeat(self):
+    def __supervise_link(self):
+        """
+        Detect heartbeat timeouts, reopen lost links with exponential backoff and restore overrides and stream
+        rates once the heartbeat is back
+        """
+        heartbeat_age = self.__state.age('HEARTBEAT')
+        heartbeat_ok = heartbeat_age is not None and heartbeat_age <= self.__heartbeat_timeout
+
+        if self.__link_state == LinkState.CONNECTED:
+            if not heartbeat_ok:
+                logging.warning("Link lost, no heartbeat for %s s", self.__heartbeat_timeout)
+                self.__set_link_state(LinkState.LOST)
+                self.__reconnect_backoff = RECONNECT_INITIAL_BACKOFF
+                self.__next_reconnect = time.monotonic()
+            return
+
+        if heartbeat_ok:
+            self.__restore_link()
+            return
+
+        if not self.__owns_io or time.monotonic() < self.__next_reconnect:
+            return
+
+        try:
+            self.__reopen_link()
+            # give the reopened link time for a heartbeat before trying again
+            wait = max(self.__reconnect_backoff, HEARTBEAT_GRACE)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.warning("Reconnect failed: %s", e)
+            wait = self.__reconnect_backoff
+
+        self.__next_reconnect = time.monotonic() + wait
+        self.__reconnect_backoff = min(self.__reconnect_backoff * 2, self.__max_reconnect_backoff)
+
+    def __restore_link(self):
+        logging.info("Link up, heartbeat received")
+        self.__heartbeat_received = True
+        self.__connected = True
+        self.__set_link_state(LinkState.CONNECTED)
+
+        if self.__stream_rates is not None:
+            self.__stream_rates.apply()
+
+        # the autopilot may have rebooted or timed out our override while the link was down
+        if self.__override_active and self.__should_allow_rc_override():
+            self.__update_steering()
+
+    def __set_link_state(self, link_state):
+        self.__link_state = link_state
+        for listener in self.__link_state_listeners:
+            try:
+                listener(link_state)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.error("Error in link state listener: %s", e)
+
+    @property
+    def link_state(self):
+        return self.__link_state
+
+    def add_link_state_listener(self, listener):
+        """
+        Register a callable invoked with the new LinkState whenever the link is lost or restored.
+        Called on the supervisor thread.
+        """
+        self.__link_state_listeners.append(listener)
+
+    def wait_for_heartbeat(self, timeout=None):
         """
         Wait for the first heartbeat from the vehicle to confirm connection.
+        :param timeout: Seconds to wait, None waits forever
+        :return: True if a heartbeat arrived in time
         """
-        print("Waiting for vehicle heartbeat")
-        if self.__vehicle.wait_heartbeat():
+        logging.info("Waiting for vehicle heartbeat")
+        heartbeat_age = self.__state.age('HEARTBEAT')
+        if heartbeat_age is not None and heartbeat_age <= self.__heartbeat_timeout or \
+                self.__io.wait_for('HEARTBEAT', timeout=timeout, src_system=self.__heartbeat_source):
             self.__heartbeat_received = True
             self.__connected = True  # probably redundant
-            print("Heartbeat received")
+            logging.info("Heartbeat received")
+            return True
+
+        return False
 
     def arm_vehicle(self):
         """
         Arm the vehicle
         :return: true if action succeeded, false otherwise
         """
-        print("Arming vehicle")
+        logging.info("Arming vehicle")
 
-        self.__vehicle.mav.command_long_send(
-            self.__vehicle.target_system, self.__vehicle.target_component,
-            mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM, 0,
-            1,
-            0, 0, 0, 0, 0, 0
-        )
+        future = self.send_command(mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM, 1)
 
-        if self.is_armed():
+        if self.__command_succeeded(future, "Arming"):
             self.__status = Status.ARMED
-            print("VEHICLE ARMED")
+            logging.info("VEHICLE ARMED")
 
             return True
 
@@ -164,18 +606,13 @@ class Boat:
         Disarm the vehicle
         :return: true if action succeeded, false otherwise
         """
-        print("DISARMING VEHICLE")
+        logging.info("DISARMING VEHICLE")
 
-        self.__vehicle.mav.command_long_send(
-            self.__vehicle.target_system, self.__vehicle.target_component,
-            mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM, 0,
-            0,
-            0, 0, 0, 0, 0, 0
-        )
+        future = self.send_command(mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM, 0)
 
-        if not self.is_armed():
+        if self.__command_succeeded(future, "Disarming"):
             self.__status = Status.DISARMED
-            print("VEHICLE DISARMED")
+            logging.info("VEHICLE DISARMED")
 
             return True
 
@@ -183,19 +620,17 @@ class Boat:
 
     def is_armed(self):
         """
-        Check if the vehicle is armed.
+        Check if the vehicle is armed, as reported by the last heartbeat.
         :return: True if armed, False otherwise
         """
-        heartbeat = self.__vehicle.recv_match(type='HEARTBEAT', blocking=True, timeout=1)
+        armed = self.__state.armed
 
-        if heartbeat:
-            # Check if the vehicle is armed by examining the base_mode field
-            armed = heartbeat.base_mode & mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED
-            return bool(armed)
-        else:
-            print("No heartbeat message received.")
+        if armed is None:
+            _limited_log.warning('no-heartbeat', "No heartbeat message received.")
             return False
 
+        return armed
+
     def set_speed(self, speed):
         """
         Set the target speed of the boat.
@@ -215,140 +650,162 @@ class Boat:
         Close the MAVLink connection.
         """
         if self.__vehicle:
-            self.__vehicle.close()
+            self.__supervisor.stop()
+            self.__command_check.stop()
+            self.__link_health.stop()
+            self.__commands.cancel_all()
+            self.__keep_alive.stop()
+            if self.__slew is not None:
+                self.__slew.stop()
+            if self.__stream_rate_check is not None:
+                self.__stream_rate_check.stop()
+            self.__control_coalescer.stop()
+            if self.__owns_io:
+                self.__close_link()
             self.__connected = False
-            print("Connection closed")
+            logging.info("Connection closed")
 
     def set_relay_on(self, relay_number):
         """
         Turns the specified relay on.
         :param vehicle: The vehicle connection
         :param relay_number: The relay number to turn on (default is 0 for Relay1)
+        :return: Future resolving to the MAV_RESULT of the COMMAND_ACK
         """
         # Send MAV_CMD_DO_SET_RELAY command to turn relay on
-        self.__vehicle.mav.command_long_send(
-            self.__vehicle.target_system, self.__vehicle.target_component,
-            mavutil.mavlink.MAV_CMD_DO_SET_RELAY,
-            0,
-            relay_number, 1, 0, 0, 0, 0, 0
-        )
-        print(f"Relay{relay_number + 1} turned on")
+        future = self.send_command(mavutil.mavlink.MAV_CMD_DO_SET_RELAY, relay_number, 1)
+        logging.info("Relay%d turning on", relay_number + 1)
+        return future
 
     def set_relay_off(self, relay_number):
         """
         Turns the specified relay on.
         :param vehicle: The vehicle connection
         :param relay_number: The relay number to turn on (default is 0 for Relay1)
+        :return: Future resolving to the MAV_RESULT of the COMMAND_ACK
         """
-        # Send MAV_CMD_DO_SET_RELAY command to turn relay on
-        self.__vehicle.mav.command_long_send(
-            self.__vehicle.target_system, self.__vehicle.target_component,
-            mavutil.mavlink.MAV_CMD_DO_SET_RELAY,
-            0,
-            relay_number, 0, 0, 0, 0, 0, 0
-        )
-        print(f"Relay{relay_number + 1} turned off")
+        # Send MAV_CMD_DO_SET_RELAY command to turn relay off
+        future = self.send_command(mavutil.mavlink.MAV_CMD_DO_SET_RELAY, relay_number, 0)
+        logging.info("Relay%d turning off", relay_number + 1)
+        return future
 
     def emergency_stop(self):
         """Emergency stop, calls the disable propulsion function. Named for clarity and to enable additional actions"""
-        print("EMERGENCY STOP, DISABLING PROPULSION")
-        self.disable_propulsion()
+        logging.warning("EMERGENCY STOP, DISABLING PROPULSION")
+        return self.disable_propulsion()
 
     def disable_propulsion(self):
         """
         Switches off the power to the motors through the beefy relay
+        :return: Future resolving to the MAV_RESULT of the COMMAND_ACK
         """
-        print("DISABLING PROPULSION")
-        self.set_relay_off(1)
+        logging.info("DISABLING PROPULSION")
+        return self.set_relay_off(1)
 
     def enable_propulsion(self):
         """
         Switches on the power to the motors through the beefy relay
+        :return: Future resolving to the MAV_RESULT of the COMMAND_ACK
         """
-        print("ENABLING PROPULSION")
-        self.set_relay_on(1)
+        logging.info("ENABLING PROPULSION")
+        return self.set_relay_on(1)
 
     def set_rudder(self, steering_value: int):
         """
         Set the steering of the boat by overriding the RC channel.
         :param steering_value: The PWM value to set for the steering channel (usually between 1000 and 2000)
         """
-        if not self.__connected:
-            print("Vehicle not connected")
-            return
-
-        try:
-            received_value = int(steering_value)
-
-            if received_value >= 1100 and received_value <= 1900:
-                self.__current_rudder_value = int(steering_value)
-
-        except:
-            print(f"Invalid steering value: {steering_value}")
-            return
-
-        if self.__should_allow_rc_override():
-            self.__update_steering()
-            print(f"Steering set to {steering_value}")
-
-        else:
-            print("Overriding RC channels currently disabled ")
+        if self.set_controls({'rudder': steering_value}):
+            logging.debug("Steering set to %s", steering_value)
 
     def set_throttle(self, throttle_value):
         """
-        Set the steering of the boat by overriding the RC channel.
-        :param steering_value: The PWM value to set for the steering channel (usually between 1000 and 2000)
+        Set the throttle of both engines by overriding the RC channels.
+        :param throttle_value: The PWM value to set for the throttle channels (usually between 1000 and 2000)
         """
-        if not self.__connected:
-            print("Vehicle not connected")
-            return
-
-        try:
-            received_value = int(throttle_value)
+        if self.set_controls({'throttle': throttle_value}):
+            logging.debug("Throttle set to %s", throttle_value)
 
-            if received_value >= 1100 and received_value <= 1900:
-                self.__current_throttle_value = int(throttle_value)
-
-        except:
-            print(f"Invalid steering value: {throttle_value}")
-            return
-
-        if self.__should_allow_rc_override():
-            self.__update_steering()
-            print(f"Throttle set to {throttle_value}")
-
-        else:
-            print("Overriding RC channels currently disabled ")
+    def set_controls(self, targets):
+        """
+        Set several control targets at once, they are sent together in the next coalesced override frame.
+        :param targets: Dict mapping control target name, e.g. 'throttle_port', to a PWM value within 1100-1900.
+            Setting a combined target (rudder, throttle, thruster) hands its per-side targets back to it
+        :return: Dict mapping the targets applied to the PWM value they drive their RC channels with after
+            mixing and clamping, targets the mixer does not use and invalid values are left out
+        """
+        if not self.__connected:
+            _limited_log.warning('not-connected', "Vehicle not connected")
+            return {}
+
+        applied = {}
+        for name, value in targets.items():
+            if not self.__mixer.uses(name):
+                continue
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                _limited_log.warning(('invalid', name), "Invalid %s value: %s", name, value)
+                continue
+            if PWM_MIN <= value <= PWM_MAX:
+                applied[name] = value
+
+        if not applied:
+            return applied
+
+        if not self.__should_allow_rc_override():
+            _limited_log.warning('override-disabled', "Overriding RC channels currently disabled")
+            return {}
+
+        for name, value in self.__mixer.expand(applied).items():
+            self.__control_coalescer.update(name, value)
+        return self.__mixer.applied(applied)
 
     def set_throttle_differential(self, throttle_left, throttle_right):
         """
-        Set the steering of the boat by overriding the RC channel.
-        :param steering_value: The PWM value to set for the steering channel (usually between 1000 and 2000)
+        Set the throttle of the port and starboard engine separately, until set_throttle sets both again.
+        :param throttle_left: The PWM value for the port engine (usually between 1000 and 2000)
+        :param throttle_right: The PWM value for the starboard engine (usually between 1000 and 2000)
         """
+        if self.set_controls({'throttle_port': throttle_left, 'throttle_starboard': throttle_right}):
+            logging.debug("Throttle set to %s port, %s starboard", throttle_left, throttle_right)
 
-        raise NotImplementedError()
+    def control_metrics(self):
+        """
+        Counters of the lever input coalescing stage.
+        :return: Dict with the number of updates received, override frames flushed and updates coalesced away
+        """
+        return self.__control_coalescer.metrics()
 
-        if not self.__connected:
-            print("Vehicle not connected")
-            return
+    def __flush_control(self, values):
+        """
+        Send the newest coalesced control targets together in one override frame
+        """
+        self.__mixer.set_inputs(values)
+        self.__update_steering()
 
-        else:
-            print("Overriding RC channels currently disabled ")
+    def __slew_tick(self):
+        # a frame flushed by the coalescer within this tick already moved the channels
+        if time.monotonic() - self.__last_override_sent < self.__outbound.min_override_interval:
+            return
+        if self.__override_active and not self.__mixer.settled and self.__should_allow_rc_override():
+            self.__update_steering()
 
     def __update_steering(self):
         """
-        Controls both rudder and throttle values
+        Controls all rudder, throttle and thruster values
         """
 
-        print(f"Updated steering steering: {self.__current_rudder_value}, throttle: {self.__current_throttle_value}")
-        self.__vehicle.mav.rc_channels_override_send(
-            self.__vehicle.target_system,  # target_system
-            self.__vehicle.target_component,  # target_component
-            self.__current_rudder_value,
-            self.__current_throttle_value,  # might be unnecessary
-            self.__current_throttle_value,
-            0, 0, 0, 0, 0
-            # Other RC channels not overridden
+        channels = self.__mixer.mix()
+        logging.debug("Updated RC channels: %s", channels)
+        self.__override_active = True
+        self.__last_override_sent = time.monotonic()
+        self.__submit(
+            'rc_channels_override_send',
+            self.target_system,  # target_system
+            self.target_component,  # target_component
+            *channels
+            # RC channels without a control target are not overridden
         )
 
     def set_raw_servo(self, servo_number, pwm_value):
@@ -357,37 +814,34 @@ class Boat:
 
         :param servo_number: The servo output number (e.g., 1 for SERVO1_OUTPUT).
         :param pwm_value: The PWM value to set (usually between 1000 and 2000).
+        :return: Future resolving to the MAV_RESULT of the COMMAND_ACK, None if not connected
         """
         if not self.__connected:
-            print("Vehicle not connected")
-            return
+            logging.warning("Vehicle not connected")
+            return None
 
         # Ensure PWM value is within a safe range
         pwm_value = max(1000, min(pwm_value, 2000))
 
         # MAV_CMD_DO_SET_SERVO command
-        self.__vehicle.mav.command_long_send(
-            self.__vehicle.target_system,
-            self.__vehicle.target_component,
-            mavutil.mavlink.MAV_CMD_DO_SET_SERVO, 0,  # 0 for confirmation
+        future = self.send_command(
+            mavutil.mavlink.MAV_CMD_DO_SET_SERVO,
             servo_number,  # Servo number
             pwm_value,  # PWM value
-            0, 0, 0, 0, 0  # Unused parameters
         )
 
-        print(f"Set servo {servo_number} to PWM {pwm_value}")
+        logging.info("Setting servo %s to PWM %s", servo_number, pwm_value)
+        return future
 
     def get_flight_mode(self):
         """
-        Retrieve the current flight mode from the vehicle.
+        Retrieve the current flight mode from the vehicle, as reported by the last heartbeat.
 
         :return: The name of the current flight mode as a string.
         """
-        # Fetch the latest heartbeat message
-        heartbeat = self.__vehicle.recv_match(type='HEARTBEAT', blocking=True, timeout=1)
+        mode_id = self.__state.custom_mode
 
-        if heartbeat:
-            mode_id = heartbeat.custom_mode
+        if mode_id is not None:
             # apm_mode_mapping = {
             #     0: 'MANUAL',
             #     1: 'ACRO',
@@ -402,7 +856,7 @@ class Boat:
             return mode_id
 
         else:
-            print("No heartbeat message received.")
+            _limited_log.warning('no-heartbeat', "No heartbeat message received.")
             return None
 
 
@@ -429,7 +883,7 @@ if __name__ == "__main__":
 
     while True:
 
-        msg = boat.get_vehicle().recv_msg()
+        msg = boat.get_message(timeout=1)
 
         if msg:
             print(msg)
@@ -454,5 +908,4 @@ if __name__ == "__main__":
         # if radio_status_msg:
         #     print(
         #         f"[{timestamp}] Radio: RSSI {radio_status_msg.rssi}/255, Remote RSSI {radio_status_msg.remrssi}/255, Noise {radio_status_msg.noise}/255, Remote Noise {radio_status_msg.remnoise}/255, TX Buffer {radio_status_msg.txbuf}%")
-        time.sleep(0.1)
     boat.close_connection()
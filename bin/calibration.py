@@ -0,0 +1,211 @@
+"""
+Actuator calibration: maps actuator settings in percent to PWM values through per-target curves with
+deadband, expo, a piecewise linear lookup table and reversal.
+
+Every curve is evaluated once, when it is loaded, into a table over the whole -100 % to 100 % range at a
+fixed resolution, so mapping a sample is a clamp and a list index no matter how the curve is shaped.
+"""
+
+import bisect
+import json
+import math
+
+from mixer import COMBINED_INPUTS, PWM_CENTER, PWM_MAX, PWM_MIN
+
+DEFAULT_RESOLUTION = 0.1  # percent per table entry
+
+_COMBINED_OF = {
+    side: combined for combined, sides in COMBINED_INPUTS.items() for side in sides
+}
+
+
+class Curve:
+    """
+    Calibration curve of one control target, precomputed into a lookup table.
+    """
+
+    KEYS = ("deadband", "expo", "points", "reversed")
+
+    def __init__(
+        self,
+        deadband=0.0,
+        expo=0.0,
+        points=None,
+        reversed=False,  # pylint: disable=redefined-builtin
+        resolution=DEFAULT_RESOLUTION,
+    ):
+        """
+        :param deadband: Settings within +-deadband percent map to 0 %, the rest is rescaled to keep full scale
+        :param expo: 0 for linear up to 1 for cubic, softens the response around center
+        :param points: List of (percent, PWM) points interpolated linearly, from -100 % to 100 %.
+            Defaults to 1100 at -100 %, 1500 at 0 % and 1900 at 100 %
+        :param reversed: Mirror the setting before shaping it, for actuators mounted the other way around
+        :param resolution: Percent per lookup table entry
+        """
+        if not 0.0 <= deadband < 100.0:
+            raise ValueError(f"Deadband must be within 0-100 %, got {deadband}")
+        if not 0.0 <= expo <= 1.0:
+            raise ValueError(f"Expo must be within 0-1, got {expo}")
+
+        points = sorted(
+            points or ((-100.0, PWM_MIN), (0.0, PWM_CENTER), (100.0, PWM_MAX))
+        )
+        if len(points) < 2:
+            raise ValueError("A calibration curve needs at least two points")
+        if any(not PWM_MIN <= pwm <= PWM_MAX for _, pwm in points):
+            raise ValueError(
+                f"Calibration points must stay within {PWM_MIN}-{PWM_MAX} PWM, got {points}"
+            )
+        xs = [float(x) for x, _ in points]
+        ys = [float(y) for _, y in points]
+
+        def shape(pct):
+            if reversed:
+                pct = -pct
+            magnitude = abs(pct)
+            if magnitude <= deadband:
+                return 0.0
+            normalized = (magnitude - deadband) / (100.0 - deadband)
+            normalized = (1.0 - expo) * normalized + expo * normalized**3
+            return math.copysign(normalized * 100.0, pct)
+
+        def interpolate(pct):
+            # beyond the first or last point the outermost segment is extended
+            index = min(max(bisect.bisect_right(xs, pct), 1), len(xs) - 1)
+            x0, x1 = xs[index - 1], xs[index]
+            y0, y1 = ys[index - 1], ys[index]
+            return y0 + (y1 - y0) * (pct - x0) / (x1 - x0)
+
+        self.shape = shape
+        self.interpolate = interpolate
+        self.scale = 1.0 / resolution
+        # table index of a setting is int(pct * scale + offset), rounded to the nearest entry
+        self.offset = 100.0 * self.scale + 0.5
+        self.last = int(round(200.0 * self.scale))
+        self.table = [
+            int(round(interpolate(shape(-100.0 + i * resolution))))
+            for i in range(self.last + 1)
+        ]
+
+    def __call__(self, pct):
+        """
+        :param pct: Actuator setting in percent, clamped to -100 to 100
+        :return: The PWM value
+        """
+        index = int(pct * self.scale + self.offset)
+        last = self.last
+        return self.table[0 if index < 0 else last if index > last else index]
+
+    def to_percent(self, pwm, near=0.0):
+        """
+        Invert the curve.
+        :param pwm: PWM value
+        :param near: Setting in percent preferred where several ranges of settings map to the PWM value
+        :return: The middle of the range of settings in percent mapping closest to the PWM value
+        """
+        table = self.table
+        error = min(abs(value - pwm) for value in table)
+        index = min(
+            (i for i, value in enumerate(table) if abs(value - pwm) == error),
+            key=lambda i: abs(i / self.scale - 100.0 - near),
+        )
+        low = high = index
+        while low > 0 and table[low - 1] == table[index]:
+            low -= 1
+        while high < self.last and table[high + 1] == table[index]:
+            high += 1
+        return round((low + high) / 2.0 / self.scale - 100.0, 6)
+
+
+class Calibration:
+    """
+    The curves of all control targets. A per-side target without a curve of its own (throttle_port, ...)
+    uses the curve of its combined target (throttle, ...), targets without any use the default linear curve.
+    """
+
+    def __init__(self, curves=None, resolution=DEFAULT_RESOLUTION):
+        """
+        :param curves: Dict mapping control target name to a dict of Curve arguments
+        :param resolution: Percent per lookup table entry
+        """
+        self.__curves = {
+            name: Curve(**settings, resolution=resolution)
+            for name, settings in (curves or {}).items()
+        }
+        self.__default = Curve(resolution=resolution)
+
+    def curve(self, name):
+        """
+        :param name: Control target name, e.g. "rudder"
+        :return: The Curve mapping the target's settings
+        """
+        curve = self.__curves.get(name)
+        if curve is None:
+            curve = self.__curves.get(_COMBINED_OF.get(name), self.__default)
+        return curve
+
+    def to_pwm(self, name, pct):
+        """
+        :param name: Control target name
+        :param pct: Setting in percent
+        :return: The PWM value
+        """
+        return self.curve(name)(pct)
+
+    def to_percent(self, name, pwm, near=0.0):
+        """
+        :param name: Control target name
+        :param pwm: PWM value
+        :param near: Setting in percent preferred where several settings map to the same PWM value
+        :return: The setting in percent
+        """
+        return self.curve(name).to_percent(pwm, near)
+
+    def mapper(self, names):
+        """
+        Resolve the curves of several targets once, for mapping many samples of all of them.
+        :param names: Sequence of control target names
+        :return: Callable mapping a sequence of settings in percent, in the order of names, to a list of PWM values
+        """
+        # every table has the same resolution, so one index computation fits all
+        tables = [self.curve(name).table for name in names]
+        scale = self.__default.scale
+        offset = self.__default.offset
+        last = self.__default.last
+
+        def _map(pcts):
+            pwms = []
+            for table, pct in zip(tables, pcts):
+                index = int(pct * scale + offset)
+                pwms.append(table[0 if index < 0 else last if index > last else index])
+            return pwms
+
+        return _map
+
+    def to_pwm_all(self, targets):
+        """
+        :param targets: Dict mapping control target name to a setting in percent
+        :return: Dict mapping the same names to PWM values
+        """
+        return {name: self.curve(name)(pct) for name, pct in targets.items()}
+
+
+def load_calibration(path=None, resolution=DEFAULT_RESOLUTION):
+    """
+    :param path: Optional JSON file mapping control target name to curve settings, ex.
+        {"rudder": {"deadband": 2, "expo": 0.3, "reversed": true, "points": [[-100, 1150], [100, 1850]]}}
+    :param resolution: Percent per lookup table entry
+    :return: The Calibration, linear for every target if no file is given
+    """
+    curves = {}
+    if path:
+        with open(path, encoding="utf-8") as fh:
+            for name, settings in json.load(fh).items():
+                unknown = set(settings) - set(Curve.KEYS)
+                if unknown:
+                    raise ValueError(
+                        f"Unknown calibration keys {sorted(unknown)} for {name} in {path}"
+                    )
+                curves[name] = settings
+
+    return Calibration(curves, resolution)
@@ -0,0 +1,108 @@
+"""
+Latest-value coalescing of high rate control inputs before they are sent to the vehicle.
+"""
+
+import logging
+import threading
+import time
+
+
+class LatestValueCoalescer:
+    """
+    Keeps only the newest value per key and flushes all pending values together at a bounded rate,
+    so a burst of lever samples turns into at most one outgoing frame per flush interval.
+    """
+
+    def __init__(self, flush, max_rate_hz=50.0):
+        """
+        :param flush: Callable receiving a dict with the newest value of every key, called from the flush thread
+        :param max_rate_hz: Max number of flushes per second
+        """
+        self.__flush = flush
+        self.__min_interval = 1.0 / max_rate_hz
+        self.__values = {}
+        self.__pending = 0
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Event()
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__last_flush = 0.0
+        self.updates = 0
+        self.flushes = 0
+        self.coalesced = 0
+
+    def start(self):
+        """
+        Start the flush thread.
+        """
+        self.__stop.clear()
+        self.__thread = threading.Thread(
+            target=self.__run, name="control-coalescer", daemon=True
+        )
+        self.__thread.start()
+
+    def stop(self, timeout=1.0):
+        """
+        Stop the flush thread, pending values are discarded.
+        :param timeout: Max time in seconds to wait for the thread to finish
+        """
+        self.__stop.set()
+        self.__wakeup.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+
+    def update(self, key, value):
+        """
+        Replace the pending value for a key and schedule a flush, never blocks on I/O.
+        :param key: Name of the input, e.g. "rudder"
+        :param value: The newest target value
+        """
+        with self.__lock:
+            self.__values[key] = value
+            self.__pending += 1
+            self.updates += 1
+        self.__wakeup.set()
+
+    def set_max_rate(self, max_rate_hz):
+        """
+        Change the max flush rate, e.g. to back off on a congested link, effective from the next flush.
+        :param max_rate_hz: Max number of flushes per second
+        """
+        self.__min_interval = 1.0 / max_rate_hz
+
+    def metrics(self):
+        """
+        :return: Dict with the number of updates received, flushes made and updates coalesced away
+        """
+        with self.__lock:
+            return {
+                "updates": self.updates,
+                "flushes": self.flushes,
+                "coalesced": self.coalesced,
+            }
+
+    def __run(self):
+        while not self.__stop.is_set():
+            self.__wakeup.wait()
+            if self.__stop.is_set():
+                break
+
+            # Hold back until the flush interval has passed, updates arriving meanwhile are merged
+            remaining = self.__last_flush + self.__min_interval - time.monotonic()
+            if remaining > 0 and self.__stop.wait(remaining):
+                break
+
+            with self.__lock:
+                self.__wakeup.clear()
+                if self.__pending == 0:
+                    continue
+                values = dict(self.__values)
+                self.coalesced += self.__pending - 1
+                self.flushes += 1
+                self.__pending = 0
+
+            self.__last_flush = time.monotonic()
+            try:
+                self.__flush(values)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.error("Error flushing control values: %s", e)
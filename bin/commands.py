@@ -0,0 +1,180 @@
+"""
+COMMAND_LONG tracking: every command gets a future resolved by the matching COMMAND_ACK, is re-sent with an
+incremented confirmation counter when the ack does not arrive in time, and several commands can be in flight.
+"""
+
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
+from pymavlink import mavutil
+
+
+def result_name(result):
+    """
+    :param result: MAV_RESULT value of a COMMAND_ACK
+    :return: Its enum name, e.g. MAV_RESULT_ACCEPTED
+    """
+    entry = mavutil.mavlink.enums["MAV_RESULT"].get(result)
+    return entry.name if entry is not None else f"MAV_RESULT_{result}"
+
+
+class CommandTimeout(Exception):
+    """
+    No COMMAND_ACK arrived for a command, including its retries.
+    """
+
+
+class _PendingCommand:
+    def __init__(self, command, params):
+        self.command = command
+        self.params = params
+        self.future = concurrent.futures.Future()
+        self.confirmation = 0
+        self.deadline = None
+
+
+class CommandManager:
+    """
+    Sends COMMAND_LONG and matches the COMMAND_ACKs. An ack only names the command it answers, so commands of
+    different IDs are pipelined while a second command with the ID of one in flight waits for it to finish.
+    """
+
+    def __init__(self, send, timeout=1.0, retries=2):
+        """
+        :param send: Callable taking the command ID, the confirmation counter and the 7 parameters
+        :param timeout: Seconds to wait for an ack before re-sending, extended by MAV_RESULT_IN_PROGRESS acks
+        :param retries: Number of re-sends before the future fails with CommandTimeout
+        """
+        self.__send = send
+        self.__timeout = timeout
+        self.__retries = retries
+        self.__lock = threading.Lock()
+        self.__in_flight = {}
+        self.__waiting = collections.defaultdict(collections.deque)
+
+    def set_timeout(self, timeout):
+        """
+        Change the time to wait for an ack, e.g. to back off on a congested link, effective from the next send.
+        :param timeout: Seconds to wait for an ack before re-sending
+        """
+        self.__timeout = timeout
+
+    def submit(self, command, *params):
+        """
+        Send a command without waiting for its result.
+        :param command: MAV_CMD ID, e.g. mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM
+        :param params: Up to 7 command parameters, missing ones are sent as 0
+        :return: Future resolving to the MAV_RESULT of the ack or failing with CommandTimeout
+        """
+        if len(params) > 7:
+            raise ValueError(
+                f"COMMAND_LONG takes at most 7 parameters, got {len(params)}"
+            )
+
+        pending = _PendingCommand(command, tuple(params) + (0,) * (7 - len(params)))
+        with self.__lock:
+            if command in self.__in_flight:
+                self.__waiting[command].append(pending)
+                return pending.future
+            self.__in_flight[command] = pending
+
+        self.__transmit(pending)
+        return pending.future
+
+    def handle_ack(self, msg):
+        """
+        Resolve the command a COMMAND_ACK answers, meant to run on the reader for every received ack.
+        :param msg: Decoded COMMAND_ACK message
+        """
+        with self.__lock:
+            pending = self.__in_flight.get(msg.command)
+            if pending is None:
+                return
+
+            if msg.result == mavutil.mavlink.MAV_RESULT_IN_PROGRESS:
+                pending.deadline = time.monotonic() + self.__timeout
+                return
+
+            next_pending = self.__advance(msg.command)
+
+        pending.future.set_result(msg.result)
+        if next_pending is not None:
+            self.__transmit(next_pending)
+
+    def check_timeouts(self):
+        """
+        Re-send or fail the commands whose ack is overdue, meant to run periodically.
+        """
+        now = time.monotonic()
+        resend = []
+        failed = []
+        with self.__lock:
+            for command, pending in list(self.__in_flight.items()):
+                if pending.deadline is None or pending.deadline > now:
+                    continue
+
+                if pending.confirmation < self.__retries:
+                    pending.confirmation += 1
+                    resend.append(pending)
+                else:
+                    failed.append(pending)
+                    next_pending = self.__advance(command)
+                    if next_pending is not None:
+                        resend.append(next_pending)
+
+        for pending in failed:
+            pending.future.set_exception(
+                CommandTimeout(
+                    f"No COMMAND_ACK for command {pending.command} after "
+                    f"{pending.confirmation + 1} attempts"
+                )
+            )
+        for pending in resend:
+            self.__transmit(pending)
+
+    def cancel_all(self):
+        """
+        Cancel every command in flight or waiting, e.g. when the link is closed for good.
+        """
+        with self.__lock:
+            cancelled = list(self.__in_flight.values())
+            for waiting in self.__waiting.values():
+                cancelled += waiting
+            self.__in_flight.clear()
+            self.__waiting.clear()
+
+        for pending in cancelled:
+            pending.future.cancel()
+
+    def pending(self):
+        """
+        :return: Number of commands in flight or waiting for one with the same ID
+        """
+        with self.__lock:
+            return len(self.__in_flight) + sum(map(len, self.__waiting.values()))
+
+    def __advance(self, command):
+        """
+        Retire the in flight command with this ID and promote the next waiting one, lock held by the caller.
+        """
+        del self.__in_flight[command]
+        waiting = self.__waiting.get(command)
+        if not waiting:
+            return None
+
+        next_pending = waiting.popleft()
+        if not waiting:
+            del self.__waiting[command]
+        self.__in_flight[command] = next_pending
+        return next_pending
+
+    def __transmit(self, pending):
+        pending.deadline = time.monotonic() + self.__timeout
+        try:
+            self.__send(pending.command, pending.confirmation, *pending.params)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # The retry timer re-sends, a failing link ends in CommandTimeout
+            logging.error("Error sending command %d: %s", pending.command, e)
@@ -0,0 +1,74 @@
+"""
+Single-reader dispatch of MAVLink messages to handlers registered per message ID.
+"""
+
+import logging
+from pymavlink import mavutil
+
+
+def message_id(msg_type: str) -> int:
+    """
+    Resolve a MAVLink message name to its numeric message ID.
+    :param msg_type: MAVLink message name, e.g. "VFR_HUD"
+    :return: The MAVLink message ID, e.g. 74
+    """
+    try:
+        return getattr(mavutil.mavlink, f"MAVLINK_MSG_ID_{msg_type}")
+    except AttributeError:
+        raise ValueError(f"Unknown MAVLink message type: {msg_type}") from None
+
+
+class MessageDispatcher:
+    """
+    Routes every message read off the link to the handlers registered for its message ID,
+    so each stream is handled at the rate the autopilot emits it.
+    """
+
+    def __init__(self, observer=None):
+        """
+        :param observer: Optional callable taking every dispatched message before its handlers, e.g. to count
+            them, it does not widen the message IDs decoded
+        """
+        self.__handlers = {}
+        self.__observer = observer
+
+    def register(self, msg_type: str, handler):
+        """
+        Register a handler for a message type, several handlers may share a type.
+        :param msg_type: MAVLink message name, e.g. "RAW_IMU"
+        :param handler: Callable taking the decoded MAVLink message
+        """
+        self.__handlers.setdefault(message_id(msg_type), []).append(handler)
+
+    @property
+    def message_ids(self):
+        """
+        The set of message IDs that have at least one registered handler, the only ones the link has to decode.
+        Frames wanted raw are picked by the link's parser before decoding, see passthrough.RawFramePublisher.
+        """
+        return frozenset(self.__handlers)
+
+    def dispatch(self, msg) -> bool:
+        """
+        Hand a message to the handlers registered for its ID.
+        :param msg: Decoded MAVLink message
+        :return: True if at least one handler was registered for the message
+        """
+        if self.__observer is not None:
+            self.__observer(msg)
+
+        handlers = self.__handlers.get(msg.get_msgId())
+        if handlers is None:
+            return False
+
+        for handler in handlers:
+            self.__call(handler, msg)
+
+        return True
+
+    @staticmethod
+    def __call(handler, msg):
+        try:
+            handler(msg)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.error("Error handling %s: %s", msg.get_type(), e)
@@ -0,0 +1,183 @@
+"""
+Several vehicles behind one MAVLink connection, e.g. boats on a MAVLink router's UDP endpoint.
+
+One MavlinkIO reads the shared link and demultiplexes every message by its source system ID. The first
+autopilot heartbeat of a system creates its Boat, and from then on the system's messages go to a bounded
+queue of its own. The consumer drains the queues round-robin, one message per vehicle per turn, so a
+chatty vehicle can only overflow its own queue and never delays the others.
+"""
+
+import collections
+import logging
+import threading
+
+from pymavlink import mavutil
+
+import boat
+from dispatcher import message_id
+from mavlink_io import MavlinkIO
+from passthrough import RawFrameRouter
+from recording import open_connection
+from vehicle_state import VehicleState
+
+
+class Fleet:
+    """
+    Owns a shared MAVLink link and one Boat per MAVLink system ID seen on it.
+    """
+
+    def __init__(
+        self,
+        connection_string,
+        baud=115200,
+        queue_size=200,
+        recorder=None,
+        **boat_options,
+    ):
+        """
+        :param connection_string: Connection string for MAVLink, e.g. udpin:0.0.0.0:14550
+        :param baud: Baud rate for serial links
+        :param queue_size: Max number of received messages buffered per vehicle, oldest dropped first
+        :param recorder: Optional recording.Recorder the raw MAVLink stream of the shared link is recorded to
+        :param boat_options: Keyword arguments for every Boat, e.g. max_override_rate_hz
+        """
+        self.__connection_string = connection_string
+        self.__connection = open_connection(connection_string, baud=baud)
+        self.__io = MavlinkIO(
+            self.__connection, buffer_inbound=False, recorder=recorder
+        )
+        self.__io.add_listener(self.__demultiplex)
+        self.__raw_router = RawFrameRouter()
+        self.__io.set_raw_forwarder(self.__raw_router)
+        self.__queue_size = queue_size
+        self.__boat_options = boat_options
+        self.__vehicles = {}
+        self.__queues = {}
+        self.__ready = threading.Condition()
+        self.__turn = collections.deque()
+        self.__pending = 0
+        self.dropped = collections.Counter()
+        self.ignored = 0
+
+    @property
+    def vehicles(self):
+        """
+        Snapshot of the vehicles seen so far.
+        :return: Dict mapping MAVLink system ID to Boat
+        """
+        with self.__ready:
+            return dict(self.__vehicles)
+
+    def start(self):
+        """
+        Start reading the shared link.
+        """
+        logging.info("Listening for vehicles on %s", self.__connection_string)
+        self.__io.start()
+
+    def close(self):
+        """
+        Stop every vehicle and close the shared link.
+        """
+        for vehicle in self.vehicles.values():
+            vehicle.close_connection()
+        self.__io.stop()
+        self.__connection.close()
+
+    def set_message_filter(self, msg_ids):
+        """
+        Only decode the given message IDs on the shared link, plus the ones vehicles are discovered and
+        tracked by.
+        :param msg_ids: Iterable of MAVLink message IDs, None decodes every message
+        """
+        if msg_ids is not None:
+            msg_ids = set(msg_ids).union(
+                message_id(msg_type) for msg_type in boat.REQUIRED_MESSAGES
+            )
+        self.__io.set_message_filter(msg_ids)
+
+    def add_raw_forwarder(self, system_id, forwarder):
+        """
+        Forward the untouched frames of one vehicle on the shared link.
+        :param system_id: MAVLink system ID of the vehicle
+        :param forwarder: passthrough.RawFramePublisher of the vehicle
+        """
+        self.__raw_router.add(system_id, forwarder)
+
+    def get_message(self, timeout=0):
+        """
+        Take the next received message, taking turns between the vehicles with queued messages.
+        :param timeout: Seconds to wait for a message, 0 returns immediately and None waits forever
+        :return: Tuple of the Boat and its MAVLink message, (None, None) if nothing arrived in time
+        """
+        with self.__ready:
+            if not self.__pending and (
+                timeout == 0
+                or not self.__ready.wait_for(lambda: self.__pending, timeout)
+            ):
+                return None, None
+
+            # The head of the turn order always has a message, vehicles drained empty leave the rotation
+            system_id = self.__turn[0]
+            queue = self.__queues[system_id]
+            msg = queue.popleft()
+            self.__pending -= 1
+            self.__turn.popleft()
+            if queue:
+                self.__turn.append(system_id)
+
+            return self.__vehicles[system_id], msg
+
+    def __demultiplex(self, msg):
+        """
+        Reader thread listener routing a message to the queue of its source system.
+        """
+        system_id = msg.get_srcSystem()
+        vehicle = self.__vehicles.get(system_id)
+
+        if vehicle is None:
+            if (
+                msg.get_type() != "HEARTBEAT"
+                or msg.autopilot == mavutil.mavlink.MAV_AUTOPILOT_INVALID
+            ):
+                # Ground stations and messages of systems not yet announced by an autopilot heartbeat
+                self.ignored += 1
+                return
+            vehicle = self.__add_vehicle(system_id, msg)
+
+        vehicle.observe(msg)
+
+        with self.__ready:
+            queue = self.__queues[system_id]
+            if len(queue) >= self.__queue_size:
+                queue.popleft()
+                self.dropped[system_id] += 1
+            else:
+                self.__pending += 1
+                if len(queue) == 0:
+                    self.__turn.append(system_id)
+            queue.append(msg)
+            self.__ready.notify()
+
+    def __add_vehicle(self, system_id, heartbeat):
+        logging.info(
+            "New vehicle system %d component %d on %s",
+            system_id,
+            heartbeat.get_srcComponent(),
+            self.__connection_string,
+        )
+        state = VehicleState(system_id)
+        state.update(heartbeat)
+        vehicle = boat.Boat(
+            connection_string=self.__connection_string,
+            baud=None,
+            io=self.__io,
+            target=(system_id, heartbeat.get_srcComponent()),
+            state=state,
+            **self.__boat_options,
+        )
+        with self.__ready:
+            self.__vehicles[system_id] = vehicle
+            self.__queues[system_id] = collections.deque()
+
+        return vehicle
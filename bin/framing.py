@@ -0,0 +1,251 @@
+"""
+MAVLink framing: splits the byte stream of a link into frames and decodes only the wanted ones.
+
+pymavlink decodes every frame into a Python object before the caller can look at its type. Here the
+message ID is read from the frame header first, frames nobody wants are only CRC checked and stepped
+over by their length without being unpacked, and the rest go through pymavlink's decode, which validates
+the CRC (and signature), so what comes out is exactly what recv_msg would have returned. The time taken
+to decode is kept on the message as _decode_seconds.
+
+A frame is only trusted, counted in the per-source statistics and forwarded raw once its CRC checked
+out. A marker inside line noise or a corrupted frame is stepped over by one byte, so a bogus length never
+swallows the valid frames following it and noise never shows up as a source of its own. Frames of message
+IDs unknown to the dialect have no CRC extra to check them with and are dropped the same way.
+
+Frames can be forwarded untouched, as they came off the link, to a raw forwarder that picks them by the
+message ID in their header, whether they are decoded or not.
+"""
+
+import binascii
+import logging
+import time
+
+from pymavlink import mavutil
+
+MAVLINK1_STX = 0xFE
+MAVLINK2_STX = 0xFD
+MAVLINK1_OVERHEAD = 8  # 6 byte header, 2 byte CRC
+MAVLINK2_OVERHEAD = 12  # 10 byte header, 2 byte CRC
+MAVLINK2_SIGNATURE_LEN = 13
+MAVLINK2_IFLAG_SIGNED = 0x01
+# SiK radios inject RADIO_STATUS with a sequence of their own, not a gap indicator of the link
+RADIO_SOURCE = ord("3") << 8 | ord("D")
+
+# MAVLink's X.25 CRC is the bit-reflected CRC-CCITT, computed in C by binascii.crc_hqx on bit-reversed bytes
+_REVERSED_BITS = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+def frame_message_id(frame, offset=0):
+    """
+    Read the message ID from the header of a MAVLink 1 or 2 frame.
+    :param frame: Bytes holding the frame
+    :param offset: Index of the frame's start-of-frame marker
+    :return: The message ID or None if there is no marker at the offset
+    """
+    if frame[offset] == MAVLINK2_STX:
+        return frame[offset + 7] | frame[offset + 8] << 8 | frame[offset + 9] << 16
+    if frame[offset] == MAVLINK1_STX:
+        return frame[offset + 5]
+    return None
+
+
+def frame_source_system(frame, offset=0):
+    """
+    Read the source system ID from the header of a MAVLink 1 or 2 frame.
+    :param frame: Bytes holding the frame
+    :param offset: Index of the frame's start-of-frame marker
+    :return: The MAVLink system ID or None if there is no marker at the offset
+    """
+    if frame[offset] == MAVLINK2_STX:
+        return frame[offset + 5]
+    if frame[offset] == MAVLINK1_STX:
+        return frame[offset + 3]
+    return None
+
+
+def frame_crc_ok(frame, offset, length, crc_extra):
+    """
+    Check the CRC of a complete MAVLink 1 or 2 frame.
+    :param frame: Bytes holding the frame
+    :param offset: Index of the frame's start-of-frame marker
+    :param length: Length of the frame including its CRC and signature
+    :param crc_extra: CRC extra byte of the frame's message type
+    :return: True if the CRC matches
+    """
+    end = offset + length
+    if frame[offset] == MAVLINK2_STX and frame[offset + 2] & MAVLINK2_IFLAG_SIGNED:
+        end -= MAVLINK2_SIGNATURE_LEN
+    crc = binascii.crc_hqx(
+        (frame[offset + 1 : end - 2] + bytes((crc_extra,))).translate(_REVERSED_BITS),
+        0xFFFF,
+    )
+    crc = _REVERSED_BITS[crc & 0xFF] << 8 | _REVERSED_BITS[crc >> 8]
+    return crc == frame[end - 2] | frame[end - 1] << 8
+
+
+class FrameParser:
+    """
+    Incremental parser for the bytes read off one mavutil connection. Not thread-safe, each link is
+    expected to be parsed by its single reader.
+    """
+
+    def __init__(self, connection, msg_ids=None):
+        """
+        :param connection: The mavutil connection the bytes are read from
+        :param msg_ids: Message IDs to decode, None decodes every frame
+        """
+        self.__connection = connection
+        self.__buffer = bytearray()
+        self.msg_ids = msg_ids
+        # RawFramePublisher-like object forwarding the valid frames of the message IDs it wants, untouched
+        self.raw_forwarder = None
+        self.decoded = 0
+        self.skipped = 0
+        # system ID: message IDs skipped, replaced, not mutated, as other threads read it
+        self.__skipped_ids = {}
+        self.errors = 0
+        # system ID << 8 | component ID: [last sequence number, frames, frames lost, bytes]
+        self.__sources = {}
+
+    @property
+    def msg_ids(self):
+        return self.__msg_ids
+
+    @msg_ids.setter
+    def msg_ids(self, msg_ids):
+        self.__msg_ids = None if msg_ids is None else frozenset(msg_ids)
+
+    def parse(self, data):
+        """
+        Feed bytes read from the link.
+        :param data: The bytes read
+        :return: List of the wanted messages completed by these bytes, posted to the connection
+        """
+        connection = self.__connection
+        if connection.first_byte:
+            # Lets mavutil switch to the MAVLink 2 dialect when it sees the first v2 frame
+            connection.auto_mavlink_version(data)
+
+        mav = connection.mav
+        mavlink_map = mavutil.mavlink.mavlink_map
+        msg_ids = self.__msg_ids
+        raw_forwarder = self.raw_forwarder
+        received_at = time.time_ns() if raw_forwarder is not None else None
+        sources = self.__sources
+        buffer = self.__buffer
+        buffer += data
+        end = len(buffer)
+        offset = 0
+        messages = []
+
+        while offset < end:
+            magic = buffer[offset]
+            if magic == MAVLINK2_STX:
+                if end - offset < MAVLINK2_OVERHEAD:
+                    break
+                length = buffer[offset + 1] + MAVLINK2_OVERHEAD
+                if buffer[offset + 2] & MAVLINK2_IFLAG_SIGNED:
+                    length += MAVLINK2_SIGNATURE_LEN
+            elif magic == MAVLINK1_STX:
+                if end - offset < MAVLINK1_OVERHEAD:
+                    break
+                length = buffer[offset + 1] + MAVLINK1_OVERHEAD
+            else:
+                # Line noise between frames, resynchronize on the next marker
+                offset += 1
+                continue
+
+            if end - offset < length:
+                break
+
+            msg_id = frame_message_id(buffer, offset)
+            msg_type = mavlink_map.get(msg_id)
+            msg = None
+            if msg_type is None:
+                valid = False
+            elif msg_ids is None or msg_id in msg_ids:
+                try:
+                    started = time.perf_counter()
+                    msg = mav.decode(buffer[offset : offset + length])
+                    # pylint: disable-next=protected-access
+                    msg._decode_seconds = time.perf_counter() - started
+                    valid = True
+                except mavutil.mavlink.MAVError as e:
+                    logging.debug("Dropped MAVLink frame: %s", e)
+                    valid = False
+            else:
+                valid = frame_crc_ok(buffer, offset, length, msg_type.crc_extra)
+
+            if not valid:
+                # Bad CRC or a marker inside noise, step over the marker only and resynchronize
+                self.errors += 1
+                offset += 1
+                continue
+
+            # Sequence numbers count every valid frame of a source, skipped frames included
+            header = offset + (4 if magic == MAVLINK2_STX else 2)
+            seq = buffer[header]
+            source = buffer[header + 1] << 8 | buffer[header + 2]
+            sequence = sources.get(source)
+            if sequence is None:
+                sources[source] = [seq, 1, 0, length]
+            else:
+                gap = (seq - sequence[0] - 1) & 0xFF
+                if gap and source != RADIO_SOURCE:
+                    sequence[2] += gap
+                sequence[0] = seq
+                sequence[1] += 1
+                sequence[3] += length
+
+            forwarded = raw_forwarder is not None and raw_forwarder.wants(msg_id)
+            if forwarded:
+                raw_forwarder.forward(buffer[offset : offset + length], received_at)
+
+            offset += length
+            if msg is None:
+                self.skipped += 1
+                if not forwarded:
+                    self.__skip(source >> 8, msg_id)
+                continue
+
+            self.decoded += 1
+            connection.post_message(msg)
+            messages.append(msg)
+
+        del buffer[:offset]
+        return messages
+
+    def __skip(self, system, msg_id):
+        skipped_ids = self.__skipped_ids.get(system, frozenset())
+        if msg_id not in skipped_ids:
+            self.__skipped_ids = {**self.__skipped_ids, system: skipped_ids | {msg_id}}
+
+    def skipped_message_ids(self, src_system=None):
+        """
+        Message IDs of the frames skipped by the message filter so far. Frames the raw forwarder consumes are
+        not skipped, whether they are decoded or not.
+        :param src_system: Only report the frames of this MAVLink system ID
+        :return: Frozenset of MAVLink message IDs
+        """
+        skipped_ids = self.__skipped_ids
+        if src_system is not None:
+            return skipped_ids.get(src_system, frozenset())
+        return frozenset().union(*skipped_ids.values())
+
+    def sequence_stats(self, src_system=None):
+        """
+        Frames received and lost per source, lost frames are the gaps in the MAVLink sequence numbers.
+        :param src_system: Only report the components of this MAVLink system ID
+        :return: Dict mapping (system ID, component ID) to a dict with the received and lost frames and the
+            bytes received
+        """
+        stats = {}
+        for source, (_, frames, lost, size) in list(self.__sources.items()):
+            system, component = source >> 8, source & 0xFF
+            if src_system is None or system == src_system:
+                stats[(system, component)] = {
+                    "received": frames,
+                    "lost": lost,
+                    "bytes": size,
+                }
+        return stats
@@ -0,0 +1,213 @@
+"""
+Link quality: rolling packet loss and throughput per source component from the MAVLink sequence numbers,
+combined with the RADIO_STATUS reports of SiK telemetry radios, and the back-off of our own outbound rate
+while the radio's transmit buffer is filling up.
+
+RADIO_STATUS.txbuf is the free space left in the radio's transmit buffer in percent, so a low txbuf means
+the radio receives more than it gets on air. As ArduPilot does for its streams, the outbound rate is slowed
+down while txbuf is low and sped up again once the buffer has drained.
+"""
+
+import collections
+import threading
+import time
+
+from log_utils import RateLimitedLog
+
+LINK_QUALITY_WINDOW = 10.0  # seconds loss and throughput are computed over
+# Free transmit buffer in percent: below CRITICAL the outbound interval doubles at every report, below
+# CONGESTED it grows by a quarter and above CLEAR it shrinks back by a quarter
+TXBUF_CRITICAL = 20
+TXBUF_CONGESTED = 50
+TXBUF_CLEAR = 90
+MAX_BACKOFF = 8.0
+# Seconds without RADIO_STATUS after which the back-off is released again
+RADIO_STATUS_TIMEOUT = 5.0
+
+_limited_log = RateLimitedLog()
+
+
+class LinkQualityMonitor:
+    """
+    Tracks the link quality of one vehicle, thread-safe. observe_radio() runs on the reader for every
+    RADIO_STATUS, sample() periodically with the link counters.
+    """
+
+    def __init__(self, window=LINK_QUALITY_WINDOW, max_backoff=MAX_BACKOFF):
+        """
+        :param window: Seconds the loss and throughput are computed over
+        :param max_backoff: Max factor the outbound intervals are stretched by
+        """
+        self.__window = window
+        self.__max_backoff = max_backoff
+        self.__lock = threading.Lock()
+        self.__samples = collections.deque()
+        self.__radio = None
+        self.__radio_seen = None
+        self.__backoff = 1.0
+
+    @property
+    def backoff(self):
+        """
+        Factor to stretch the outbound intervals by, 1 while the radio keeps up.
+        """
+        return self.__backoff
+
+    @property
+    def txbuf(self):
+        """
+        Free transmit buffer of the radio in percent as of its last RADIO_STATUS, None if none was seen.
+        """
+        with self.__lock:
+            return self.__radio.txbuf if self.__radio is not None else None
+
+    def observe_radio(self, msg):
+        """
+        Adapt the back-off to the radio's transmit buffer.
+        :param msg: RADIO_STATUS message
+        :return: The back-off factor
+        """
+        with self.__lock:
+            self.__radio = msg
+            self.__radio_seen = time.monotonic()
+            if msg.txbuf < TXBUF_CRITICAL:
+                backoff = self.__backoff * 2.0
+            elif msg.txbuf < TXBUF_CONGESTED:
+                backoff = self.__backoff * 1.25
+            elif msg.txbuf > TXBUF_CLEAR:
+                backoff = self.__backoff / 1.25
+            else:
+                backoff = self.__backoff
+            self.__backoff = min(max(backoff, 1.0), self.__max_backoff)
+            return self.__backoff
+
+    def sample(self, link_stats, now=None):
+        """
+        Add a sample of the link counters and compute the link health over the window.
+        :param link_stats: Link counters as returned by Boat.link_stats(), None if the link is not open
+        :param now: time.monotonic() of the sample, taken now if not given
+        :return: JSON serializable dict with loss and throughput per source, the last radio status and the
+            back-off factor
+        """
+        now = time.monotonic() if now is None else now
+        with self.__lock:
+            if (
+                self.__radio_seen is not None
+                and now - self.__radio_seen > RADIO_STATUS_TIMEOUT
+            ):
+                # the radio went silent, e.g. swapped for a link without one, do not stay backed off
+                self.__backoff = max(self.__backoff / 1.25, 1.0)
+
+            sequence = link_stats["sequence"] if link_stats is not None else {}
+            samples = self.__samples
+            samples.append((now, sequence))
+            while len(samples) > 1 and now - samples[1][0] >= self.__window:
+                samples.popleft()
+            since, oldest = samples[0]
+            elapsed = now - since
+
+            sources = {}
+            for (system, component), counts in sorted(sequence.items()):
+                before = oldest.get((system, component), {})
+                received = counts["received"] - before.get("received", 0)
+                lost = counts["lost"] - before.get("lost", 0)
+                size = counts["bytes"] - before.get("bytes", 0)
+                if received < 0:
+                    # the link was reopened and counts from zero again
+                    received, lost, size = (
+                        counts["received"],
+                        counts["lost"],
+                        counts["bytes"],
+                    )
+                sources[f"{system}/{component}"] = {
+                    "loss_pct": (
+                        round(100.0 * lost / (received + lost), 2)
+                        if received + lost
+                        else None
+                    ),
+                    "frames_per_s": round(received / elapsed, 2) if elapsed else None,
+                    "bytes_per_s": round(size / elapsed, 1) if elapsed else None,
+                }
+
+            radio = None
+            if self.__radio is not None:
+                msg = self.__radio
+                radio = {
+                    "rssi": msg.rssi,
+                    "remrssi": msg.remrssi,
+                    "noise": msg.noise,
+                    "remnoise": msg.remnoise,
+                    "txbuf": msg.txbuf,
+                    "rxerrors": msg.rxerrors,
+                    "fixed": msg.fixed,
+                    "age_s": round(now - self.__radio_seen, 1),
+                }
+
+            return {
+                "window_s": round(elapsed, 1),
+                "sources": sources,
+                "radio": radio,
+                "backoff": round(self.__backoff, 2),
+            }
+
+
+class OutboundBackoff:
+    """
+    Stretches the override frame interval and the command ack timeout of a vehicle by the back-off of its
+    LinkQualityMonitor while the telemetry radio is congested, thread-safe, as the back-off is applied from
+    the reader on every RADIO_STATUS and from the link health sampling. The keep-alive keeps its period, so
+    ArduPilot does not drop the override.
+    """
+
+    def __init__(
+        self,
+        link_quality,
+        max_override_rate_hz,
+        commands,
+        command_timeout,
+        coalescer=None,
+    ):
+        """
+        :param link_quality: LinkQualityMonitor of the vehicle
+        :param max_override_rate_hz: Max rate of override frames while the radio keeps up
+        :param commands: CommandManager whose ack timeout is stretched
+        :param command_timeout: Ack timeout in seconds while the radio keeps up
+        :param coalescer: Optional LatestValueCoalescer of the control updates, its max rate is slowed down
+        """
+        self.__link_quality = link_quality
+        self.__max_override_rate_hz = max_override_rate_hz
+        self.__commands = commands
+        self.__command_timeout = command_timeout
+        self.__coalescer = coalescer
+        self.__lock = threading.Lock()
+        self.__min_override_interval = 1.0 / max_override_rate_hz
+
+    @property
+    def min_override_interval(self):
+        """
+        Min seconds between two override frames at the current back-off.
+        """
+        return self.__min_override_interval
+
+    def apply(self):
+        """
+        Apply the current back-off of the link quality monitor.
+        """
+        with self.__lock:
+            backoff = self.__link_quality.backoff
+            min_override_interval = backoff / self.__max_override_rate_hz
+            if min_override_interval == self.__min_override_interval:
+                return
+
+            if min_override_interval > self.__min_override_interval:
+                _limited_log.warning(
+                    "radio-congested",
+                    "Telemetry radio congested, %s%% of its buffer free, "
+                    "sending overrides at most at %.1f Hz",
+                    self.__link_quality.txbuf,
+                    1.0 / min_override_interval,
+                )
+            self.__min_override_interval = min_override_interval
+            if self.__coalescer is not None:
+                self.__coalescer.set_max_rate(1.0 / min_override_interval)
+            self.__commands.set_timeout(self.__command_timeout * backoff)
@@ -0,0 +1,153 @@
+"""
+Logging for the hot paths: records are handed to a queue and formatted and written by a listener thread,
+repeated events are rate limited per event key and high-rate events are only counted and reported as
+aggregates, e.g. "RAW_IMU sent 1843 in last 10 s".
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+from scheduler import PeriodicTask
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler leaving the formatting of the message to the listener thread, the logging thread only
+    creates the record. Arguments must not be mutated after they are logged.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level, fmt=LOG_FORMAT):
+    """
+    Route every log record through a queue to a listener thread writing to stderr, so logging threads do
+    not wait for formatting or for the console.
+    :param level: Level of the root logger, e.g. logging.INFO
+    :param fmt: Format of the written records
+    :return: The started QueueListener, stopped and flushed at exit
+    """
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(fmt))
+    listener = logging.handlers.QueueListener(records, handler)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_DeferredQueueHandler(records))
+    root.setLevel(level)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+class RateLimitedLog:
+    """
+    Logs an event at most once per interval, counting the repetitions suppressed in between and reporting
+    them with the next record of the event.
+    """
+
+    def __init__(self, logger=None, interval=10.0):
+        """
+        :param logger: Logger to write to, the root logger if not given
+        :param interval: Min seconds between two records of the same event
+        """
+        self.__logger = logger or logging.getLogger()
+        self.__interval = interval
+        self.__lock = threading.Lock()
+        self.__events = {}
+
+    def log(self, level, key, msg, *args):
+        """
+        :param level: Log level, e.g. logging.WARNING
+        :param key: Event key, records with the same key are rate limited together
+        :param msg: Format string, formatted with args only when the record is written
+        """
+        if not self.__logger.isEnabledFor(level):
+            return
+
+        now = time.monotonic()
+        with self.__lock:
+            last, suppressed = self.__events.get(key, (None, 0))
+            if last is not None and now - last < self.__interval:
+                self.__events[key] = (last, suppressed + 1)
+                return
+            self.__events[key] = (now, 0)
+
+        if suppressed:
+            msg += " (%d more in last %.3g s)"
+            args += (suppressed, now - last)
+        self.__logger.log(level, msg, *args)
+
+    def info(self, key, msg, *args):
+        self.log(logging.INFO, key, msg, *args)
+
+    def warning(self, key, msg, *args):
+        self.log(logging.WARNING, key, msg, *args)
+
+    def error(self, key, msg, *args):
+        self.log(logging.ERROR, key, msg, *args)
+
+
+class EventCounters:
+    """
+    Counts high-rate events by name and logs one aggregate record per name and interval instead of one per
+    event, thread-safe.
+    """
+
+    def __init__(
+        self, description, interval=10.0, level=logging.INFO, logger=None, name=None
+    ):
+        """
+        :param description: Format of the event name in the report, e.g. "%s sent"
+        :param interval: Seconds between reports
+        :param level: Level of the report records
+        :param logger: Logger to write to, the root logger if not given
+        :param name: Name of the reporting thread
+        """
+        self.__description = description + " %d in last %.3g s"
+        self.__level = level
+        self.__logger = logger or logging.getLogger()
+        self.__lock = threading.Lock()
+        self.__counts = {}
+        self.__since = time.monotonic()
+        self.__report = PeriodicTask(
+            self.report, interval, name=name or "event-counters"
+        )
+
+    def count(self, event, n=1):
+        """
+        :param event: Event name, e.g. the message type
+        :param n: Number of events
+        """
+        with self.__lock:
+            self.__counts[event] = self.__counts.get(event, 0) + n
+
+    def report(self):
+        """
+        Log and reset the counts collected since the last report, run periodically once started.
+        """
+        now = time.monotonic()
+        with self.__lock:
+            counts, self.__counts = self.__counts, {}
+            since, self.__since = self.__since, now
+
+        if not self.__logger.isEnabledFor(self.__level):
+            return
+        for event, n in sorted(counts.items()):
+            self.__logger.log(self.__level, self.__description, event, n, now - since)
+
+    def start(self):
+        self.__report.start()
+
+    def stop(self):
+        self.__report.stop()
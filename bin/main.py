@@ -2,202 +2,524 @@
 Utility tool for connecting MAVlink flight controller to Keelson.
 """
 
+import asyncio
+import time
 import zenoh
 import logging
 import warnings
 import atexit
 import json
-import time
 import keelson
 import boat
 
-from utils import map_value
+from functools import partial
+
+from calibration import load_calibration
+from dispatcher import MessageDispatcher, message_id
+from policies import load_policies, policy_filtered
+from telemetry import TELEMETRY_REGISTRY, TelemetryEncoder
+from batching import TelemetryBatch, batch_subject, flush_due
+from passthrough import RawFramePublisher
+from stream_rates import parse_stream_rate
+from mixer import load_mixer_config
+from async_runtime import AsyncConnector
+from fleet import Fleet
+from commands import result_name
+from actuators import ACTUATORS, ActuatorDispatcher
+from log_utils import EventCounters, setup_logging
+from metrics import MetricsReport, PrometheusEndpoint, TelemetryMetrics
+from recording import Recorder
 from terminal_inputs import terminal_inputs
 
 from keelson.payloads.TimestampedFloat_pb2 import TimestampedFloat
 from keelson.payloads.TimestampedString_pb2 import TimestampedString
-from keelson.payloads.ImuReading_pb2 import ImuReading
-from keelson.payloads.Experimental_FlightControllerTelemetry_pb2 import (
-    VFRHUD,
-    RawIMU,
-    AHRS,
-    Vibration,
-    BatteryStatus,
-)
 
 vehicle = None
-sub_rudder_listener = None
+calibration = None
+metrics_endpoint = None
+# the rudder subscriber of each vehicle, replaced or undeclared through its set_rudder_listener queryable,
+# None is the key of the single vehicle
+rudder_listeners = {}
 session = None
 
-msg_types = ["VFR_HUD", "RAW_IMU", "AHRS", "VIBRATION", "BATTERY_STATUS"]
+LEVER_FULL_SCALE = 99  # lever positions span -99 to 99
 
+# published telemetry is reported as counts per message type instead of a record per message
+telemetry_sent = EventCounters("%s sent", name="telemetry-sent-report")
 
-def query_set_rudder_prc(query):
-    """
-    Set rudder angle in percentage with query either for combined, port or starboard rudder
 
-    """
-    global vehicle
+def query_set_rudder_listener(query, target=None):
+    logging.debug(">> [Queryable Rudder] Received Query '%s'", query)
 
     key_exp = str(query.selector)
-    rudder_id = key_exp.split("/")[5]
-    logging.debug(
-        f">> [Queryable Rudder] Received Query '{query.selector}' for rudder {rudder_id}"
-    )
 
     values = query.value
     received_at, enclosed_at, content = keelson.uncover(values.payload)
-    rudder_input = TimestampedFloat.FromString(content)
+    message = TimestampedString.FromString(content)
+    new_key = message.value
 
-    if rudder_id == "*":  # Rudder combined
-        logging.debug(
-            f">> [Queryable Rudder] COMBI rudder angle in percentage-100 port 100 starboard '{rudder_input}'"
-        )
-        vehicle.set_rudder(rudder_input)
-        # TODO: Implement rudder control forwarding to MAVlink
+    logging.debug(">> [SET Sub Rudder] New key: %s", new_key)
 
-    elif rudder_id == "0":  # Port rudder
-        logging.debug(
-            f">> [Queryable Rudder] PORT rudder angle in percentage -100 port 100 starboard  '{rudder_input}'"
-        )
-        # TODO: Implement rudder control forwarding to MAVlink
+    if len(new_key) > 5:
+        logging.debug("Setting up RUDDER subscriber: %s", new_key)
 
-    elif rudder_id == "0":  # Starboard rudder
-        logging.debug(
-            f">> [Queryable Rudder] STARBOARD rudder angle in percentage -100 port 100 starboard '{rudder_input}'"
+        rudder_listeners[target] = session.declare_subscriber(
+            new_key,
+            partial(subscriber_rudder, target=target),
         )
-        # TODO: Implement rudder control forwarding to MAVlink
+    else:
+        logging.debug("Undeclaring RUDDER subscriber: %s", new_key)
+        try:
+            rudder_listeners.pop(target).undeclare()
+        except Exception as e:
+            logging.error("Error undeclaring sub_rudder_listner: %s", e)
+
+    # query.reply(zenoh.Sample(key_exp, 'OK'))
+
+
+def subscriber_rudder(data, target=None):
+    res = keelson.uncover(data.payload)
+
+    # create base payload, so we can add the actual values from the received brefv payload
+    payload = TimestampedFloat()
+    payload.ParseFromString(res[2])
+
+    logging.debug(">> [Subscriber Rudder] Received value %s", payload.value)
+    # map the lever position from keelson steering thing through the rudder's calibration curve to a value
+    # that the ardupilot understands when we override the rc channel
+    (target or vehicle).set_rudder(
+        calibration.to_pwm("rudder", payload.value * 100 / LEVER_FULL_SCALE)
+    )
+
 
-    # TODO: Respond with actual set value
-    query.respond(zenoh.StatusCode.OK, None)
+def subscriber_engine(data, target=None):
+    res = keelson.uncover(data.payload)
+    # create base payload, so we can add the actual values from the received brefv payload
+    payload = TimestampedFloat()
+    payload.ParseFromString(res[2])
+
+    logging.debug(">> [Subscriber Engine] Received value %s", payload.value)
 
+    # map the lever position from keelson steering thing through the throttle's calibration curve to a value
+    # that the ardupilot understands when we override the rc channel
+    (target or vehicle).set_throttle(
+        calibration.to_pwm("throttle", payload.value * 100 / LEVER_FULL_SCALE)
+    )
 
-def query_set_engine_prc(query):
+
+def publish_telemetry(publisher, encoder, batch, metrics, msg):
     """
-    Set engine power in percentage with query either for combined, port or starboard engine
+    Refill the stream's pooled protobuf payload from a MAVLink telemetry message and publish it,
+    adding it to the stream's batch too when batching is enabled.
     """
-    key_exp = str(query.selector)
-    engine_id = key_exp.split("/")[5]
-    logging.debug(
-        f">> [Queryable ENGINE] Received Query '{query.selector}' for engine {engine_id}"
-    )
+    started = time.perf_counter()
+    envelope = encoder.encode(msg)
+    encoded = time.perf_counter()
+    publisher.put(envelope)
+    if metrics is not None:
+        metrics.published(msg, encoded - started, time.perf_counter() - encoded)
+    if batch is not None:
+        batch.add(envelope)
+    telemetry_sent.count(msg.get_type())
+
+
+def declare_metrics(session, args, entity_id, target):
+    """
+    Collect the telemetry metrics of a vehicle when a metrics summary or the Prometheus endpoint is enabled,
+    publishing the summary as JSON every metrics interval.
+    :param target: The Boat or AsyncConnector whose link counters are reported
+    :return: The vehicle's TelemetryMetrics, None if metrics are disabled
+    """
+    if not args.metrics_interval and metrics_endpoint is None:
+        return None
 
-    values = query.value
-    received_at, enclosed_at, content = keelson.uncover(values.payload)
-    engine_input = TimestampedFloat.FromString(content)
+    metrics = TelemetryMetrics()
+    if metrics_endpoint is not None:
+        metrics_endpoint.add({"entity": entity_id}, metrics, target.link_stats)
 
-    if engine_id == "*":  # Engine combined
-        logging.debug(
-            f">> [Queryable ENGINE] COMBINED power in percentage -100 astern 100 ahead '{engine_input}'"
+    if args.metrics_interval:
+        pubkey = keelson.construct_pub_sub_key(
+            realm=args.realm,
+            entity_id=entity_id,
+            subject="connector_metrics",
+            source_id="speedybee",
         )
-        # TODO: Implement control forwarding to MAVlink
+        publisher = session.declare_publisher(pubkey)
+        logging.info("Declared METRICS publisher: %s", pubkey)
 
-    elif engine_id == "0":  # Port
-        logging.debug(
-            f">> [Queryable ENGINE] PORT power in percentage -100 astern 100 ahead '{engine_input}'"
+        def _publish(summary):
+            payload = TimestampedString()
+            payload.timestamp.FromNanoseconds(time.time_ns())
+            payload.value = summary
+            publisher.put(keelson.enclose(payload.SerializeToString()))
+
+        # the reporting thread keeps the report and its publisher referenced
+        MetricsReport(
+            metrics,
+            target.link_stats,
+            _publish,
+            args.metrics_interval,
+            name=f"metrics-report-{entity_id}",
+        ).start()
+
+    return metrics
+
+
+def declare_telemetry(session, args, entity_id, metrics=None):
+    """
+    Declare the publishers of every enabled telemetry stream and register their handlers.
+    Declare the raw MAVLink passthrough publisher too when enabled.
+    :param metrics: Optional TelemetryMetrics counting the messages received and published
+    :return: The message dispatcher, the list of telemetry batches to flush and the RawFramePublisher
+        to set as the link's raw forwarder, None if the passthrough is disabled
+    """
+    policies = load_policies(args.policy, args.policy_file)
+    batched = {msg_type.upper() for msg_type in args.batch or ()}
+    batches = []
+    dispatcher = MessageDispatcher(
+        observer=metrics.received if metrics is not None else None
+    )
+
+    for msg_type in args.telemetry:
+        if msg_type not in TELEMETRY_REGISTRY:
+            raise ValueError(
+                f"No telemetry mapping for {msg_type}, known: {list(TELEMETRY_REGISTRY)}"
+            )
+        stream = TELEMETRY_REGISTRY[msg_type]
+        pubkey = keelson.construct_pub_sub_key(
+            realm=args.realm,
+            entity_id=entity_id,
+            subject=stream.subject,
+            source_id="speedybee",
         )
-        # TODO: Implement control forwarding to MAVlink
+        publisher = session.declare_publisher(pubkey)
+        logging.info("Declared TELEMETRY publisher: %s", pubkey)
 
-    elif engine_id == "0":  # Starboard
-        logging.debug(
-            f">> [Queryable ENGINE] STARBOARD power in percentage -100 astern 100 ahead '{engine_input}'"
+        batch = None
+        if msg_type in batched:
+            # Own subject for the batched stream, per-sample key stays for low latency
+            batch_pubkey = keelson.construct_pub_sub_key(
+                realm=args.realm,
+                entity_id=entity_id,
+                subject=batch_subject(stream.subject),
+                source_id="speedybee",
+            )
+            batch = TelemetryBatch(
+                session.declare_publisher(batch_pubkey),
+                max_count=args.batch_count,
+                window=args.batch_window_ms / 1000,
+            )
+            batches.append(batch)
+            logging.info("Declared TELEMETRY batch publisher: %s", batch_pubkey)
+
+        handler = partial(
+            publish_telemetry, publisher, TelemetryEncoder(stream), batch, metrics
+        )
+        if stream.subject in policies:
+            logging.info("Applying publish policy to %s", stream.subject)
+            handler = policy_filtered(handler, policies[stream.subject])
+        dispatcher.register(msg_type, handler)
+
+    raw = None
+    if args.raw_passthrough is not None:
+        raw_pubkey = keelson.construct_pub_sub_key(
+            realm=args.realm,
+            entity_id=entity_id,
+            subject="raw",
+            source_id="speedybee/mavlink",
         )
-        # TODO: Implement control forwarding to MAVlink
+        raw = RawFramePublisher(
+            session.declare_publisher(raw_pubkey),
+            msg_ids=[message_id(msg_type) for msg_type in args.raw_passthrough] or None,
+        )
+        logging.info("Declared RAW MAVLink publisher: %s", raw_pubkey)
 
-    # TODO: Respond with actual set value
-    query.respond(zenoh.StatusCode.OK, None)
+    return dispatcher, batches, raw
 
 
-def query_set_thruster_prc(query):
+def declare_link_state(session, args, entity_id, target):
     """
-    Set thruster power in percentage with query either for combined, bow or stern
+    Publish the MAVLink link state of a vehicle, now and whenever it is lost or restored.
+    :param target: The Boat or AsyncConnector whose link is reported
+    :return: The link state publisher
     """
-    key_exp = str(query.selector)
-    thruster_id = key_exp.split("/")[5]
-    logging.debug(
-        f">> [Queryable THRUSTER] Received Query '{query.selector}' for thruster {thruster_id}"
+    pubkey = keelson.construct_pub_sub_key(
+        realm=args.realm,
+        entity_id=entity_id,
+        subject="flight_controller_link_state",
+        source_id="speedybee",
     )
+    publisher = session.declare_publisher(pubkey)
+    logging.info("Declared LINK STATE publisher: %s", pubkey)
 
-    values = query.value
-    received_at, enclosed_at, content = keelson.uncover(values.payload)
-    thruster_input = TimestampedFloat.FromString(content)
+    def _publish(link_state):
+        payload = TimestampedString()
+        payload.timestamp.FromNanoseconds(time.time_ns())
+        payload.value = link_state.name.lower()
+        publisher.put(keelson.enclose(payload.SerializeToString()))
 
-    if thruster_id == "*":  # Combined
-        logging.debug(
-            f">> [Queryable THRUSTER] COMBINED power in percentage -100 moving vessel to port to 100 moving vessel to starboard '{thruster_input}'"
+    target.add_link_state_listener(_publish)
+    _publish(target.link_state)
+    return publisher
+
+
+def declare_link_health(session, args, entity_id, target):
+    """
+    Publish the link health of a vehicle as JSON at every link health sample.
+    :param target: The Boat or AsyncConnector whose link is reported
+    :return: The link health publisher
+    """
+    pubkey = keelson.construct_pub_sub_key(
+        realm=args.realm,
+        entity_id=entity_id,
+        subject="flight_controller_link_health",
+        source_id="speedybee",
+    )
+    publisher = session.declare_publisher(pubkey)
+    logging.info("Declared LINK HEALTH publisher: %s", pubkey)
+
+    def _publish(health):
+        payload = TimestampedString()
+        payload.timestamp.FromNanoseconds(time.time_ns())
+        payload.value = json.dumps(health)
+        publisher.put(keelson.enclose(payload.SerializeToString()))
+
+    target.add_link_health_listener(_publish)
+    return publisher
+
+
+def declare_actuator_queryables(session, args, entity_id, target):
+    """
+    Serve the rudder, engine and thruster queryables of a vehicle, combined and per side, from one
+    dispatch table.
+    :param target: The Boat or AsyncConnector the actuators are set on
+    :return: The queryables
+    """
+    dispatcher = ActuatorDispatcher(target, calibration)
+    queryables = []
+    for kind, (procedure, sides) in ACTUATORS.items():
+        for side, control_targets in sides.items():
+            dispatcher.add_route(
+                keelson.construct_req_rep_key(
+                    realm=args.realm,
+                    entity_id=entity_id,
+                    responder_id=f"{kind}/{side}",
+                    procedure=procedure,
+                ),
+                control_targets,
+            )
+
+        # one wildcard queryable per kind, the combined key itself is the wildcard
+        key_exp = keelson.construct_req_rep_key(
+            realm=args.realm,
+            entity_id=entity_id,
+            responder_id=f"{kind}/*",
+            procedure=procedure,
         )
-        # TODO: Implement control forwarding to MAVlink
+        logging.info("Setting up %s queryable: %s", kind.upper(), key_exp)
+        queryables.append(session.declare_queryable(key_exp, dispatcher.handle, False))
 
-    elif thruster_id == "0":  # Bow
-        logging.debug(
-            f">> [Queryable THRUSTER] BOW power in percentage -100 moving vessel to port to 100 moving vessel to starboard '{thruster_input}'"
+    return queryables
+
+
+def declare_propulsion_queryable(session, args, entity_id, target):
+    """
+    Serve set_state_of_propulsion_system: a TimestampedString "on" or "off" switches the propulsion relay and
+    the reply, a TimestampedString with the MAV_RESULT name, is sent once the vehicle acknowledged the command.
+    Nothing blocks the Zenoh thread while the command is in flight.
+    :param target: The Boat or AsyncConnector whose propulsion is switched
+    :return: The queryable
+    """
+    key_exp = keelson.construct_req_rep_key(
+        realm=args.realm,
+        entity_id=entity_id,
+        responder_id="propulsion",
+        procedure="set_state_of_propulsion_system",
+    )
+
+    def _reply(query, future):
+        # not re-raising the error keeps the traceback from holding on to the query, which is only
+        # finalized once it is no longer referenced
+        if future.cancelled():
+            query.reply_err("Connection closed")
+            return
+        if future.exception() is not None:
+            query.reply_err(str(future.exception()))
+            return
+
+        payload = TimestampedString()
+        payload.timestamp.FromNanoseconds(time.time_ns())
+        payload.value = result_name(future.result())
+        query.reply(
+            zenoh.Sample(
+                str(query.key_expr), keelson.enclose(payload.SerializeToString())
+            )
         )
-        # TODO: Implement control forwarding to MAVlink
 
-    elif thruster_id == "0":  # Stern
+    def _query(query):
+        received_at, enclosed_at, content = keelson.uncover(query.value.payload)
+        state = TimestampedString.FromString(content).value.strip().lower()
         logging.debug(
-            f">> [Queryable THRUSTER] STERN power in percentage -100 moving vessel to port to 100 moving vessel to starboard '{thruster_input}'"
+            ">> [Queryable PROPULSION] Received Query '%s': %s",
+            query.selector,
+            state,
         )
-        # TODO: Implement control forwarding to MAVlink
 
-    # TODO: Respond with actual set value
-    query.respond(zenoh.StatusCode.OK, None)
+        if state == "on":
+            future = target.enable_propulsion()
+        elif state == "off":
+            future = target.disable_propulsion()
+        else:
+            query.reply_err(f"Expected on or off, got: {state}")
+            return
 
+        # the query is answered from whichever thread resolves the future, the reader or the retry timer
+        future.add_done_callback(partial(_reply, query))
 
-def query_set_rudder_listener(query):
-    global sub_rudder_listener, session
-    logging.debug(f">> [Queryable Rudder] Received Query '{query}'")
+    logging.info("Setting up PROPULSION queryable: %s", key_exp)
+    return session.declare_queryable(key_exp, _query, False)
 
-    key_exp = str(query.selector)
 
-    values = query.value
-    received_at, enclosed_at, content = keelson.uncover(values.payload)
-    message = TimestampedString.FromString(content)
-    new_key = message.value
+def stream_rates_from_args(args):
+    """
+    :return: Dict mapping MAVLink message name to the rate in Hz to request from the autopilot
+    """
+    rates = {}
+    if args.stream_rate_hz > 0:
+        rates = dict.fromkeys(args.telemetry, args.stream_rate_hz)
 
-    logging.debug(f">> [SET Sub Rudder] New key: {new_key}")
+    for spec in args.stream_rate or ():
+        msg_type, rate = parse_stream_rate(spec)
+        rates[msg_type] = rate
 
-    if len(new_key) > 5:
-        logging.debug(f"Setting up RUDDER subscriber: {new_key}")
+    return rates
 
-        sub_rudder_listener = session.declare_subscriber(
-            new_key,
-            subscriber_rudder,
-        )
-    else:
-        logging.debug(f"Undeclaring RUDDER subscriber: {new_key}")
-        try:
-            sub_rudder_listener.undeclare()
-        except Exception as e:
-            logging.error(f"Error undeclaring sub_rudder_listner: {e}")
 
-    # query.reply(zenoh.Sample(key_exp, 'OK'))
+def declare_lever_subscribers(session, args, entity_id, target=None):
+    """
+    Subscribe to the rudder and engine lever positions of an entity.
+    :param target: The Boat the levers control, the global vehicle if not given
+    :return: The rudder and engine subscribers
+    """
+    key_exp_sub_rudder = keelson.construct_pub_sub_key(
+        realm=args.realm,
+        entity_id=entity_id,
+        subject="lever_position_pct",
+        source_id="arduino/right/azimuth/horizontal/on_change",
+    )
+    logging.info("Setting up RUDDER subscriber: %s", key_exp_sub_rudder)
+    sub_rudder = session.declare_subscriber(
+        key_exp_sub_rudder,
+        partial(subscriber_rudder, target=target),
+    )
 
+    key_exp_sub_engine = keelson.construct_pub_sub_key(
+        realm=args.realm,
+        entity_id=entity_id,
+        subject="lever_position_pct",
+        source_id="arduino/right/azimuth/vertical/on_change",
+    )
+    logging.info("Setting up ENGINE subscriber: %s", key_exp_sub_engine)
+    sub_engine = session.declare_subscriber(
+        key_exp_sub_engine,
+        partial(subscriber_engine, target=target),
+    )
 
-def subscriber_rudder(data):
-    res = keelson.uncover(data.payload)
+    return sub_rudder, sub_engine
 
-    # create base payload, so we can add the actual values from the received brefv payload
-    payload = TimestampedFloat()
-    payload.ParseFromString(res[2])
 
-    logging.debug(f">> [Subscriber Rudder] Received value {payload.value}")
-    # map the 0-100 value from keelson steering thing to value that the ardupilot understands when we override
-    # the rc channel
-    vehicle.set_rudder(map_value(payload.value, -99, 99, 1100, 1900))
+def declare_rudder_listener_queryable(session, args, entity_id, target=None):
+    """
+    Let the rudder subscriber of an entity be moved to another key, or undeclared, through a query.
+    :param target: The Boat the rudder subscriber controls, the global vehicle if not given
+    :return: The queryable
+    """
+    key_exp_lister_rudder = keelson.construct_req_rep_key(
+        realm=args.realm,
+        entity_id=entity_id,
+        responder_id="rudder/*",
+        procedure="set_rudder_listener",
+    )
+    logging.info("Setting up RUDDER queryable: %s", key_exp_lister_rudder)
 
+    return session.declare_queryable(
+        key_exp_lister_rudder,
+        partial(query_set_rudder_listener, target=target),
+        False,
+    )
 
-def subscriber_engine(data):
-    res = keelson.uncover(data.payload)
-    # create base payload, so we can add the actual values from the received brefv payload
-    payload = TimestampedFloat()
-    payload.ParseFromString(res[2])
 
-    logging.debug(f">> [Subscriber Engine] Received value {payload.value}")
+def parse_vehicle_entities(specs, default_entity_id):
+    """
+    :param specs: List of "SYSID=ENTITY" strings
+    :param default_entity_id: Prefix of the entity of unlisted vehicles
+    :return: Function mapping a MAVLink system ID to its entity id
+    """
+    entities = {}
+    for spec in specs or ():
+        system_id, sep, entity_id = spec.partition("=")
+        if not sep or not entity_id:
+            raise ValueError(f"Expected SYSID=ENTITY, got: {spec}")
+        entities[int(system_id)] = entity_id.strip()
 
-    # map the 0-100 value from keelson steering thing to value that the ardupilot understands when we override
-    # the rc channel
-    vehicle.set_throttle(map_value(payload.value, -99, 99, 1100, 1900))
+    return lambda system_id: entities.get(system_id, f"{default_entity_id}_{system_id}")
+
+
+def run_fleet(session, args, fleet):
+    """
+    Serve every vehicle on the shared link, declaring a vehicle's publishers and subscribers under its own
+    entity when its first message is taken.
+    """
+    entity_of = parse_vehicle_entities(args.vehicle_entity, args.entity_id)
+    stream_rates = stream_rates_from_args(args)
+    dispatchers = {}
+    batches = []
+    declared = []  # kept referenced, a dropped publisher or subscriber is undeclared
+
+    while True:
+        target, msg = fleet.get_message(timeout=flush_due(batches))
+        if msg is None:
+            continue
+
+        dispatcher = dispatchers.get(target)
+        if dispatcher is None:
+            entity_id = entity_of(target.target_system)
+            logging.info(
+                "Serving MAVLink system %s as entity %s",
+                target.target_system,
+                entity_id,
+            )
+            metrics = declare_metrics(session, args, entity_id, target)
+            dispatcher, vehicle_batches, raw = declare_telemetry(
+                session, args, entity_id, metrics
+            )
+            if raw is not None:
+                fleet.add_raw_forwarder(target.target_system, raw)
+            if not dispatchers:
+                # Every vehicle is served with the same streams, skip decoding the rest
+                fleet.set_message_filter(dispatcher.message_ids)
+            dispatchers[target] = dispatcher
+            batches.extend(vehicle_batches)
+            if stream_rates:
+                target.set_stream_rates(stream_rates, args.disable_unused_streams)
+            declared.append(declare_link_state(session, args, entity_id, target))
+            declared.append(declare_link_health(session, args, entity_id, target))
+            declared.append(
+                declare_propulsion_queryable(session, args, entity_id, target)
+            )
+            declared.extend(
+                declare_actuator_queryables(session, args, entity_id, target)
+            )
+            declared.append(
+                declare_rudder_listener_queryable(session, args, entity_id, target)
+            )
+            if args.subscribe:
+                rudder_listeners[target], sub_engine = declare_lever_subscribers(
+                    session, args, entity_id, target
+                )
+                declared.append(sub_engine)
+
+        dispatcher.dispatch(msg)
 
 
 """
@@ -208,12 +530,14 @@ if __name__ == "__main__":
     # Input arguments and configurations
     args = terminal_inputs()
 
-    # Setup logger
-    logging.basicConfig(
-        format="%(asctime)s %(levelname)s %(name)s %(message)s", level=args.log_level
-    )
+    # Setup logger, records are written by a listener thread off the control and telemetry paths
+    setup_logging(args.log_level)
     logging.captureWarnings(True)
     warnings.filterwarnings("once")
+    telemetry_sent.start()
+
+    # Actuator calibration curves, evaluated into lookup tables once
+    calibration = load_calibration(args.calibration_file)
 
     ## Construct session
     logging.info("Opening Zenoh session...")
@@ -228,277 +552,162 @@ if __name__ == "__main__":
 
     atexit.register(_on_exit)
 
-    logging.info(f"Zenoh session: {session.info()}")
+    logging.info("Zenoh session: %s", session.info())
+
+    if args.metrics_port is not None:
+        metrics_endpoint = PrometheusEndpoint(args.metrics_port)
+        metrics_endpoint.start()
+        logging.info("Serving metrics on port %d at /metrics", args.metrics_port)
+
+    # Raw MAVLink stream recorded for replay with -di replay:PATH
+    recorder = None
+    if args.record is not None:
+        recorder = Recorder(args.record)
+        atexit.register(recorder.close)
+        logging.info("Recording the MAVLink stream to %s", args.record)
 
     # CONNECT TO MAVLINK supported FLIGHT CONTROLLER
-    try:
-        vehicle = boat.Boat(connection_string=args.device_id, baud=115200)
-        # vehicle.connect() # no longer needed as the boat connects automatically now
-        vehicle.wait_for_heartbeat()  # blocking
+    if args.multi_vehicle:
+        # Vehicles are created as their heartbeats arrive, nothing is armed automatically
+        vehicle = Fleet(
+            args.device_id,
+            baud=115200,
+            queue_size=args.vehicle_queue_size,
+            max_override_rate_hz=args.max_override_rate,
+            keep_alive_period=args.override_keep_alive,
+            heartbeat_timeout=args.heartbeat_timeout,
+            mixer_config=load_mixer_config(args.rc_channel, args.mixer_file),
+            link_health_period=args.link_health_period,
+            recorder=recorder,
+        )
+        vehicle.start()
+
+    elif args.runtime == "asyncio":
+        # Connects, waits for the heartbeat and arms from within the event loop
+        vehicle = AsyncConnector(
+            args.device_id,
+            baud=115200,
+            max_override_rate_hz=args.max_override_rate,
+            keep_alive_period=args.override_keep_alive,
+            heartbeat_timeout=args.heartbeat_timeout,
+            max_reconnect_backoff=args.max_reconnect_backoff,
+            stream_rates=stream_rates_from_args(args),
+            disable_unused_streams=args.disable_unused_streams,
+            mixer_config=load_mixer_config(args.rc_channel, args.mixer_file),
+            link_health_period=args.link_health_period,
+            recorder=recorder,
+        )
+        link_state_publisher = declare_link_state(
+            session, args, args.entity_id, vehicle
+        )
+        link_health_publisher = declare_link_health(
+            session, args, args.entity_id, vehicle
+        )
+
+    else:
+        # A device that is not there yet, e.g. not plugged in, is retried with backoff instead of carrying on
+        # without a vehicle
+        backoff = boat.RECONNECT_INITIAL_BACKOFF
+        while vehicle is None:
+            try:
+                vehicle = boat.Boat(
+                    connection_string=args.device_id,
+                    baud=115200,
+                    max_override_rate_hz=args.max_override_rate,
+                    keep_alive_period=args.override_keep_alive,
+                    heartbeat_timeout=args.heartbeat_timeout,
+                    max_reconnect_backoff=args.max_reconnect_backoff,
+                    mixer_config=load_mixer_config(args.rc_channel, args.mixer_file),
+                    link_health_period=args.link_health_period,
+                    recorder=recorder,
+                )
+            except Exception as e:
+                logging.error(
+                    "Error connecting to flight controller: %s, retrying in %.1f s",
+                    e,
+                    backoff,
+                )
+                time.sleep(backoff)
+                backoff = min(backoff * 2, args.max_reconnect_backoff)
+
+        link_state_publisher = declare_link_state(
+            session, args, args.entity_id, vehicle
+        )
+        link_health_publisher = declare_link_health(
+            session, args, args.entity_id, vehicle
+        )
 
-        if not vehicle.heart_beat_received:
-            raise TimeoutError("Timed out waiting for heartbeat from FlightController")
+        # vehicle.connect() # no longer needed as the boat connects automatically now
+        # the link supervisor keeps reopening the link meanwhile, and the link state is published
+        while not vehicle.wait_for_heartbeat(timeout=args.heartbeat_timeout):
+            logging.warning("No heartbeat from FlightController yet, still trying")
 
         if not vehicle.is_armed():
             vehicle.arm_vehicle()
 
-    except Exception as e:
-        logging.error("Error connecting to flight controller: %s", e)
-
     # Keelson setup queryable and subscriber
     try:
-        ### RUDDER ###
-
-        # SET ANGLE QUERYABLE
-        key_exp_set_rudder = keelson.construct_req_rep_key(
-            realm=args.realm,
-            entity_id=args.entity_id,
-            responder_id="rudder/*",
-            procedure="set_rudder_angle_pct",
-        )
-        logging.info(f"Setting up RUDDER queryable: {key_exp_set_rudder}")
-        queryable_set_rudder_angle = session.declare_queryable(
-            key_exp_set_rudder, query_set_rudder_prc, False
-        )
+        ### RUDDER, ENGINE AND THRUSTER ###
 
-        # SET RUDDER LISTENER QUERYABLE
-        key_exp_lister_rudder = keelson.construct_req_rep_key(
-            realm=args.realm,
-            entity_id=args.entity_id,
-            responder_id="rudder/*",
-            procedure="set_rudder_listener",
-        )
-        logging.info(f"Setting up RUDDER queryable: {key_exp_lister_rudder}")
-
-        queryable_set_listener_rudder = session.declare_queryable(
-            key_exp_lister_rudder,
-            query_set_rudder_listener,
-            False,
-        )
-
-        if args.subscribe:
-            # # Setting default subscribers
-            key_exp_sub_rudder = keelson.construct_pub_sub_key(
-                realm=args.realm,
-                entity_id=args.entity_id,
-                subject="lever_position_pct",
-                source_id="arduino/right/azimuth/horizontal/on_change",
-            )
-            logging.info(f"Setting up RUDDER subscriber: {key_exp_sub_rudder}")
-            sub_rudder_listener = session.declare_subscriber(
-                key_exp_sub_rudder,
-                subscriber_rudder,
+        # SET ANGLE AND POWER QUERYABLES, combined and per side
+        if vehicle is not None and not args.multi_vehicle:
+            actuator_queryables = declare_actuator_queryables(
+                session, args, args.entity_id, vehicle
             )
 
-            key_exp_sub_engine = keelson.construct_pub_sub_key(
-                realm=args.realm,
-                entity_id=args.entity_id,
-                subject="lever_position_pct",
-                source_id="arduino/right/azimuth/vertical/on_change",
+        # SET RUDDER LISTENER QUERYABLE, per vehicle entity in multi-vehicle mode
+        if not args.multi_vehicle:
+            queryable_set_listener_rudder = declare_rudder_listener_queryable(
+                session, args, args.entity_id
             )
-            logging.info(f"Setting up ENGIEN subscriber: {key_exp_sub_rudder}")
-            sub_engine_listener = session.declare_subscriber(
-                key_exp_sub_engine,
-                subscriber_engine,
+
+        if args.subscribe and not args.multi_vehicle:
+            # # Setting default subscribers
+            rudder_listeners[None], sub_engine_listener = declare_lever_subscribers(
+                session, args, args.entity_id
             )
 
         #  sub_rudder_listner.undeclare()
 
-        ### ENGINE ###
-
-        # # Set
-        # queryable_set_engine_0 = session.declare_queryable(
-        #     key_req_rep + "/set_engine_power_percentage/engine/0",
-        #     query_set_engine_prc,
-        #     False,
-        # )
-        # queryable_set_engine_1 = session.declare_queryable(
-        #     key_req_rep + "/set_engine_power_percentage/engine/1",
-        #     query_set_engine_prc,
-        #     False,
-        # )
-        # queryable_set_engine_0_and_1 = session.declare_queryable(
-        #     key_req_rep + "/set_engine_power_percentage/engine/combined",
-        #     query_set_engine_prc,
-        #     False,
-        # )
-
-        # # Set BOW THRUSTERS
-        # queryable_set_engine_0 = session.declare_queryable(
-        #     key_req_rep + "/set_thruster_power_percentage/thruster/0",
-        #     query_set_rudder_prc,
-        #     False,
-        # )
-        # queryable_set_engine_1 = session.declare_queryable(
-        #     key_req_rep + "/set_thruster_power_percentage/thruster/1",
-        #     query_set_rudder_prc,
-        #     False,
-        # )
-        # queryable_set_engine_0_and_1 = session.declare_queryable(
-        #     key_req_rep + "/set_thruster_power_percentage/thruster/combined",
-        #     query_set_rudder_prc,
-        #     False,
-        # )
-
-        # # Set GENERAL SYSTEMS
-        # queryable_set_state_of_propulsion_system = session.declare_queryable(
-        #     key_req_rep + "/set_state_of_propulsion_system", query_set_rudder_prc, False
-        # )
-
-        # VFR_HUD
-        pubkey_vfrhud = keelson.construct_pub_sub_key(
-            realm=args.realm,
-            entity_id=args.entity_id,
-            subject="flight_controller_telemetry_vfrhud",
-            source_id="speedybee",
-        )
-        pub_vfrhud = session.declare_publisher(pubkey_vfrhud)
-        logging.info(f"Decler up TELEMETRY publisher: {pub_vfrhud}")
-
-        # RAW_IMU (OK)
-        pubkey_rawimu = keelson.construct_pub_sub_key(
-            realm=args.realm,
-            entity_id=args.entity_id,
-            subject="flight_controller_telemetry_rawimu",
-            source_id="speedybee",
-        )
-        pub_rawimu = session.declare_publisher(pubkey_rawimu)
-        logging.info(f"Decler up TELEMETRY publisher: {pub_rawimu}")
-        
-        # AHRS (OK)
-        pubkey_ahrs = keelson.construct_pub_sub_key(
-            realm=args.realm,
-            entity_id=args.entity_id,
-            subject="flight_controller_telemetry_ahrs",
-            source_id="speedybee",
-        )
-        pub_ahrs = session.declare_publisher(pubkey_ahrs)
-        logging.info(f"Decler up TELEMETRY publisher: {pub_ahrs}")
+        # Set GENERAL SYSTEMS, replied to with the vehicle's COMMAND_ACK
+        if vehicle is not None and not args.multi_vehicle:
+            queryable_set_state_of_propulsion_system = declare_propulsion_queryable(
+                session, args, args.entity_id, vehicle
+            )
 
-        # VIBRATION (OK)
-        pubkey_vibration = keelson.construct_pub_sub_key(
-            realm=args.realm,
-            entity_id=args.entity_id,
-            subject="flight_controller_telemetry_vibration",
-            source_id="speedybee",
-        )
-        pub_vibration = session.declare_publisher(pubkey_vibration)
-        logging.info(f"Decler up TELEMETRY publisher: {pub_vibration}")
+        if args.multi_vehicle:
+            # TELEMETRY publishers are declared per vehicle as vehicles appear
+            run_fleet(session, args, vehicle)
 
-        # BATTERY_STATUS (OK)
-        pubkey_battery = keelson.construct_pub_sub_key(
-            realm=args.realm,
-            entity_id=args.entity_id,
-            subject="flight_controller_telemetry_battery",
-            source_id="speedybee",
-        )
-        pub_battery = session.declare_publisher(pubkey_battery)
-        logging.info(f"Decler up TELEMETRY publisher: {pub_ahrs}")
-
-        while True:
-            #################################################
-            # TEST Telemetry
-            #################################################
-
-            for msg_type in msg_types:
-
-                msg = vehicle.get_vehicle().recv_match(
-                    type=msg_type, blocking=True
-                )  # Only selected set of messages
-                # ['VFR_HUD', 'RAW_IMU', 'AHRS', 'VIBRATION', 'BATTERY_STATUS']
-
-                if msg:
-                    logging.debug(f"Telemetry message': {msg}")
-
-                    match msg_type:
-                        case "VFR_HUD":
-                            payload = VFRHUD(
-                                airspeed=msg.airspeed,
-                                groundspeed=msg.groundspeed,
-                                heading=msg.heading,
-                                throttle=msg.throttle,
-                                alt=msg.alt,
-                                climb=msg.climb,
-                            )
-                            # serialize to bytes
-                            serialized_payload = payload.SerializeToString()
-                            envelope = keelson.enclose(serialized_payload)
-                            pub_vfrhud.put(envelope)
-                            logging.info(f"VFR_HUD SENT")
-
-                        case "RAW_IMU":
-                            payload = RawIMU(
-                                time_usec=msg.time_usec,
-                                xacc=msg.xacc,
-                                yacc=msg.yacc,
-                                zacc=msg.zacc,
-                                xgyro=msg.xgyro,
-                                ygyro=msg.ygyro,
-                                zgyro=msg.zgyro,
-                                xmag=msg.xmag,
-                                ymag=msg.ymag,
-                                zmag=msg.zmag,
-                                temperature=msg.temperature,
-                            )
-                            serialized_payload = payload.SerializeToString()
-                            envelope = keelson.enclose(serialized_payload)
-                            pub_rawimu.put(envelope)
-                            logging.info(f"RAW_IMU SENT")
-
-                        case "AHRS":
-                            payload = AHRS(
-                                omegaIx=msg.omegaIx,
-                                omegaIy=msg.omegaIy,
-                                omegaIz=msg.omegaIz,
-                                accel_weight=msg.accel_weight,
-                                renorm_val=msg.renorm_val,
-                                error_rp=msg.error_rp,
-                                error_yaw=msg.error_yaw,
-                            )
-                            serialized_payload = payload.SerializeToString()
-                            envelope = keelson.enclose(serialized_payload)
-                            pub_ahrs.put(envelope)
-                            logging.info(f"AHRS SENT")
-
-                        case "VIBRATION":
-                            payload = Vibration(
-                                vibration_x=msg.vibration_x,
-                                vibration_y=msg.vibration_y,
-                                vibration_z=msg.vibration_z,
-                                clipping_0=msg.clipping_0,
-                                clipping_1=msg.clipping_1,
-                                clipping_2=msg.clipping_2,
-                            )
-                            serialized_payload = payload.SerializeToString()
-                            envelope = keelson.enclose(serialized_payload)
-                            pub_vibration.put(envelope)
-                            logging.info(f"VIBRATION SENT")
-
-                        case "BATTERY_STATUS":
-                            payload = BatteryStatus(
-                                id=msg.id,
-                                battery_function=msg.battery_function,
-                                type=msg.type,
-                                temperature=msg.temperature,
-                                voltages=msg.voltages,
-                                current_battery=msg.current_battery,
-                                current_consumed=msg.current_consumed,
-                                energy_consumed=msg.energy_consumed,
-                                battery_remaining=msg.battery_remaining,
-                                time_remaining=msg.time_remaining,
-                                charge_state=msg.charge_state,
-                                voltages_ext=msg.voltages_ext,
-                                mode=msg.mode,
-                                fault_bitmask=msg.fault_bitmask,
-                            )
-                            serialized_payload = payload.SerializeToString()
-                            envelope = keelson.enclose(serialized_payload)
-                            pub_battery.put(envelope)
-                            logging.info(f"BATTERY_STATUS SENT")
-
-
-            time.sleep(0.1)
-            # forever loop
+        else:
+            # TELEMETRY publishers, one per enabled entry of the telemetry registry
+            metrics = declare_metrics(session, args, args.entity_id, vehicle)
+            dispatcher, batches, raw = declare_telemetry(
+                session, args, args.entity_id, metrics
+            )
+            if raw is not None:
+                # Raw frames are taken off the link by message ID, without decoding them
+                vehicle.set_raw_forwarder(raw)
+
+            if args.runtime == "asyncio":
+                asyncio.run(vehicle.run(dispatcher, batches))
+
+            else:
+                # Frames of message types nothing is published for are not even decoded
+                vehicle.set_message_filter(dispatcher.message_ids)
+
+                stream_rates = stream_rates_from_args(args)
+                if stream_rates:
+                    vehicle.set_stream_rates(stream_rates, args.disable_unused_streams)
+
+                while True:
+                    # Event driven: block until the boat's reader thread hands over the next
+                    # frame and dispatch it by message ID as soon as it arrives, waking up
+                    # early only when a pending batch is due
+                    msg = vehicle.get_message(timeout=flush_due(batches))
+                    if msg is not None:
+                        dispatcher.dispatch(msg)
+                    # forever loop
 
     except KeyboardInterrupt:
         logging.info("Program ended due to user request (Ctrl-C)")
@@ -0,0 +1,289 @@
+"""
+Threaded MAVLink I/O: one reader and one writer per connection, with bounded queues to the rest of the process.
+"""
+
+import logging
+import queue
+import threading
+
+from framing import FrameParser
+
+
+class MavlinkIO:
+    """
+    Owns all traffic on a mavutil connection. The reader thread is the only code that reads the port and the
+    writer thread the only code that writes to it, so Zenoh callbacks hand work over through the queues and
+    never touch the serial port themselves.
+    """
+
+    def __init__(
+        self,
+        connection,
+        inbound_size=1000,
+        outbound_size=100,
+        read_timeout=0.5,
+        buffer_inbound=True,
+        recorder=None,
+    ):
+        """
+        :param connection: An open mavutil connection
+        :param inbound_size: Max number of received messages buffered for the consumer, oldest dropped first
+        :param outbound_size: Max number of queued send jobs, new jobs are dropped when full
+        :param read_timeout: Max time in seconds the reader blocks waiting for data before checking for stop
+        :param buffer_inbound: Queue received messages for get_message, disable when listeners consume them
+        :param recorder: Optional recording.Recorder every chunk read from the connection is written to
+        """
+        self.__connection = connection
+        self.__inbound = queue.Queue(maxsize=inbound_size) if buffer_inbound else None
+        self.__outbound = queue.Queue(maxsize=outbound_size)
+        self.__read_timeout = read_timeout
+        self.__recorder = recorder
+        self.__parser = FrameParser(connection)
+        self.__listeners = []
+        self.__waiters = {}
+        self.__waiters_lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__reader = None
+        self.__writer = None
+        self.dropped_inbound = 0
+        self.dropped_outbound = 0
+
+    @property
+    def connection(self):
+        return self.__connection
+
+    def start(self):
+        """
+        Start the reader and writer threads.
+        """
+        self.__stop.clear()
+        self.__reader = threading.Thread(
+            target=self.__read_loop, name="mavlink-reader", daemon=True
+        )
+        self.__writer = threading.Thread(
+            target=self.__write_loop, name="mavlink-writer", daemon=True
+        )
+        self.__reader.start()
+        self.__writer.start()
+
+    def stop(self, timeout=1.0):
+        """
+        Stop both threads, queued but unsent jobs are discarded.
+        :param timeout: Max time in seconds to wait for each thread to finish
+        """
+        self.__stop.set()
+        try:
+            self.__outbound.put_nowait(None)  # wake the writer
+        except queue.Full:
+            pass
+        if self.__inbound is not None:
+            self.__offer(None)  # wake a consumer blocked in get_message, it gets None
+
+        for thread in (self.__reader, self.__writer):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def set_message_filter(self, msg_ids):
+        """
+        Only decode frames with these message IDs, the rest are skipped by the reader without being unpacked.
+        Listeners, waiters and the inbound queue then only see the wanted messages.
+        :param msg_ids: Iterable of MAVLink message IDs, None decodes every frame
+        """
+        self.__parser.msg_ids = msg_ids
+
+    def set_raw_forwarder(self, forwarder):
+        """
+        Hand the valid frames of the message IDs a forwarder wants to it untouched, on the reader thread and
+        whether they are decoded or not.
+        :param forwarder: passthrough.RawFramePublisher or RawFrameRouter, None stops forwarding
+        """
+        self.__parser.raw_forwarder = forwarder
+
+    def frame_stats(self):
+        """
+        :return: Dict with the number of decoded, skipped and malformed frames
+        """
+        return {
+            "decoded": self.__parser.decoded,
+            "skipped": self.__parser.skipped,
+            "errors": self.__parser.errors,
+        }
+
+    def sequence_stats(self, src_system=None):
+        """
+        :param src_system: Only report the components of this MAVLink system ID
+        :return: Dict mapping (system ID, component ID) to a dict with the received and lost frames and bytes
+        """
+        return self.__parser.sequence_stats(src_system)
+
+    def queue_depths(self):
+        """
+        :return: Dict with the number of received messages and send jobs currently queued
+        """
+        return {
+            "inbound": self.__inbound.qsize() if self.__inbound is not None else 0,
+            "outbound": self.__outbound.qsize(),
+        }
+
+    @property
+    def message_filter(self):
+        """
+        The message IDs decoded by the reader, None if every frame is decoded.
+        """
+        return self.__parser.msg_ids
+
+    def skipped_message_ids(self, src_system=None):
+        """
+        :param src_system: Only report the frames of this MAVLink system ID
+        :return: The message IDs of the frames skipped by the message filter and not forwarded raw so far
+        """
+        return self.__parser.skipped_message_ids(src_system)
+
+    def add_listener(self, listener):
+        """
+        Register a callable invoked on the reader thread for every received message, before it is queued.
+        Listeners must be fast and must not block.
+        :param listener: Callable taking the decoded MAVLink message
+        """
+        self.__listeners.append(listener)
+
+    def submit(self, send_function, *args):
+        """
+        Queue a send for the writer thread without blocking the caller.
+        :param send_function: Callable writing to the connection, e.g. connection.mav.rc_channels_override_send
+        :param args: Arguments for the send function
+        :return: True if queued, False if the outbound queue was full and the job was dropped
+        """
+        try:
+            self.__outbound.put_nowait((send_function, args))
+            return True
+        except queue.Full:
+            self.dropped_outbound += 1
+            logging.warning(
+                "MAVLink outbound queue full, dropped %s",
+                getattr(send_function, "__name__", send_function),
+            )
+            return False
+
+    def get_message(self, timeout=0):
+        """
+        Take the next received message.
+        :param timeout: Seconds to wait for a message, 0 returns immediately and None waits forever
+        :return: The next MAVLink message or None if nothing arrived in time
+        """
+        if self.__inbound is None:
+            raise RuntimeError("Inbound buffering is disabled on this MavlinkIO")
+
+        try:
+            if timeout == 0:
+                return self.__inbound.get_nowait()
+            return self.__inbound.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def wait_for(self, msg_type, timeout=None, src_system=None):
+        """
+        Block until the reader receives the next message of the given type.
+        :param msg_type: MAVLink message name, e.g. "HEARTBEAT"
+        :param timeout: Seconds to wait, None waits forever
+        :param src_system: Only accept messages from this MAVLink system ID, None accepts any
+        :return: The message or None on timeout
+        """
+        waiter = [threading.Event(), None, src_system]
+        with self.__waiters_lock:
+            self.__waiters.setdefault(msg_type, []).append(waiter)
+
+        if waiter[0].wait(timeout):
+            return waiter[1]
+
+        with self.__waiters_lock:
+            pending = self.__waiters.get(msg_type, [])
+            if waiter in pending:
+                pending.remove(waiter)
+
+        return waiter[1]
+
+    def __notify_waiters(self, msg):
+        with self.__waiters_lock:
+            waiters = self.__waiters.get(msg.get_type())
+            if not waiters:
+                return
+
+            src_system = msg.get_srcSystem()
+            matched = [w for w in waiters if w[2] is None or w[2] == src_system]
+            for waiter in matched:
+                waiters.remove(waiter)
+            if not waiters:
+                del self.__waiters[msg.get_type()]
+
+        for waiter in matched:
+            waiter[1] = msg
+            waiter[0].set()
+
+    def __offer(self, msg):
+        """
+        Queue a received message, dropping the oldest one if the consumer has fallen behind.
+        """
+        while True:
+            try:
+                self.__inbound.put_nowait(msg)
+                return
+            except queue.Full:
+                try:
+                    self.__inbound.get_nowait()
+                    self.dropped_inbound += 1
+                except queue.Empty:
+                    pass
+
+    def __read_loop(self):
+        connection = self.__connection
+        parser = self.__parser
+        recorder = self.__recorder
+        readable = False
+        while not self.__stop.is_set():
+            try:
+                data = connection.recv(4096)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.error("Error reading from MAVLink connection: %s", e)
+                self.__stop.wait(self.__read_timeout)
+                continue
+
+            if not data:
+                if readable:
+                    # Readable yet nothing read: the peer closed the stream, don't spin until it is reopened
+                    self.__stop.wait(self.__read_timeout)
+                    readable = False
+                else:
+                    readable = connection.select(self.__read_timeout)
+                continue
+            readable = False
+
+            if recorder is not None:
+                recorder.write(data)
+            for msg in parser.parse(data):
+                self.__deliver(msg)
+
+    def __deliver(self, msg):
+        for listener in self.__listeners:
+            try:
+                listener(msg)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.error("Error in MAVLink listener: %s", e)
+
+        if self.__waiters:
+            self.__notify_waiters(msg)
+
+        if self.__inbound is not None:
+            self.__offer(msg)
+
+    def __write_loop(self):
+        while not self.__stop.is_set():
+            job = self.__outbound.get()
+            if job is None:
+                break
+
+            send_function, args = job
+            try:
+                send_function(*args)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.error("Error writing to MAVLink connection: %s", e)
@@ -0,0 +1,477 @@
+"""
+Telemetry metrics: per message type receive and publish counts, decode, encode and put timings and latency
+histograms of the published messages, next to the counters of the vehicle's MAVLink link. Reported as a
+periodic JSON summary on a Keelson subject and, optionally, in the Prometheus text format over HTTP.
+
+Two latencies are measured per published message. The publish latency runs from the frame being read
+off the link to the put returning. The age runs from the autopilot's own timestamp (time_usec or
+time_boot_ms) to the put returning. The autopilot clock is not synchronized with ours, so it is mapped onto
+ours with the smallest offset seen in the last one to two clock windows: a constant link delay does not
+show up in the age, queueing on the link and in the connector does.
+"""
+
+import bisect
+import http.server
+import json
+import logging
+import math
+import threading
+import time
+
+from scheduler import PeriodicTask
+
+# Upper bounds in seconds of the latency histogram buckets, a last +Inf bucket takes the rest
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+CLOCK_WINDOW = 60.0  # seconds the smallest autopilot clock offset is tracked over
+# Autopilot timestamp fields in the order they are looked for, with their unit in seconds
+TIMESTAMP_FIELDS = (("time_usec", 1e-6), ("time_boot_ms", 1e-3))
+
+
+def quantile(counts, q, buckets=LATENCY_BUCKETS):
+    """
+    :param counts: Count per histogram bucket, the last one being +Inf
+    :param q: Quantile, e.g. 0.99
+    :param buckets: Upper bounds of the buckets
+    :return: Upper bound of the bucket holding the quantile, math.inf beyond the last bound, None if empty
+    """
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for bound, count in zip(buckets + (math.inf,), counts):
+        seen += count
+        if seen >= rank:
+            return bound
+    return math.inf
+
+
+class _Stream:
+    def __init__(self, buckets):
+        self.published = 0
+        self.encode_seconds = 0.0
+        self.put_seconds = 0.0
+        self.latency = [0] * (len(buckets) + 1)
+        self.latency_sum = 0.0
+        self.age = [0] * (len(buckets) + 1)
+        self.age_sum = 0.0
+        self.aged = 0
+
+
+class TelemetryMetrics:
+    """
+    Collects the metrics of one vehicle's telemetry, thread-safe. received() and published() run on the
+    dispatching thread for every message, snapshot() on whichever thread reports.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        :param buckets: Upper bounds in seconds of the latency histogram buckets
+        """
+        self.buckets = tuple(buckets)
+        self.__lock = threading.Lock()
+        self.__received = {}
+        self.__decode_seconds = {}
+        self.__streams = {}
+        # (system ID, component ID, field): [last timestamp, window min offset, previous min, window start]
+        self.__clocks = {}
+
+    def received(self, msg):
+        """
+        Count a message taken off the link, meant as the observer of a MessageDispatcher.
+        :param msg: Decoded MAVLink message, with the time its decode took if it went through a FrameParser
+        """
+        msg_type = msg.get_type()
+        decode_seconds = getattr(msg, "_decode_seconds", 0.0)
+        with self.__lock:
+            self.__received[msg_type] = self.__received.get(msg_type, 0) + 1
+            self.__decode_seconds[msg_type] = (
+                self.__decode_seconds.get(msg_type, 0.0) + decode_seconds
+            )
+
+    def published(self, msg, encode_seconds, put_seconds):
+        """
+        Record a published telemetry message.
+        :param msg: The MAVLink message published
+        :param encode_seconds: Time taken to encode its payload
+        :param put_seconds: Time taken by the put
+        """
+        now = time.time()
+        received_at = getattr(msg, "_timestamp", now)
+        latency = now - received_at
+        msg_type = msg.get_type()
+
+        for field, unit in TIMESTAMP_FIELDS:
+            sent_at = getattr(msg, field, None)
+            if sent_at is not None:
+                sent_at *= unit
+                clock_key = (msg.get_srcSystem(), msg.get_srcComponent(), field)
+                break
+        else:
+            sent_at = None
+
+        with self.__lock:
+            stream = self.__streams.get(msg_type)
+            if stream is None:
+                stream = self.__streams[msg_type] = _Stream(self.buckets)
+            stream.published += 1
+            stream.encode_seconds += encode_seconds
+            stream.put_seconds += put_seconds
+            stream.latency[bisect.bisect_left(self.buckets, latency)] += 1
+            stream.latency_sum += latency
+
+            if sent_at is not None:
+                age = (
+                    now - sent_at - self.__clock_offset(clock_key, sent_at, received_at)
+                )
+                stream.age[bisect.bisect_left(self.buckets, age)] += 1
+                stream.age_sum += age
+                stream.aged += 1
+
+    def __clock_offset(self, key, sent_at, received_at):
+        """
+        Offset of our clock to the autopilot's, the smallest seen over the current and the previous window.
+        Lock held by the caller.
+        """
+        offset = received_at - sent_at
+        clock = self.__clocks.get(key)
+        if clock is None or sent_at < clock[0]:
+            # first timestamp of the source or the autopilot rebooted
+            clock = self.__clocks[key] = [sent_at, offset, offset, received_at]
+        elif received_at - clock[3] > CLOCK_WINDOW:
+            # the clocks drift apart, forget offsets older than two windows
+            clock[2] = clock[1]
+            clock[1] = offset
+            clock[3] = received_at
+        elif offset < clock[1]:
+            clock[1] = offset
+        clock[0] = sent_at
+        return min(clock[1], clock[2])
+
+    def snapshot(self):
+        """
+        :return: Dict mapping message type to its cumulative counters, timings and histogram counts
+        """
+        with self.__lock:
+            types = set(self.__received) | set(self.__streams)
+            snapshot = {}
+            for msg_type in types:
+                stream = self.__streams.get(msg_type)
+                snapshot[msg_type] = {
+                    "received": self.__received.get(msg_type, 0),
+                    "decode_seconds": self.__decode_seconds.get(msg_type, 0.0),
+                    "published": stream.published if stream else 0,
+                    "encode_seconds": stream.encode_seconds if stream else 0.0,
+                    "put_seconds": stream.put_seconds if stream else 0.0,
+                    "latency": list(stream.latency) if stream else None,
+                    "latency_sum": stream.latency_sum if stream else 0.0,
+                    "age": list(stream.age) if stream else None,
+                    "age_sum": stream.age_sum if stream else 0.0,
+                    "aged": stream.aged if stream else 0,
+                }
+            return snapshot
+
+
+def _delta(counts, previous):
+    if counts is None:
+        return None
+    if previous is None:
+        return counts
+    return [count - before for count, before in zip(counts, previous)]
+
+
+def _ms(seconds):
+    if seconds is None:
+        return None
+    if seconds == math.inf:
+        return "inf"  # beyond the last bucket
+    return round(seconds * 1000.0, 3)
+
+
+class MetricsReport:
+    """
+    Publishes a JSON summary of the telemetry metrics and link counters over the last interval: rates in Hz,
+    mean decode, encode and put times and latency percentiles, given as the upper bound of the bucket they fall in.
+    """
+
+    def __init__(self, metrics, link_stats, publish, interval, name="metrics-report"):
+        """
+        :param metrics: The TelemetryMetrics summarized
+        :param link_stats: Callable returning the link counters, e.g. Boat.link_stats
+        :param publish: Callable taking the summary as a JSON string
+        :param interval: Seconds between summaries
+        :param name: Name of the reporting thread
+        """
+        self.__metrics = metrics
+        self.__link_stats = link_stats
+        self.__publish = publish
+        self.__previous = {}
+        self.__previous_lost = {}
+        self.__since = time.monotonic()
+        self.__task = PeriodicTask(self.report, interval, name=name)
+
+    def start(self):
+        self.__task.start()
+
+    def stop(self):
+        self.__task.stop()
+
+    def summary(self):
+        """
+        Summarize the interval since the last summary.
+        :return: JSON serializable dict with the streams by message type and the link counters
+        """
+        now = time.monotonic()
+        elapsed = max(now - self.__since, 1e-9)
+        self.__since = now
+        buckets = self.__metrics.buckets
+        snapshot = self.__metrics.snapshot()
+
+        streams = {}
+        for msg_type, current in sorted(snapshot.items()):
+            previous = self.__previous.get(msg_type, {})
+            received = current["received"] - previous.get("received", 0)
+            published = current["published"] - previous.get("published", 0)
+            decode = current["decode_seconds"] - previous.get("decode_seconds", 0.0)
+            encode = current["encode_seconds"] - previous.get("encode_seconds", 0.0)
+            put = current["put_seconds"] - previous.get("put_seconds", 0.0)
+            latency = _delta(current["latency"], previous.get("latency"))
+            age = _delta(current["age"], previous.get("age"))
+            streams[msg_type] = {
+                "received_hz": round(received / elapsed, 2),
+                "published_hz": round(published / elapsed, 2),
+                "decode_ms": _ms(decode / received) if received else None,
+                "encode_ms": _ms(encode / published) if published else None,
+                "put_ms": _ms(put / published) if published else None,
+                "latency_p50_ms": _ms(latency and quantile(latency, 0.5, buckets)),
+                "latency_p99_ms": _ms(latency and quantile(latency, 0.99, buckets)),
+                "age_p50_ms": _ms(age and quantile(age, 0.5, buckets)),
+                "age_p99_ms": _ms(age and quantile(age, 0.99, buckets)),
+            }
+        self.__previous = snapshot
+
+        summary = {"interval_s": round(elapsed, 3), "streams": streams}
+        link = self.__link_stats()
+        if link is not None:
+            sources = {}
+            for (system, component), counts in link["sequence"].items():
+                source = f"{system}/{component}"
+                lost = counts["lost"] - self.__previous_lost.get(source, 0)
+                self.__previous_lost[source] = counts["lost"]
+                sources[source] = dict(counts, lost_in_interval=lost)
+            summary["link"] = {
+                "frames": link["frames"],
+                "sources": sources,
+                "dropped": link["dropped"],
+                "queued": link["queued"],
+            }
+        return summary
+
+    def report(self):
+        """
+        Publish the summary of the interval since the last one, run periodically once started.
+        """
+        try:
+            self.__publish(json.dumps(self.summary()))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.error("Error publishing metrics: %s", e)
+
+
+def _labels(labels):
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+
+def prometheus_text(sources):
+    """
+    Render metrics in the Prometheus text exposition format.
+    :param sources: Iterable of (labels, TelemetryMetrics, link stats callable) tuples, labels being a dict
+        added to every sample of the source, e.g. {"entity": "boat"}
+    :return: The exposition as a string
+    """
+    families = {}
+
+    def sample(name, kind, text, labels, value):
+        family = families.setdefault(name, (kind, text, []))
+        family[2].append(f"{name}{{{_labels(labels)}}} {value}")
+
+    def histogram(name, text, labels, buckets, counts, total, count):
+        family = families.setdefault(name, ("histogram", text, []))
+        seen = 0
+        for bound, bucket_count in zip(buckets + (math.inf,), counts):
+            seen += bucket_count
+            le = "+Inf" if bound == math.inf else repr(bound)
+            family[2].append(f"{name}_bucket{{{_labels(dict(labels, le=le))}}} {seen}")
+        family[2].append(f"{name}_sum{{{_labels(labels)}}} {total}")
+        family[2].append(f"{name}_count{{{_labels(labels)}}} {count}")
+
+    for labels, metrics, link_stats in sources:
+        for msg_type, stream in sorted(metrics.snapshot().items()):
+            stream_labels = dict(labels, type=msg_type)
+            sample(
+                "keelson_mavlink_messages_received_total",
+                "counter",
+                "MAVLink messages taken off the link",
+                stream_labels,
+                stream["received"],
+            )
+            sample(
+                "keelson_mavlink_messages_published_total",
+                "counter",
+                "Telemetry messages published",
+                stream_labels,
+                stream["published"],
+            )
+            sample(
+                "keelson_mavlink_decode_seconds_total",
+                "counter",
+                "Time spent decoding received MAVLink frames",
+                stream_labels,
+                stream["decode_seconds"],
+            )
+            sample(
+                "keelson_mavlink_encode_seconds_total",
+                "counter",
+                "Time spent encoding published telemetry payloads",
+                stream_labels,
+                stream["encode_seconds"],
+            )
+            sample(
+                "keelson_mavlink_put_seconds_total",
+                "counter",
+                "Time spent in puts of published telemetry",
+                stream_labels,
+                stream["put_seconds"],
+            )
+            if stream["latency"] is not None:
+                histogram(
+                    "keelson_mavlink_publish_latency_seconds",
+                    "Time from reading a frame off the link to its telemetry being published",
+                    stream_labels,
+                    metrics.buckets,
+                    stream["latency"],
+                    stream["latency_sum"],
+                    stream["published"],
+                )
+            if stream["aged"]:
+                histogram(
+                    "keelson_mavlink_message_age_seconds",
+                    "Time from the autopilot timestamp to publishing, beyond the fastest delivery",
+                    stream_labels,
+                    metrics.buckets,
+                    stream["age"],
+                    stream["age_sum"],
+                    stream["aged"],
+                )
+
+        link = link_stats()
+        if link is None:
+            continue
+        for result, count in link["frames"].items():
+            sample(
+                "keelson_mavlink_frames_total",
+                "counter",
+                "MAVLink frames read off the link by result",
+                dict(labels, result=result),
+                count,
+            )
+        for (system, component), counts in sorted(link["sequence"].items()):
+            source_labels = dict(labels, system=system, component=component)
+            sample(
+                "keelson_mavlink_source_frames_total",
+                "counter",
+                "MAVLink frames received per source",
+                source_labels,
+                counts["received"],
+            )
+            sample(
+                "keelson_mavlink_source_frames_lost_total",
+                "counter",
+                "MAVLink frames lost per source, from gaps in the sequence numbers",
+                source_labels,
+                counts["lost"],
+            )
+        for queue, count in link["dropped"].items():
+            sample(
+                "keelson_mavlink_queue_dropped_total",
+                "counter",
+                "Messages and send jobs dropped by full queues",
+                dict(labels, queue=queue),
+                count,
+            )
+        for queue, depth in link["queued"].items():
+            sample(
+                "keelson_mavlink_queue_depth",
+                "gauge",
+                "Messages and send jobs currently queued",
+                dict(labels, queue=queue),
+                depth,
+            )
+
+    lines = []
+    for name, (kind, text, samples) in families.items():
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusEndpoint:
+    """
+    Serves the metrics of every added vehicle at /metrics over HTTP, from a thread of its own.
+    """
+
+    def __init__(self, port, address=""):
+        """
+        :param port: TCP port to listen on
+        :param address: Address to bind, all interfaces by default so the endpoint can be scraped from
+            outside the container
+        """
+        self.__sources = []
+        self.__lock = threading.Lock()
+        endpoint = self
+
+        class _Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = endpoint.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                logging.debug("Metrics request: " + format, *args)
+
+        self.__server = http.server.ThreadingHTTPServer((address, port), _Handler)
+        self.__server.daemon_threads = True
+        self.__thread = None
+
+    def add(self, labels, metrics, link_stats):
+        """
+        :param labels: Dict of labels added to every sample of the vehicle, e.g. {"entity": "boat"}
+        :param metrics: The vehicle's TelemetryMetrics
+        :param link_stats: Callable returning the counters of the vehicle's link
+        """
+        with self.__lock:
+            self.__sources.append((labels, metrics, link_stats))
+
+    def render(self):
+        """
+        :return: The metrics of every added vehicle in the Prometheus text format
+        """
+        with self.__lock:
+            sources = list(self.__sources)
+        return prometheus_text(sources)
+
+    def start(self):
+        self.__thread = threading.Thread(
+            target=self.__server.serve_forever, name="metrics-http", daemon=True
+        )
+        self.__thread.start()
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
@@ -0,0 +1,224 @@
+"""
+Control mixing: turns the rudder, throttle and thruster targets into the PWM values of every overridden RC
+channel in one pass, so each control tick sends one complete override frame.
+
+Inputs are PWM targets. A per-side input (throttle_port, thruster_bow, ...) that is not set follows its
+combined input (throttle, thruster, ...). Every channel is the center plus the weighted sum of its inputs'
+deviations from the center, clamped to the channel's limits and moved towards at most at its slew rate.
+"""
+
+import json
+import threading
+import time
+
+PWM_MIN = 1100
+PWM_CENTER = 1500  # center point for rc joysticks
+PWM_MAX = 1900
+RC_OVERRIDE_CHANNELS = 8
+
+# Combined input: the per-side inputs following it while they are not set themselves
+COMBINED_INPUTS = {
+    "rudder": ("rudder_port", "rudder_starboard"),
+    "throttle": ("throttle_port", "throttle_starboard"),
+    "thruster": ("thruster_bow", "thruster_stern"),
+}
+_COMBINED_OF = {
+    side: combined for combined, sides in COMBINED_INPUTS.items() for side in sides
+}
+
+# Single rudder channel and one throttle channel per engine, the RC channels ArduPilot Rover uses
+DEFAULT_MATRIX = {
+    1: {"rudder": 1.0},
+    2: {"throttle_port": 1.0},
+    3: {"throttle_starboard": 1.0},
+}
+
+
+def parse_rc_channel(spec):
+    """
+    Parse an RC channel mapping given on the command line.
+    :param spec: "TARGET=CHANNEL", e.g. "thruster_bow=4", channel 0 removes the target
+    :return: Tuple of input name and channel number
+    """
+    name, sep, channel = spec.partition("=")
+    if not sep or not channel:
+        raise ValueError(f"Expected TARGET=CHANNEL, got: {spec}")
+    return name.strip(), int(channel)
+
+
+def load_mixer_config(specs=None, path=None):
+    """
+    Build the mixer settings from a JSON config file and/or command line RC channel mappings, a mapping
+    moves its input to a channel of its own.
+    :param specs: List of "TARGET=CHANNEL" strings
+    :param path: Optional JSON file with "matrix" (channel: {input: weight}), "slew_rates" (channel: PWM
+        per second) and "limits" (channel: [min PWM, max PWM]), channels as strings
+    :return: Dict of Mixer arguments
+    """
+    config = {"matrix": DEFAULT_MATRIX, "slew_rates": {}, "limits": {}}
+    if path:
+        with open(path, encoding="utf-8") as fh:
+            settings = json.load(fh)
+        unknown = set(settings) - set(config)
+        if unknown:
+            raise ValueError(f"Unknown mixer settings {sorted(unknown)} in {path}")
+        for key, channels in settings.items():
+            config[key] = {int(channel): value for channel, value in channels.items()}
+
+    matrix = {channel: dict(row) for channel, row in config["matrix"].items()}
+    for spec in specs or ():
+        name, channel = parse_rc_channel(spec)
+        for row in matrix.values():
+            row.pop(name, None)
+        if channel:
+            matrix[channel] = {name: 1.0}
+    config["matrix"] = {channel: row for channel, row in matrix.items() if row}
+
+    return config
+
+
+class Mixer:
+    """
+    Holds the latest control inputs and mixes them into RC channel PWM values, thread-safe.
+    """
+
+    def __init__(self, matrix=None, slew_rates=None, limits=None, tick_interval=0.02):
+        """
+        :param matrix: Dict mapping RC channel (1-8) to a dict of input name to weight
+        :param slew_rates: Dict mapping RC channel to its max change in PWM per second, unlimited if not given
+        :param limits: Dict mapping RC channel to its (min PWM, max PWM), 1100-1900 if not given
+        :param tick_interval: Seconds between control ticks while slewing, the first step after the
+            channels settled is as long as one tick
+        """
+        matrix = DEFAULT_MATRIX if matrix is None else matrix
+        slew_rates = slew_rates or {}
+        limits = limits or {}
+
+        self.__channels = []
+        for channel, row in sorted(matrix.items()):
+            if not 1 <= channel <= RC_OVERRIDE_CHANNELS:
+                raise ValueError(
+                    f"RC channel must be within 1-{RC_OVERRIDE_CHANNELS}, got {channel}"
+                )
+            low, high = limits.get(channel, (PWM_MIN, PWM_MAX))
+            self.__channels.append(
+                (channel - 1, tuple(row.items()), low, high, slew_rates.get(channel))
+            )
+
+        self.__used = frozenset(
+            name for _, row, *_ in self.__channels for name, _ in row
+        )
+        self.__inputs = {}
+        self.__levels = {index: float(PWM_CENTER) for index, *_ in self.__channels}
+        self.__outputs = [0] * RC_OVERRIDE_CHANNELS
+        self.__tick_interval = tick_interval
+        self.__last_mix = None
+        self.__settled = True
+        self.__lock = threading.Lock()
+
+    def uses(self, name):
+        """
+        :param name: Input name, e.g. "throttle_port"
+        :return: True if setting the input moves at least one channel
+        """
+        return name in self.__used or any(
+            side in self.__used for side in COMBINED_INPUTS.get(name, ())
+        )
+
+    @staticmethod
+    def expand(targets):
+        """
+        Add the per-side inputs a combined input takes over again, unless set in the same call.
+        :param targets: Dict mapping input name to PWM value
+        :return: Dict of inputs to set, None unsets a per-side input
+        """
+        expanded = dict(targets)
+        for name in targets:
+            for side in COMBINED_INPUTS.get(name, ()):
+                expanded.setdefault(side, None)
+        return expanded
+
+    def applied(self, inputs):
+        """
+        The values inputs drive their channels with once weighted and clamped to the channel limits, of the
+        most limiting channel for an input driving several. The other inputs of a channel and slewing are
+        left out.
+        :param inputs: Dict mapping input name to PWM value
+        :return: Dict mapping the same names to the PWM value applied
+        """
+        applied = {}
+        for name, value in inputs.items():
+            names = (name,) + COMBINED_INPUTS.get(name, ())
+            deviation = value - PWM_CENTER
+            for _, row, low, high, _ in self.__channels:
+                for input_name, weight in row:
+                    if input_name in names and weight:
+                        channel = PWM_CENTER + weight * (value - PWM_CENTER)
+                        limited = (min(high, max(low, channel)) - PWM_CENTER) / weight
+                        if abs(limited) < abs(deviation):
+                            deviation = limited
+            applied[name] = int(round(PWM_CENTER + deviation))
+        return applied
+
+    def set_inputs(self, inputs):
+        """
+        :param inputs: Dict mapping input name to PWM value, None unsets it
+        """
+        with self.__lock:
+            self.__inputs.update(inputs)
+            if self.__settled:
+                # time spent settled does not count towards the next slew step
+                self.__last_mix = None
+            self.__settled = False
+
+    @property
+    def settled(self):
+        """
+        True once every channel reached its target, False while channels are still slewing.
+        """
+        return self.__settled
+
+    def mix(self, now=None):
+        """
+        Move every channel towards its target, at most as far as its slew rate allows since the last call.
+        :param now: time.monotonic() of the control tick, taken now if not given
+        :return: List of the 8 channel values, 0 for the channels left to the RC transmitter
+        """
+        now = time.monotonic() if now is None else now
+        with self.__lock:
+            elapsed = (
+                self.__tick_interval
+                if self.__last_mix is None
+                else now - self.__last_mix
+            )
+            self.__last_mix = now
+            inputs = self.__inputs
+            levels = self.__levels
+            outputs = self.__outputs
+            settled = True
+
+            for index, row, low, high, slew_rate in self.__channels:
+                target = PWM_CENTER
+                for name, weight in row:
+                    value = inputs.get(name)
+                    if value is None:
+                        value = inputs.get(_COMBINED_OF.get(name))
+                    if value is not None:
+                        target += weight * (value - PWM_CENTER)
+                target = min(high, max(low, target))
+
+                level = levels[index]
+                if slew_rate is not None:
+                    step = slew_rate * elapsed
+                    if target > level + step:
+                        target = level + step
+                        settled = False
+                    elif target < level - step:
+                        target = level - step
+                        settled = False
+
+                levels[index] = target
+                outputs[index] = int(round(target))
+
+            self.__settled = settled
+            return list(outputs)
@@ -0,0 +1,93 @@
+"""
+Passthrough of raw MAVLink frames to Keelson, for consumers that want the untouched bytes, e.g. log
+recorders or a shore-side ground control station bridge.
+
+Frames are forwarded as they came off the link, wrapped in a TimestampedBytes payload on the well-known
+"raw" subject. The link's FrameParser hands every valid frame whose header message ID the forwarder
+wants over before and regardless of decoding, so no MAVLink fields are looked at and nothing is
+re-serialized, and the passthrough never widens the message IDs decoded.
+"""
+
+import time
+
+from keelson.payloads.TimestampedBytes_pb2 import TimestampedBytes
+
+from framing import frame_message_id, frame_source_system
+from telemetry import EnvelopeWriter
+
+
+class RawFramePublisher:
+    """
+    Publishes raw MAVLink frames, optionally only those with the given message IDs.
+    Not thread-safe, frames are expected to be forwarded from a single thread.
+    """
+
+    def __init__(self, publisher, msg_ids=None):
+        """
+        :param publisher: Zenoh publisher on the raw subject
+        :param msg_ids: Message IDs to forward, None forwards every frame
+        """
+        self.__publisher = publisher
+        self.__msg_ids = None if msg_ids is None else frozenset(msg_ids)
+        self.__payload = TimestampedBytes()
+        self.__timestamp = self.__payload.timestamp
+        self.__envelope = EnvelopeWriter()
+        self.forwarded = 0
+
+    def wants(self, msg_id):
+        """
+        :param msg_id: MAVLink message ID
+        :return: True if frames with this message ID are forwarded
+        """
+        return self.__msg_ids is None or msg_id in self.__msg_ids
+
+    def forward(self, frame, received_at=None):
+        """
+        Publish a frame, called by the link's reader for the valid frames of the message IDs it wants.
+        :param frame: The raw frame bytes
+        :param received_at: Arrival time in nanoseconds since epoch, now if not given
+        """
+        received_at = received_at or time.time_ns()
+        self.__timestamp.seconds, self.__timestamp.nanos = divmod(
+            received_at, 1_000_000_000
+        )
+        self.__payload.value = bytes(frame)
+        self.__publisher.put(
+            self.__envelope.enclose(self.__payload.SerializeToString(), received_at)
+        )
+        self.forwarded += 1
+
+
+class RawFrameRouter:
+    """
+    Raw forwarder of a link shared by several vehicles, handing each frame to the RawFramePublisher of its
+    source system. Frames of systems without one are dropped.
+    """
+
+    def __init__(self):
+        self.__forwarders = {}
+
+    def add(self, system_id, forwarder):
+        """
+        :param system_id: MAVLink system ID of the vehicle
+        :param forwarder: The vehicle's RawFramePublisher
+        """
+        # replaced, not mutated, as the reader iterates it concurrently
+        self.__forwarders = {**self.__forwarders, system_id: forwarder}
+
+    def wants(self, msg_id):
+        """
+        :param msg_id: MAVLink message ID
+        :return: True if any vehicle's forwarder wants frames with this message ID
+        """
+        return any(forwarder.wants(msg_id) for forwarder in self.__forwarders.values())
+
+    def forward(self, frame, received_at=None):
+        """
+        Hand a frame to the forwarder of its source system, if that one wants its message ID.
+        :param frame: The raw frame bytes
+        :param received_at: Arrival time in nanoseconds since epoch
+        """
+        forwarder = self.__forwarders.get(frame_source_system(frame))
+        if forwarder is not None and forwarder.wants(frame_message_id(frame)):
+            forwarder.forward(frame, received_at)
@@ -0,0 +1,193 @@
+"""
+Per-stream publishing policies, applied before a message is serialized so dropped samples cost nothing.
+"""
+
+import json
+import time
+
+
+class RateLimiter:
+    """
+    Lets at most max_rate_hz samples per second through, evenly spaced. Slots advance from the previous slot
+    rather than from the sample that took it, so samples arriving a little after their slot do not lower the
+    rate, e.g. a 50 Hz stream limited to 15 Hz passes 15 and not 12.5 samples per second.
+    """
+
+    def __init__(self, max_rate_hz):
+        """
+        :param max_rate_hz: Max number of samples per second
+        """
+        self.__min_interval = 1.0 / max_rate_hz
+        self.__next_allowed = 0.0
+        self.dropped = 0
+
+    def allow(self, now=None):
+        """
+        :param now: time.monotonic() of the sample, taken now if not given
+        :return: True if the sample should be published
+        """
+        now = time.monotonic() if now is None else now
+        if now < self.__next_allowed:
+            self.dropped += 1
+            return False
+
+        next_allowed = self.__next_allowed + self.__min_interval
+        # a sample a whole interval late, e.g. after a gap in the stream, starts the slots over instead of
+        # letting the following samples through in a burst
+        self.__next_allowed = (
+            next_allowed if now < next_allowed else now + self.__min_interval
+        )
+        return True
+
+
+class PublishPolicy:
+    """
+    Decides per sample whether a stream publishes it. Checks run in order: decimation, on-change with
+    deadband (bypassed when the heartbeat interval has passed), max rate.
+    """
+
+    KEYS = ("max_rate", "decimation", "deadband", "heartbeat")
+
+    def __init__(self, max_rate=None, decimation=1, deadband=None, heartbeat=None):
+        """
+        :param max_rate: Max samples per second, None for unlimited
+        :param decimation: Only every Nth received sample is considered
+        :param deadband: Only publish when a field moved more than this since the last published sample,
+            None publishes every sample. Fields named time_* are ignored in the comparison
+        :param heartbeat: Republish at least every this many seconds even if nothing changed
+        """
+        self.__rate_limiter = RateLimiter(max_rate) if max_rate else None
+        self.__decimation = int(decimation)
+        self.__deadband = deadband
+        self.__heartbeat = heartbeat
+        self.__received = 0
+        self.__last_values = None
+        self.__last_published = None
+        self.published = 0
+        self.dropped = 0
+
+    def allow(self, msg, now=None):
+        """
+        :param msg: Decoded MAVLink message
+        :param now: time.monotonic() of the sample, taken now if not given
+        :return: True if the sample should be published
+        """
+        now = time.monotonic() if now is None else now
+
+        self.__received += 1
+        if self.__decimation > 1 and self.__received % self.__decimation:
+            self.dropped += 1
+            return False
+
+        values = None
+        if self.__deadband is not None:
+            values = _compared_values(msg)
+            heartbeat_due = self.__heartbeat is not None and (
+                self.__last_published is None
+                or now - self.__last_published >= self.__heartbeat
+            )
+            if (
+                self.__last_values is not None
+                and not heartbeat_due
+                and not _changed(self.__last_values, values, self.__deadband)
+            ):
+                self.dropped += 1
+                return False
+
+        if self.__rate_limiter is not None and not self.__rate_limiter.allow(now):
+            self.dropped += 1
+            return False
+
+        if values is not None:
+            self.__last_values = values
+        self.__last_published = now
+        self.published += 1
+        return True
+
+
+def _compared_values(msg):
+    return [
+        getattr(msg, name)
+        for name in msg.get_fieldnames()
+        if not name.startswith("time_")
+    ]
+
+
+def _changed(previous, current, deadband):
+    for old, new in zip(previous, current):
+        if isinstance(new, (list, tuple)):
+            if _changed(old, new, deadband):
+                return True
+        elif isinstance(new, (int, float)):
+            if abs(new - old) > deadband:
+                return True
+        elif new != old:
+            return True
+
+    return False
+
+
+def policy_filtered(handler, policy):
+    """
+    Wrap a message handler so it is only called for samples the policy lets through.
+    :param handler: Callable taking the decoded MAVLink message
+    :param policy: The PublishPolicy of the stream
+    :return: The wrapped handler
+    """
+
+    def _handler(msg):
+        if policy.allow(msg):
+            handler(msg)
+
+    return _handler
+
+
+def parse_policy(spec):
+    """
+    Parse a policy given on the command line.
+    :param spec: "SUBJECT:key=value,key=value", e.g. "flight_controller_telemetry_ahrs:max_rate=5"
+    :return: Tuple of subject and dict of policy arguments
+    """
+    subject, sep, settings = spec.partition(":")
+    if not sep or not settings:
+        raise ValueError(f"Expected SUBJECT:key=value[,key=value], got: {spec}")
+
+    arguments = {}
+    for setting in settings.split(","):
+        key, sep, value = setting.partition("=")
+        key = key.strip()
+        if not sep or key not in PublishPolicy.KEYS:
+            raise ValueError(
+                f"Invalid policy setting '{setting}', known keys: {PublishPolicy.KEYS}"
+            )
+        arguments[key] = float(value)
+
+    return subject.strip(), arguments
+
+
+def load_policies(specs=None, path=None):
+    """
+    Build the publish policies from a JSON config file and/or command line specs, the command line
+    settings override the file settings of the same subject.
+    :param specs: List of "SUBJECT:key=value,..." strings
+    :param path: Optional JSON file mapping subject to {key: value}
+    :return: Dict mapping subject to PublishPolicy
+    """
+    settings = {}
+    if path:
+        with open(path, encoding="utf-8") as fh:
+            for subject, arguments in json.load(fh).items():
+                unknown = set(arguments) - set(PublishPolicy.KEYS)
+                if unknown:
+                    raise ValueError(
+                        f"Unknown policy keys {sorted(unknown)} for {subject} in {path}"
+                    )
+                settings[subject] = dict(arguments)
+
+    for spec in specs or ():
+        subject, arguments = parse_policy(spec)
+        settings.setdefault(subject, {}).update(arguments)
+
+    return {
+        subject: PublishPolicy(**arguments) for subject, arguments in settings.items()
+    }
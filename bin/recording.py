@@ -0,0 +1,237 @@
+"""
+Recording and replay of the raw MAVLink byte stream.
+
+A recording keeps every chunk of bytes read from the link together with its arrival time, so a session on
+the water can be replayed later, byte for byte and with the original timing, through the same parser,
+dispatcher and publishers. The file is a magic line and the wall clock time the recording started at,
+followed by one record per chunk: the microseconds since the previous chunk as uint32, the chunk length
+as uint16 and the chunk itself.
+
+A replay is opened like any other link with the connection string replay:PATH[@SPEED], where SPEED is a
+factor on the recorded timing (1 is real time, the default) or max to replay as fast as it is read.
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+
+from pymavlink import mavutil
+
+MAGIC = b"MAVREC1\n"
+REPLAY_PREFIX = "replay:"
+FLUSH_INTERVAL = 1.0  # max seconds recorded chunks stay in the file buffer
+
+_HEADER = struct.Struct("<d")
+_RECORD = struct.Struct("<IH")
+_MAX_DELTA_US = 0xFFFFFFFF
+_MAX_CHUNK = 0xFFFF
+
+
+class Recorder:
+    """
+    Appends the chunks read from a MAVLink link to a recording file, thread-safe.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: File to write, replaced if it exists
+        """
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__file = open(path, "wb")  # pylint: disable=consider-using-with
+        self.__file.write(MAGIC + _HEADER.pack(time.time()))
+        self.__last = time.monotonic()
+        self.__flushed = self.__last
+        self.chunks = 0
+        self.bytes = 0
+
+    def write(self, data):
+        """
+        Record a chunk as read from the link, called by the reader right after every read.
+        :param data: The bytes read
+        """
+        now = time.monotonic()
+        with self.__lock:
+            if self.__file is None:
+                return
+
+            delta_us = min(int((now - self.__last) * 1e6), _MAX_DELTA_US)
+            self.__last = now
+            for start in range(0, len(data), _MAX_CHUNK):
+                chunk = data[start : start + _MAX_CHUNK]
+                self.__file.write(_RECORD.pack(delta_us, len(chunk)))
+                self.__file.write(chunk)
+                delta_us = 0
+            self.chunks += 1
+            self.bytes += len(data)
+
+            if now - self.__flushed >= FLUSH_INTERVAL:
+                self.__file.flush()
+                self.__flushed = now
+
+    def close(self):
+        with self.__lock:
+            if self.__file is None:
+                return
+            self.__file.close()
+            self.__file = None
+        logging.info(
+            "Recorded %d chunks, %d bytes to %s", self.chunks, self.bytes, self.path
+        )
+
+
+def read_recording(path):
+    """
+    Read a recording chunk by chunk. A record cut short, e.g. by a crash while recording, ends the recording.
+    :param path: Recording file
+    :return: Generator of (seconds since the recording started, bytes) per chunk
+    """
+    with open(path, "rb") as fh:
+        if fh.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a MAVLink recording")
+        if len(fh.read(_HEADER.size)) != _HEADER.size:
+            return
+
+        offset = 0.0
+        while True:
+            record = fh.read(_RECORD.size)
+            if len(record) < _RECORD.size:
+                if record:
+                    logging.warning("Recording %s ends in a truncated record", path)
+                return
+            delta_us, length = _RECORD.unpack(record)
+            data = fh.read(length)
+            if len(data) < length:
+                logging.warning("Recording %s ends in a truncated record", path)
+                return
+            offset += delta_us / 1e6
+            yield offset, data
+
+
+class ReplayConnection(mavutil.mavfile):
+    """
+    A mavutil connection reading a recording instead of a device. A feeder thread writes the recorded
+    chunks into a pipe at their recorded pace, scaled by the speed, and the read end of the pipe is the
+    connection's file descriptor, so MavlinkIO and the event loop read it like a serial port. Messages
+    sent to the vehicle are counted and discarded.
+
+    Once the recording is played out the pipe stays open and silent until the connection is closed, like
+    a link that went quiet, and finished is set.
+    """
+
+    def __init__(self, path, speed=1.0, source_system=255, source_component=0):
+        """
+        :param path: Recording file
+        :param speed: Factor on the recorded timing, e.g. 2 replays twice as fast, None as fast as it is read
+        :param source_system: MAVLink system ID of our own messages
+        :param source_component: MAVLink component ID of our own messages
+        """
+        if speed is not None and speed <= 0:
+            raise ValueError(f"Replay speed must be positive, got {speed}")
+        # read it once up front, so a bad file fails here and not on the feeder thread
+        next(read_recording(path), None)
+
+        read_fd, self.__write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        super().__init__(
+            read_fd,
+            f"{REPLAY_PREFIX}{path}",
+            source_system=source_system,
+            source_component=source_component,
+        )
+        self.path = path
+        self.speed = speed
+        self.finished = threading.Event()
+        self.discarded = 0
+        self.__stop = threading.Event()
+        self.__feeder = threading.Thread(
+            target=self.__feed, name="mavlink-replay", daemon=True
+        )
+        self.__feeder.start()
+
+    def __feed(self):
+        started = time.monotonic()
+        replayed = 0
+        try:
+            for offset, data in read_recording(self.path):
+                if self.speed is not None:
+                    delay = started + offset / self.speed - time.monotonic()
+                    if delay > 0 and self.__stop.wait(delay):
+                        return
+                elif self.__stop.is_set():
+                    return
+
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(self.__write_fd, view) :]
+                replayed += len(data)
+        except OSError as e:
+            # the read end was closed while we were writing
+            if not self.__stop.is_set():
+                logging.error("Error replaying %s: %s", self.path, e)
+            return
+
+        logging.info(
+            "Replayed %d bytes of %s in %.1f s",
+            replayed,
+            self.path,
+            time.monotonic() - started,
+        )
+        self.finished.set()
+
+    def recv(self, n=None):
+        if n is None:
+            n = 4096
+        try:
+            return os.read(self.fd, n)
+        except BlockingIOError:
+            return b""
+
+    def write(self, buf):
+        self.discarded += len(buf)
+
+    def close(self, n=None):
+        self.__stop.set()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.__feeder.join(1.0)
+        if self.__write_fd is not None:
+            os.close(self.__write_fd)
+            self.__write_fd = None
+
+
+def parse_replay(connection_string):
+    """
+    :param connection_string: replay:PATH, replay:PATH@SPEED or replay:PATH@max
+    :return: (path, speed) with speed None for as fast as possible, None if not a replay connection string
+    """
+    if not connection_string.startswith(REPLAY_PREFIX):
+        return None
+
+    path = connection_string[len(REPLAY_PREFIX) :]
+    head, _, suffix = path.rpartition("@")
+    if not head:
+        return path, 1.0
+    if suffix == "max":
+        return head, None
+    try:
+        return head, float(suffix)
+    except ValueError:
+        # an @ belonging to the path
+        return path, 1.0
+
+
+def open_connection(connection_string, baud=115200):
+    """
+    Open a MAVLink connection, a replay for replay:PATH[@SPEED] and mavutil's connection otherwise.
+    :param connection_string: Connection string, e.g. /dev/ttyACM0, udpin:0.0.0.0:14550 or replay:run.mavrec@max
+    :param baud: Baud rate for serial links
+    :return: The open connection
+    """
+    replay = parse_replay(connection_string)
+    if replay is not None:
+        return ReplayConnection(*replay)
+    return mavutil.mavlink_connection(connection_string, baud=baud)
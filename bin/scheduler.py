@@ -0,0 +1,108 @@
+"""
+Fixed cadence scheduling of periodic jobs with jitter measurement.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+
+class PeriodicTask:
+    """
+    Runs a job on its own thread at a fixed period. Deadlines are absolute (start + n * period), so the
+    time the job takes and the wake-up latency of each tick do not accumulate as drift.
+    """
+
+    def __init__(self, job, period, name="periodic-task", window=1000):
+        """
+        :param job: Callable without arguments run at every tick
+        :param period: Period in seconds
+        :param name: Name of the thread
+        :param window: Number of recent ticks kept for the jitter percentiles
+        """
+        self.__job = job
+        self.__period = period
+        self.__name = name
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__lock = threading.Lock()
+        self.__recent = collections.deque(maxlen=window)
+        self.__max_jitter = 0.0
+        self.__ticks = 0
+        self.__missed = 0
+
+    @property
+    def period(self):
+        return self.__period
+
+    def start(self):
+        """
+        Start the scheduler thread, the first tick runs one period from now.
+        """
+        self.__stop.clear()
+        self.__thread = threading.Thread(
+            target=self.__run, name=self.__name, daemon=True
+        )
+        self.__thread.start()
+
+    def stop(self, timeout=1.0):
+        """
+        Stop the scheduler thread.
+        :param timeout: Max time in seconds to wait for the thread to finish
+        """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+
+    def jitter(self):
+        """
+        Measured lateness of the ticks relative to their deadlines.
+        :return: Dict with ticks, missed deadlines and mean/p99/max jitter in seconds
+        """
+        with self.__lock:
+            recent = sorted(self.__recent)
+            ticks = self.__ticks
+            missed = self.__missed
+            max_jitter = self.__max_jitter
+
+        if not recent:
+            return {
+                "ticks": ticks,
+                "missed": missed,
+                "mean": None,
+                "p99": None,
+                "max": None,
+            }
+
+        return {
+            "ticks": ticks,
+            "missed": missed,
+            "mean": sum(recent) / len(recent),
+            "p99": recent[min(len(recent) - 1, int(len(recent) * 0.99))],
+            "max": max_jitter,
+        }
+
+    def __run(self):
+        deadline = time.monotonic() + self.__period
+        while not self.__stop.wait(max(0.0, deadline - time.monotonic())):
+            lateness = time.monotonic() - deadline
+
+            try:
+                self.__job()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.error("Error in periodic task %s: %s", self.__name, e)
+
+            with self.__lock:
+                self.__ticks += 1
+                self.__recent.append(lateness)
+                self.__max_jitter = max(self.__max_jitter, lateness)
+
+            deadline += self.__period
+            now = time.monotonic()
+            if deadline < now:
+                # Fell more than a period behind, skip the lost ticks rather than bursting to catch up
+                skipped = int((now - deadline) // self.__period) + 1
+                deadline += skipped * self.__period
+                with self.__lock:
+                    self.__missed += skipped
@@ -0,0 +1,164 @@
+"""
+Stream rate management: requests the rate of every published message type from the autopilot with
+MAV_CMD_SET_MESSAGE_INTERVAL, checks the rates actually achieved and optionally switches off streams
+nothing consumes, so link bandwidth goes to the streams that are published.
+"""
+
+import logging
+import threading
+import time
+
+from pymavlink import mavutil
+
+from dispatcher import message_id
+
+DISABLED_INTERVAL = -1
+
+# Never switched off, the connector itself or any other ground station on the link depends on them
+PROTECTED_MESSAGES = (
+    "HEARTBEAT",
+    "RC_CHANNELS",
+    "COMMAND_ACK",
+    "STATUSTEXT",
+    "SYS_STATUS",
+    "TIMESYNC",
+    "PARAM_VALUE",
+)
+
+
+def parse_stream_rate(spec):
+    """
+    Parse a stream rate given on the command line.
+    :param spec: "MSG_TYPE=HZ", e.g. "RAW_IMU=20"
+    :return: Tuple of message type and rate in Hz
+    """
+    msg_type, sep, rate = spec.partition("=")
+    if not sep or not rate:
+        raise ValueError(f"Expected MSG_TYPE=HZ, got: {spec}")
+    msg_type = msg_type.strip().upper()
+    message_id(msg_type)  # fail early on typos
+    if float(rate) <= 0:
+        raise ValueError(f"Stream rate must be positive, got: {spec}")
+    return msg_type, float(rate)
+
+
+class StreamRateManager:
+    """
+    Requests message intervals and measures the rates the autopilot delivers. observe() is meant to run on
+    the reader for every received message, verify() periodically from another thread.
+    """
+
+    def __init__(self, request_interval, rates, tolerance=0.8, heartbeat_timeout=3.0):
+        """
+        :param request_interval: Callable taking a message ID and an interval in microseconds, -1 disables
+        :param rates: Dict mapping MAVLink message name to the requested rate in Hz
+        :param tolerance: Fraction of the requested rate below which a stream is reported as too slow
+        :param heartbeat_timeout: A heartbeat after a gap this long means the autopilot rebooted or the link
+            came back, and the intervals are requested again. None leaves re-requesting to the caller
+        """
+        self.__request_interval = request_interval
+        self.__rates = {message_id(msg_type): rate for msg_type, rate in rates.items()}
+        self.__names = {message_id(msg_type): msg_type for msg_type in rates}
+        self.__protected = frozenset(message_id(name) for name in PROTECTED_MESSAGES)
+        self.__tolerance = tolerance
+        self.__heartbeat_timeout = heartbeat_timeout
+        self.__lock = threading.Lock()
+        self.__counts = dict.fromkeys(self.__rates, 0)
+        self.__window_start = time.monotonic()
+        self.__last_heartbeat = None
+        self.__disabled = set()
+        self.rejected = 0
+
+    def apply(self):
+        """
+        Request the interval of every managed stream and disable the ones switched off before.
+        """
+        for msg_id, rate in self.__rates.items():
+            self.__request_interval(msg_id, int(1e6 / rate))
+        for msg_id in self.__disabled:
+            self.__request_interval(msg_id, DISABLED_INTERVAL)
+
+        with self.__lock:
+            self.__counts = dict.fromkeys(self.__rates, 0)
+            self.__window_start = time.monotonic()
+
+        logging.info(
+            "Requested stream rates %s",
+            {self.__names[msg_id]: rate for msg_id, rate in self.__rates.items()},
+        )
+
+    def disable(self, msg_ids):
+        """
+        Switch off streams nothing consumes. Managed and protected messages are never disabled.
+        :param msg_ids: Iterable of MAVLink message IDs
+        """
+        new = set(msg_ids) - self.__disabled - self.__protected - set(self.__rates)
+        for msg_id in new:
+            self.__request_interval(msg_id, DISABLED_INTERVAL)
+        if new:
+            self.__disabled |= new
+            logging.info("Disabled unused streams with message IDs %s", sorted(new))
+
+    def observe(self, msg):
+        """
+        Count a received message towards its stream's achieved rate.
+        :param msg: Decoded MAVLink message
+        """
+        msg_id = msg.get_msgId()
+        if msg_id in self.__counts:
+            with self.__lock:
+                self.__counts[msg_id] += 1
+
+        elif msg_id == mavutil.mavlink.MAVLINK_MSG_ID_HEARTBEAT:
+            if (
+                self.__heartbeat_timeout is None
+                or msg.autopilot == mavutil.mavlink.MAV_AUTOPILOT_INVALID
+            ):
+                return
+            now = time.monotonic()
+            last_heartbeat, self.__last_heartbeat = self.__last_heartbeat, now
+            if (
+                last_heartbeat is not None
+                and now - last_heartbeat > self.__heartbeat_timeout
+            ):
+                logging.info(
+                    "Heartbeat back after %.1f s, requesting stream rates again",
+                    now - last_heartbeat,
+                )
+                self.apply()
+
+        elif (
+            msg_id == mavutil.mavlink.MAVLINK_MSG_ID_COMMAND_ACK
+            and msg.command == mavutil.mavlink.MAV_CMD_SET_MESSAGE_INTERVAL
+            and msg.result != mavutil.mavlink.MAV_RESULT_ACCEPTED
+        ):
+            self.rejected += 1
+            logging.warning(
+                "Autopilot rejected a message interval, result %d", msg.result
+            )
+
+    def verify(self):
+        """
+        Compare the achieved rates since the last call with the requested ones and start a new window.
+        :return: Dict mapping message name to a (requested Hz, achieved Hz) tuple
+        """
+        now = time.monotonic()
+        with self.__lock:
+            counts = self.__counts
+            elapsed = now - self.__window_start
+            self.__counts = dict.fromkeys(self.__rates, 0)
+            self.__window_start = now
+
+        report = {}
+        for msg_id, requested in self.__rates.items():
+            achieved = counts[msg_id] / elapsed if elapsed > 0 else 0.0
+            report[self.__names[msg_id]] = (requested, achieved)
+            if achieved < requested * self.__tolerance:
+                logging.warning(
+                    "%s arrives at %.1f Hz, requested %.1f Hz",
+                    self.__names[msg_id],
+                    achieved,
+                    requested,
+                )
+
+        return report
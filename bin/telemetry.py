@@ -0,0 +1,166 @@
+"""
+Declarative mapping of MAVLink telemetry messages to Keelson protobuf payloads and subjects.
+
+Each registry entry names the MAVLink message, the protobuf class it is copied into and the Keelson subject
+it is published on. Protobuf fields are filled from the MAVLink field of the same name unless the entry's
+field map says otherwise, and a copier function is generated once per entry so the hot path is a dictionary
+lookup plus straight-line attribute copies.
+"""
+
+import time
+
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+
+from keelson.Envelope_pb2 import Envelope
+from keelson.payloads.Experimental_FlightControllerTelemetry_pb2 import (
+    VFRHUD,
+    RawIMU,
+    AHRS,
+    Vibration,
+    BatteryStatus,
+    Attitude,
+    GPSRawInt,
+    ServoOutputRaw,
+    ScaledPressure,
+    SysStatus,
+)
+
+
+class TelemetryMapping:
+    """
+    One MAVLink message type mapped to a protobuf payload and a Keelson subject.
+    """
+
+    def __init__(self, msg_type, proto_class, subject, field_map=None):
+        """
+        :param msg_type: MAVLink message name, e.g. "VFR_HUD"
+        :param proto_class: Protobuf message class the MAVLink fields are copied into
+        :param subject: Keelson subject the payload is published on
+        :param field_map: Optional {protobuf field: MAVLink field or list of MAVLink fields} for fields whose
+            names differ, a list fills a repeated protobuf field from several scalar MAVLink fields
+        """
+        self.msg_type = msg_type
+        self.proto_class = proto_class
+        self.subject = subject
+        self.field_map = self.__resolve_field_map(field_map or {})
+        self.fill = self.__compile_copier()
+
+    def __resolve_field_map(self, overrides):
+        # Resolve against the MAVLink 2 definitions, the v1 ones lack the extension fields
+        msg_class = mavlink2.mavlink_map[
+            getattr(mavlink2, f"MAVLINK_MSG_ID_{self.msg_type}")
+        ]
+        field_map = {}
+        for field in self.proto_class.DESCRIPTOR.fields:
+            source = overrides.get(field.name, field.name)
+            sources = source if isinstance(source, list) else [source]
+            for name in sources:
+                if name not in msg_class.fieldnames:
+                    raise ValueError(
+                        f"{self.msg_type} has no field {name} for {self.proto_class.__name__}.{field.name}"
+                    )
+            field_map[field.name] = source
+
+        return field_map
+
+    def __compile_copier(self):
+        """
+        Generate and compile a function refilling a protobuf payload in place from a MAVLink message.
+        """
+        repeated = {
+            field.name
+            for field in self.proto_class.DESCRIPTOR.fields
+            if _is_repeated(field)
+        }
+        statements = []
+        for proto_field, source in self.field_map.items():
+            if isinstance(source, list):
+                value = "(" + ", ".join(f"msg.{name}" for name in source) + ",)"
+            else:
+                value = f"msg.{source}"
+
+            if proto_field in repeated:
+                statements.append(f"    out.{proto_field}[:] = {value}")
+            else:
+                statements.append(f"    out.{proto_field} = {value}")
+
+        function_name = f"fill_{self.msg_type.lower()}"
+        source = "\n".join([f"def {function_name}(msg, out):"] + statements)
+        namespace = {}
+        exec(  # pylint: disable=exec-used
+            compile(source, f"<telemetry copier {self.msg_type}>", "exec"), namespace
+        )
+        return namespace[function_name]
+
+
+def _is_repeated(field):
+    if hasattr(field, "is_repeated"):
+        return field.is_repeated
+    return field.label == field.LABEL_REPEATED
+
+
+class EnvelopeWriter:
+    """
+    Builds Keelson envelopes, equivalent to keelson.enclose, in one reused Envelope message instead of
+    allocating an Envelope and a Timestamp message per sample.
+    """
+
+    def __init__(self):
+        self.__envelope = Envelope()
+        self.__enclosed_at = self.__envelope.enclosed_at
+
+    def enclose(self, payload, enclosed_at=None):
+        """
+        :param payload: Serialized payload
+        :param enclosed_at: Enclosing time in nanoseconds since epoch, now if not given
+        :return: The serialized envelope
+        """
+        # Plain field assignment, Timestamp.FromNanoseconds is noticeably slower
+        self.__enclosed_at.seconds, self.__enclosed_at.nanos = divmod(
+            enclosed_at or time.time_ns(), 1_000_000_000
+        )
+        self.__envelope.payload = payload
+        return self.__envelope.SerializeToString()
+
+
+class TelemetryEncoder:
+    """
+    Per-stream encoder reusing one payload message and one envelope buffer for every sample.
+    Not thread-safe, each stream is expected to be encoded from a single thread.
+    """
+
+    def __init__(self, mapping):
+        """
+        :param mapping: The TelemetryMapping of the stream
+        """
+        self.__fill = mapping.fill
+        self.__payload = mapping.proto_class()
+        self.__envelope = EnvelopeWriter()
+
+    def encode(self, msg, enclosed_at=None):
+        """
+        :param msg: Decoded MAVLink message of the stream's type
+        :param enclosed_at: Enclosing time in nanoseconds since epoch, now if not given
+        :return: The serialized Keelson envelope
+        """
+        self.__fill(msg, self.__payload)
+        return self.__envelope.enclose(self.__payload.SerializeToString(), enclosed_at)
+
+
+# fmt: off
+TELEMETRY_REGISTRY = {
+    mapping.msg_type: mapping
+    for mapping in (
+        TelemetryMapping("VFR_HUD", VFRHUD, "flight_controller_telemetry_vfrhud"),
+        TelemetryMapping("RAW_IMU", RawIMU, "flight_controller_telemetry_rawimu"),
+        TelemetryMapping("AHRS", AHRS, "flight_controller_telemetry_ahrs"),
+        TelemetryMapping("VIBRATION", Vibration, "flight_controller_telemetry_vibration"),
+        TelemetryMapping("BATTERY_STATUS", BatteryStatus, "flight_controller_telemetry_battery"),
+        TelemetryMapping("ATTITUDE", Attitude, "flight_controller_telemetry_attitude"),
+        TelemetryMapping("GPS_RAW_INT", GPSRawInt, "flight_controller_telemetry_gpsrawint"),
+        TelemetryMapping("SERVO_OUTPUT_RAW", ServoOutputRaw, "flight_controller_telemetry_servooutputraw", {"servo_raw": [f"servo{i}_raw" for i in range(1, 17)]}),
+        TelemetryMapping("SCALED_PRESSURE", ScaledPressure, "flight_controller_telemetry_scaledpressure"),
+        TelemetryMapping("SYS_STATUS", SysStatus, "flight_controller_telemetry_sysstatus"),
+    )
+}
+# fmt: on
@@ -39,7 +39,8 @@ def terminal_inputs():
         "--device-id",
         type=str,
         required=True,
-        help="Connection device string for MAVLink Ex. /dev/ttyACM0",
+        help="Connection device string for MAVLink Ex. /dev/ttyACM0, or replay:PATH[@SPEED] to replay a "
+        "recording at SPEED times real time, replay:PATH@max as fast as possible",
     )
 
     parser.add_argument(
@@ -49,7 +50,196 @@ def terminal_inputs():
         help="Subscribe from start",
     )
 
+    parser.add_argument(
+        "--max-override-rate",
+        type=float,
+        default=50.0,
+        help="Max rate in Hz at which coalesced rudder/throttle inputs are sent as RC overrides",
+    )
+
+    parser.add_argument(
+        "--override-keep-alive",
+        type=float,
+        default=0.5,
+        help="Seconds between re-sends of the current RC override, keep below ArduPilot RC_OVERRIDE_TIME",
+    )
+
+    parser.add_argument(
+        "--policy",
+        action="append",
+        type=str,
+        help="Per-subject publish policy as SUBJECT:key=value[,key=value] with keys max_rate (Hz), "
+        "decimation (every Nth sample), deadband (publish on change only) and heartbeat (s), "
+        "ex. flight_controller_telemetry_ahrs:max_rate=5, may be repeated",
+    )
+
+    parser.add_argument(
+        "--policy-file",
+        type=str,
+        help="JSON file mapping subject to publish policy settings, ex. "
+        '{"flight_controller_telemetry_ahrs": {"max_rate": 5}}',
+    )
+
+    parser.add_argument(
+        "--telemetry",
+        nargs="+",
+        type=str.upper,
+        default=["VFR_HUD", "RAW_IMU", "AHRS", "VIBRATION", "BATTERY_STATUS"],
+        help="MAVLink message types to publish, any entry of the telemetry registry",
+    )
+
+    parser.add_argument(
+        "--batch",
+        action="append",
+        type=str,
+        help="MAVLink message type to also publish in batches on the stream's subject suffixed with _batch, "
+        "as an EnvelopeBatch of the per-sample envelopes (see bin/batching.py), may be repeated",
+    )
+
+    parser.add_argument(
+        "--batch-window-ms",
+        type=float,
+        default=100.0,
+        help="Max time in ms a sample waits in a batch before the batch is published",
+    )
+
+    parser.add_argument(
+        "--batch-count",
+        type=int,
+        default=50,
+        help="Max number of samples per batch",
+    )
+
+    parser.add_argument(
+        "--runtime",
+        choices=["threaded", "asyncio"],
+        default="threaded",
+        help="Connector runtime, threaded Boat with blocking main loop or cooperative asyncio tasks",
+    )
+
+    parser.add_argument(
+        "--heartbeat-timeout",
+        type=float,
+        default=3.0,
+        help="Seconds without heartbeat after which the MAVLink link is considered lost and reopened",
+    )
+
+    parser.add_argument(
+        "--max-reconnect-backoff",
+        type=float,
+        default=10.0,
+        help="Max seconds between attempts to reopen a lost MAVLink link",
+    )
+
+    parser.add_argument(
+        "--stream-rate-hz",
+        type=float,
+        default=0.0,
+        help="Rate requested from the autopilot for every published telemetry type, "
+        "the default 0 leaves the autopilot's configured stream rates untouched",
+    )
+
+    parser.add_argument(
+        "--stream-rate",
+        action="append",
+        metavar="MSG_TYPE=HZ",
+        help="Rate requested from the autopilot for one message type, can be repeated, "
+        "e.g. RAW_IMU=50",
+    )
+
+    parser.add_argument(
+        "--disable-unused-streams",
+        action="store_true",
+        help="Ask the autopilot to stop sending streams the connector neither publishes nor needs",
+    )
+
+    parser.add_argument(
+        "--raw-passthrough",
+        nargs="*",
+        type=str.upper,
+        metavar="MSG_TYPE",
+        help="Also publish the untouched MAVLink frames on the raw subject, "
+        "only of the given message types if any are listed",
+    )
+
+    parser.add_argument(
+        "--multi-vehicle",
+        action="store_true",
+        help="Serve every MAVLink system ID seen on the device, e.g. a MAVLink router endpoint, "
+        "each vehicle published under its own entity",
+    )
+
+    parser.add_argument(
+        "--vehicle-entity",
+        action="append",
+        metavar="SYSID=ENTITY",
+        help="Entity id of a MAVLink system ID in multi-vehicle mode, can be repeated. "
+        "Unlisted vehicles are published as <entity-id>_<sysid>",
+    )
+
+    parser.add_argument(
+        "--vehicle-queue-size",
+        type=int,
+        default=200,
+        help="Max number of received messages buffered per vehicle in multi-vehicle mode",
+    )
+
+    parser.add_argument(
+        "--rc-channel",
+        action="append",
+        metavar="TARGET=CHANNEL",
+        help="RC channel a control target is overridden on, can be repeated, e.g. thruster_bow=4. "
+        "Defaults to rudder=1 throttle_port=2 throttle_starboard=3, CHANNEL 0 leaves the target undriven",
+    )
+
+    parser.add_argument(
+        "--mixer-file",
+        type=str,
+        help="JSON file with the mixing matrix, slew rates (PWM/s) and limits of the RC channels, ex. "
+        '{"matrix": {"2": {"throttle_port": 1, "rudder": 0.5}, '
+        '"3": {"throttle_starboard": 1, "rudder": -0.5}}, "slew_rates": {"2": 800, "3": 800}, '
+        '"limits": {"2": [1200, 1800]}}, --rc-channel applies on top',
+    )
+
+    parser.add_argument(
+        "--calibration-file",
+        type=str,
+        help="JSON file with the calibration curve of each control target, keys deadband (%%), expo (0-1), "
+        "points ([percent, PWM] pairs interpolated linearly) and reversed, ex. "
+        '{"rudder": {"deadband": 2, "expo": 0.3, "points": [[-100, 1150], [100, 1850]]}}',
+    )
+
+    parser.add_argument(
+        "--link-health-period",
+        type=float,
+        default=1.0,
+        help="Seconds between link health reports (loss and throughput per source, RADIO_STATUS, outbound "
+        "back-off) published on the flight_controller_link_health subject",
+    )
+
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=0.0,
+        help="Seconds between metrics summaries (rates, timings, latencies, frame loss) published as JSON "
+        "on the connector_metrics subject, 0 disables them",
+    )
+
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Serve the metrics in the Prometheus text format at /metrics on this HTTP port",
+    )
+
+    parser.add_argument(
+        "--record",
+        metavar="PATH",
+        help="Record the raw MAVLink stream read from the device with arrival times to PATH, for replay",
+    )
+
     ## Parse arguments and start doing our thing
     args = parser.parse_args()
+    if args.multi_vehicle and args.runtime == "asyncio":
+        parser.error("--multi-vehicle is only supported by the threaded runtime")
 
     return args
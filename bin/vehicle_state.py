@@ -0,0 +1,121 @@
+"""
+Cached vehicle state, maintained from the incoming MAVLink stream by the reader thread.
+"""
+
+import threading
+import time
+
+from pymavlink import mavutil
+
+RC_CHANNEL_COUNT = 18
+
+# Message types the state is built from, links filtering by message ID must keep decoding these
+STATE_MESSAGES = ("HEARTBEAT", "RC_CHANNELS")
+
+
+class VehicleState:
+    """
+    Thread-safe snapshot of the latest known vehicle state. Updated for every received message,
+    so readers get armed state, flight mode and RC channels in O(1) without touching the link.
+    """
+
+    def __init__(self, src_system=None):
+        """
+        :param src_system: MAVLink system ID of the autopilot, None takes the first autopilot seen
+        """
+        self.__lock = threading.Lock()
+        self.__src_system = src_system
+        self.__base_mode = None
+        self.__custom_mode = None
+        self.__rc_channels = ()
+        self.__last_seen = {}
+
+    def update(self, msg):
+        """
+        Fold a received message into the state, meant to be registered as a reader listener.
+        :param msg: Decoded MAVLink message
+        """
+        msg_type = msg.get_type()
+        now = time.monotonic()
+
+        with self.__lock:
+            if msg_type == "HEARTBEAT":
+                # Heartbeats from GCSs, companions and other vehicles say nothing about our autopilot
+                if msg.autopilot != mavutil.mavlink.MAV_AUTOPILOT_INVALID:
+                    if self.__src_system is None:
+                        self.__src_system = msg.get_srcSystem()
+                    if msg.get_srcSystem() == self.__src_system:
+                        self.__last_seen[msg_type] = now
+                        self.__base_mode = msg.base_mode
+                        self.__custom_mode = msg.custom_mode
+                return
+
+            self.__last_seen[msg_type] = now
+
+            if msg_type == "RC_CHANNELS":
+                self.__rc_channels = tuple(
+                    getattr(msg, f"chan{i}_raw") for i in range(1, RC_CHANNEL_COUNT + 1)
+                )
+
+    @property
+    def armed(self):
+        """
+        True if the last autopilot heartbeat reported the vehicle armed, None if no heartbeat was seen yet.
+        """
+        with self.__lock:
+            if self.__base_mode is None:
+                return None
+            return bool(self.__base_mode & mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED)
+
+    @property
+    def custom_mode(self):
+        """
+        The custom_mode (flight mode number) of the last autopilot heartbeat, None if not seen yet.
+        """
+        with self.__lock:
+            return self.__custom_mode
+
+    def rc_channel(self, channel):
+        """
+        Latest raw value of an RC input channel.
+        :param channel: 1-based RC channel number
+        :return: PWM value or None if RC_CHANNELS was not seen yet
+        """
+        with self.__lock:
+            if channel > len(self.__rc_channels):
+                return None
+            return self.__rc_channels[channel - 1]
+
+    def last_seen(self, msg_type):
+        """
+        :param msg_type: MAVLink message name, e.g. "HEARTBEAT"
+        :return: time.monotonic() of the last message of the type, None if never seen
+        """
+        with self.__lock:
+            return self.__last_seen.get(msg_type)
+
+    def age(self, msg_type):
+        """
+        :param msg_type: MAVLink message name, e.g. "HEARTBEAT"
+        :return: Seconds since the last message of the type, None if never seen
+        """
+        last_seen = self.last_seen(msg_type)
+        return None if last_seen is None else time.monotonic() - last_seen
+
+    def snapshot(self):
+        """
+        A consistent copy of the whole state.
+        :return: Dict with armed, custom_mode, rc_channels and last_seen
+        """
+        with self.__lock:
+            armed = None
+            if self.__base_mode is not None:
+                armed = bool(
+                    self.__base_mode & mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED
+                )
+            return {
+                "armed": armed,
+                "custom_mode": self.__custom_mode,
+                "rc_channels": self.__rc_channels,
+                "last_seen": dict(self.__last_seen),
+            }
@@ -0,0 +1,92 @@
+"""
+Actuator queries are answered with the setting actually applied: the requested percentage, or what is left
+of it once the mixer clamped the RC channel to its limits.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+# pylint: disable=wrong-import-position
+import keelson
+import pytest
+from keelson.payloads.TimestampedFloat_pb2 import TimestampedFloat
+
+from actuators import ActuatorDispatcher
+from calibration import Calibration
+from mixer import Mixer
+
+KEY = "rise/v0/boat/rpc/rudder/*/set_rudder_angle_pct"
+
+
+class _Target:
+    """A Boat applying control targets through a mixer."""
+
+    def __init__(self, mixer):
+        self.mixer = mixer
+
+    def set_controls(self, targets):
+        targets = {name: pwm for name, pwm in targets.items() if self.mixer.uses(name)}
+        self.mixer.set_inputs(Mixer.expand(targets))
+        return self.mixer.applied(targets)
+
+
+class _Value:
+    def __init__(self, payload):
+        self.payload = payload
+
+
+class _Query:
+    def __init__(self, key_expr, pct):
+        self.key_expr = key_expr
+        self.value = _Value(
+            keelson.enclose(TimestampedFloat(value=pct).SerializeToString())
+        )
+        self.replies = []
+        self.errors = []
+
+    def reply(self, sample):
+        self.replies.append(
+            TimestampedFloat.FromString(keelson.uncover(sample.payload)[2]).value
+        )
+
+    def reply_err(self, error):
+        self.errors.append(error)
+
+
+def _query(mixer, pct, key_expr=KEY):
+    dispatcher = ActuatorDispatcher(_Target(mixer), Calibration())
+    dispatcher.add_route(KEY, ("rudder",))
+    query = _Query(key_expr, pct)
+    dispatcher.handle(query)
+    return query
+
+
+def test_reply_is_the_requested_setting_within_the_channel_limits():
+    query = _query(Mixer(), 50.0)
+
+    assert query.replies == [pytest.approx(50.0)]
+
+
+def test_reply_is_the_setting_applied_after_clamping_to_the_channel_limits():
+    mixer = Mixer(matrix={1: {"rudder": 1.0}}, limits={1: (1200, 1800)})
+
+    assert _query(mixer, 100.0).replies == [pytest.approx(75.0)]
+    assert _query(mixer, -120.0).replies == [pytest.approx(-75.0)]
+    assert mixer.mix(now=0.0)[0] == 1200
+
+
+def test_targets_without_a_channel_are_not_applied():
+    query = _query(Mixer(matrix={2: {"throttle": 1.0}}), 50.0)
+
+    assert not query.replies
+    assert query.errors == ["Not applied to rudder"]
+
+
+def test_unknown_key_is_rejected():
+    query = _query(
+        Mixer(), 50.0, key_expr="rise/v0/boat/rpc/rudder/2/set_rudder_angle_pct"
+    )
+
+    assert query.errors and not query.replies
@@ -0,0 +1,97 @@
+"""
+What a consumer of batched telemetry receives: a Keelson envelope on the stream's _batch subject whose
+payload is a protobuf EnvelopeBatch holding every sample's envelope, oldest first.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+# pylint: disable=wrong-import-position
+import keelson
+import pytest
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+from batching import TelemetryBatch, batch_subject, flush_due, unpack_batch
+
+SUBJECT = "flight_controller_telemetry_rawimu"
+
+
+def _envelope_batch_class():
+    """The EnvelopeBatch message class, built from the schema documented in batching."""
+    proto = descriptor_pb2.FileDescriptorProto(name="envelope_batch.proto")
+    message = proto.message_type.add(name="EnvelopeBatch")
+    message.field.add(
+        name="envelopes",
+        number=1,
+        type=descriptor_pb2.FieldDescriptorProto.TYPE_BYTES,
+        label=descriptor_pb2.FieldDescriptorProto.LABEL_REPEATED,
+    )
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(proto)
+    return message_factory.GetMessageClass(pool.FindMessageTypeByName("EnvelopeBatch"))
+
+
+EnvelopeBatch = _envelope_batch_class()
+
+
+class _Publisher(list):
+    def put(self, value):
+        self.append(value)
+
+
+def _samples(count):
+    # sizes across the one and two byte length prefix
+    return [keelson.enclose(bytes([i]) * (i * 20)) for i in range(count)]
+
+
+def test_batch_round_trips_through_the_protobuf_schema():
+    publisher = _Publisher()
+    batch = TelemetryBatch(publisher, max_count=10)
+    samples = _samples(10)
+
+    for sample in samples:
+        batch.add(sample, now=0.0)
+
+    assert len(publisher) == 1
+    _, _, payload = keelson.uncover(publisher[0])
+    assert list(EnvelopeBatch.FromString(payload).envelopes) == samples
+    assert unpack_batch(payload) == samples
+    assert unpack_batch(EnvelopeBatch(envelopes=samples).SerializeToString()) == samples
+    assert [keelson.uncover(sample)[2] for sample in unpack_batch(payload)] == [
+        keelson.uncover(sample)[2] for sample in samples
+    ]
+
+
+def test_batch_is_flushed_once_its_window_expired():
+    publisher = _Publisher()
+    batch = TelemetryBatch(publisher, max_count=50, window=0.1)
+    samples = _samples(3)
+    for sample in samples:
+        batch.add(sample, now=10.0)
+
+    assert flush_due([batch], now=10.05) == pytest.approx(0.05)
+    assert not publisher
+    assert flush_due([batch], now=10.1) is None
+    assert unpack_batch(keelson.uncover(publisher[0])[2]) == samples
+
+
+def test_batch_subject_is_a_sibling_of_the_stream_subject():
+    key = keelson.construct_pub_sub_key(
+        realm="rise",
+        entity_id="boatswain",
+        subject=batch_subject(SUBJECT),
+        source_id="speedybee",
+    )
+
+    assert (
+        key
+        == "rise/v0/boatswain/pubsub/flight_controller_telemetry_rawimu_batch/speedybee"
+    )
+    assert keelson.get_subject_from_pub_sub_key(key) == SUBJECT + "_batch"
+
+
+def test_unpack_rejects_other_payloads():
+    with pytest.raises(ValueError):
+        unpack_batch(b"\x12\x01x")
@@ -0,0 +1,140 @@
+"""
+Calibration curves map actuator settings in percent to PWM values: linear by default, interpolated through
+the points of a lookup table, shaped by deadband, expo and reversal, and clamped outside -100 to 100 %.
+"""
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+# pylint: disable=wrong-import-position
+import pytest
+
+from calibration import Calibration, Curve, load_calibration
+
+
+def test_default_curve_is_linear():
+    curve = Curve()
+
+    assert [curve(pct) for pct in (-100, -50, 0, 25, 100)] == [
+        1100,
+        1300,
+        1500,
+        1600,
+        1900,
+    ]
+
+
+def test_points_are_interpolated_linearly():
+    curve = Curve(points=[(100, 1800), (-100, 1200), (0, 1550)])
+
+    assert curve(-100) == 1200
+    assert curve(-50) == 1375
+    assert curve(0) == 1550
+    assert curve(50) == 1675
+    assert curve(100) == 1800
+
+
+def test_settings_out_of_range_are_clamped():
+    curve = Curve()
+
+    assert curve(-250.0) == 1100
+    assert curve(100.04) == 1900
+    assert curve(1e6) == 1900
+
+
+def test_points_short_of_full_scale_extend_their_outer_segments():
+    curve = Curve(points=[(-50, 1300), (50, 1700)])
+
+    assert curve(-100) == 1100
+    assert curve(100) == 1900
+
+
+def test_deadband_and_expo_shape_the_setting():
+    deadband = Curve(deadband=10)
+    expo = Curve(expo=1.0)
+
+    assert deadband(9.9) == 1500
+    assert deadband(55) == 1700
+    assert deadband(100) == 1900
+    assert expo(50) == 1550
+    assert expo(-100) == 1100
+
+
+def test_reversed_curve_mirrors_the_setting():
+    curve = Curve(reversed=True)
+
+    assert curve(100) == 1100
+    assert curve(-25) == 1600
+
+
+def test_settings_are_rounded_to_the_table_resolution():
+    curve = Curve(resolution=1.0)
+
+    assert curve(0.4) == 1500
+    assert curve(0.6) == 1504
+    assert curve(-0.6) == 1496
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        {"deadband": 100},
+        {"expo": 1.5},
+        {"points": [(0, 1500)]},
+        {"points": [(-100, 1000), (100, 1900)]},
+    ],
+)
+def test_invalid_curves_are_rejected(settings):
+    with pytest.raises(ValueError):
+        Curve(**settings)
+
+
+def test_per_side_targets_use_the_curve_of_their_combined_target():
+    calibration = Calibration(
+        {"throttle": {"reversed": True}, "throttle_port": {"deadband": 10}}
+    )
+
+    assert calibration.to_pwm("throttle_starboard", 50) == 1300
+    assert calibration.to_pwm("throttle_port", 5) == 1500
+    assert calibration.to_pwm("rudder", 50) == 1700
+    assert calibration.mapper(["throttle_starboard", "rudder"])([50, 50]) == [
+        1300,
+        1700,
+    ]
+    assert calibration.to_pwm_all({"throttle": 150, "rudder": -150}) == {
+        "throttle": 1100,
+        "rudder": 1100,
+    }
+
+
+def test_to_percent_inverts_the_curve():
+    curve = Curve(deadband=2)
+
+    assert curve.to_percent(1500, near=50) == 0.0
+    assert curve.to_percent(1800) == pytest.approx(75.5)
+    assert Curve(reversed=True).to_percent(1800, near=-100) == pytest.approx(-75.0)
+
+
+def test_load_calibration_from_a_file(tmp_path):
+    path = tmp_path / "calibration.json"
+    path.write_text(
+        json.dumps({"rudder": {"points": [[-100, 1150], [100, 1850]], "expo": 0}})
+    )
+
+    calibration = load_calibration(str(path))
+
+    assert calibration.to_pwm("rudder", -100) == 1150
+    assert calibration.to_pwm("rudder", 100) == 1850
+    assert calibration.to_pwm("throttle", 100) == 1900
+    assert load_calibration().to_pwm("rudder", 100) == 1900
+
+
+def test_load_calibration_rejects_unknown_keys(tmp_path):
+    path = tmp_path / "calibration.json"
+    path.write_text(json.dumps({"rudder": {"trim": 5}}))
+
+    with pytest.raises(ValueError, match="trim"):
+        load_calibration(str(path))
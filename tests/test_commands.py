@@ -0,0 +1,172 @@
+"""
+CommandManager resolves the future of a command by the COMMAND_ACK naming it, re-sends a command with an
+incremented confirmation counter until its retries are used up and only then fails it, and keeps a second
+command with the ID of one in flight waiting until the first is done.
+"""
+
+import os
+import sys
+
+os.environ.setdefault("MAVLINK20", "1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+# pylint: disable=wrong-import-position
+import pytest
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+
+import commands as commands_module
+from commands import CommandManager, CommandTimeout, result_name
+
+ARM = mavlink2.MAV_CMD_COMPONENT_ARM_DISARM
+RELAY = mavlink2.MAV_CMD_DO_SET_RELAY
+
+
+class _Sent(list):
+    """Send callable recording (command, confirmation, params) of every COMMAND_LONG sent."""
+
+    def __call__(self, command, confirmation, *params):
+        self.append((command, confirmation, params))
+
+
+def _ack(command, result=mavlink2.MAV_RESULT_ACCEPTED):
+    return mavlink2.MAVLink_command_ack_message(command, result)
+
+
+def test_ack_resolves_the_matching_command():
+    sent = _Sent()
+    commands = CommandManager(sent, timeout=10.0)
+
+    arm = commands.submit(ARM, 1)
+    relay = commands.submit(RELAY, 1, 1)
+    commands.handle_ack(_ack(RELAY, mavlink2.MAV_RESULT_DENIED))
+
+    assert sent == [(ARM, 0, (1, 0, 0, 0, 0, 0, 0)), (RELAY, 0, (1, 1, 0, 0, 0, 0, 0))]
+    assert relay.result(0) == mavlink2.MAV_RESULT_DENIED
+    assert not arm.done()
+
+    commands.handle_ack(_ack(ARM))
+    assert arm.result(0) == mavlink2.MAV_RESULT_ACCEPTED
+    assert commands.pending() == 0
+
+
+def test_ack_of_a_command_not_in_flight_is_ignored():
+    commands = CommandManager(_Sent(), timeout=10.0)
+    arm = commands.submit(ARM, 1)
+
+    commands.handle_ack(_ack(RELAY))
+
+    assert not arm.done()
+    assert commands.pending() == 1
+
+
+def test_resent_with_incremented_confirmation_until_it_times_out():
+    sent = _Sent()
+    commands = CommandManager(sent, timeout=0.0, retries=2)
+    arm = commands.submit(ARM, 1)
+
+    for _ in range(3):
+        commands.check_timeouts()
+
+    assert [confirmation for _, confirmation, _ in sent] == [0, 1, 2]
+    with pytest.raises(CommandTimeout):
+        arm.result(0)
+    assert commands.pending() == 0
+
+
+def test_ack_after_a_retry_resolves_the_command():
+    sent = _Sent()
+    commands = CommandManager(sent, timeout=0.0, retries=2)
+    arm = commands.submit(ARM, 1)
+
+    commands.check_timeouts()
+    commands.handle_ack(_ack(ARM))
+    commands.check_timeouts()
+
+    assert len(sent) == 2
+    assert arm.result(0) == mavlink2.MAV_RESULT_ACCEPTED
+
+
+def test_in_progress_ack_extends_the_deadline(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(commands_module.time, "monotonic", lambda: clock[0])
+    sent = _Sent()
+    commands = CommandManager(sent, timeout=1.0, retries=0)
+    arm = commands.submit(ARM, 1)
+
+    clock[0] += 0.9
+    commands.handle_ack(_ack(ARM, mavlink2.MAV_RESULT_IN_PROGRESS))
+    clock[0] += 0.9
+    commands.check_timeouts()
+    assert not arm.done()
+
+    clock[0] += 0.2
+    commands.check_timeouts()
+    assert isinstance(arm.exception(0), CommandTimeout)
+    assert len(sent) == 1
+
+
+def test_same_command_waits_for_the_one_in_flight():
+    sent = _Sent()
+    commands = CommandManager(sent, timeout=10.0)
+
+    first = commands.submit(RELAY, 1, 1)
+    second = commands.submit(RELAY, 1, 0)
+    assert len(sent) == 1
+    assert commands.pending() == 2
+
+    commands.handle_ack(_ack(RELAY))
+    assert first.result(0) == mavlink2.MAV_RESULT_ACCEPTED
+    assert not second.done()
+    assert sent[-1] == (RELAY, 0, (1, 0, 0, 0, 0, 0, 0))
+
+    commands.handle_ack(_ack(RELAY, mavlink2.MAV_RESULT_FAILED))
+    assert second.result(0) == mavlink2.MAV_RESULT_FAILED
+
+
+def test_timeout_sends_the_next_waiting_command():
+    sent = _Sent()
+    commands = CommandManager(sent, timeout=0.0, retries=0)
+    first = commands.submit(RELAY, 1, 1)
+    second = commands.submit(RELAY, 1, 0)
+
+    commands.check_timeouts()
+
+    assert isinstance(first.exception(0), CommandTimeout)
+    assert not second.done()
+    assert sent[-1] == (RELAY, 0, (1, 0, 0, 0, 0, 0, 0))
+
+
+def test_send_error_is_retried():
+    attempts = []
+
+    def send(command, confirmation, *params):
+        attempts.append(confirmation)
+        if confirmation == 0:
+            raise OSError("write failed")
+
+    commands = CommandManager(send, timeout=0.0, retries=1)
+    arm = commands.submit(ARM, 1)
+    commands.check_timeouts()
+    commands.handle_ack(_ack(ARM))
+
+    assert attempts == [0, 1]
+    assert arm.result(0) == mavlink2.MAV_RESULT_ACCEPTED
+
+
+def test_cancel_all_cancels_in_flight_and_waiting_commands():
+    commands = CommandManager(_Sent(), timeout=10.0)
+    futures = [commands.submit(RELAY, 1, 1), commands.submit(RELAY, 1, 0)]
+
+    commands.cancel_all()
+
+    assert all(future.cancelled() for future in futures)
+    assert commands.pending() == 0
+
+
+def test_too_many_parameters_are_rejected():
+    with pytest.raises(ValueError):
+        CommandManager(_Sent()).submit(ARM, *range(8))
+
+
+def test_result_name():
+    assert result_name(mavlink2.MAV_RESULT_ACCEPTED) == "MAV_RESULT_ACCEPTED"
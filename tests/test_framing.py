@@ -0,0 +1,149 @@
+"""
+FrameParser decodes only the wanted frames, picked by the message ID in their header, and drops frames
+failing their CRC check. Frames of either MAVLink version may be split across reads, gaps in the sequence
+numbers of a source are counted as lost frames. It reports as skipped only the streams nothing consumes:
+frames the raw forwarder passes on are not skipped, and skipped frames are kept apart per source system.
+"""
+
+import os
+import sys
+
+os.environ.setdefault("MAVLINK20", "1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+# pylint: disable=wrong-import-position
+from pymavlink.dialects.v10 import ardupilotmega as mavlink1
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+
+from framing import FrameParser
+
+RAW_IMU = mavlink2.MAVLINK_MSG_ID_RAW_IMU
+VFR_HUD = mavlink2.MAVLINK_MSG_ID_VFR_HUD
+HEARTBEAT = mavlink2.MAVLINK_MSG_ID_HEARTBEAT
+
+
+class _Connection:
+    """The parts of a mavutil connection FrameParser uses."""
+
+    first_byte = False
+
+    def __init__(self):
+        self.mav = mavlink2.MAVLink(None)
+        self.posted = []
+
+    def post_message(self, msg):
+        self.posted.append(msg)
+
+
+class _Forwarder:
+    """The parts of a RawFramePublisher FrameParser uses."""
+
+    def __init__(self, msg_ids):
+        self.msg_ids = msg_ids
+        self.frames = []
+
+    def wants(self, msg_id):
+        return msg_id in self.msg_ids
+
+    def forward(self, frame, received_at=None):
+        self.frames.append(bytes(frame))
+
+
+def _frames(system=1, dialect=mavlink2):
+    sender = dialect.MAVLink(None, srcSystem=system, srcComponent=1)
+    return [
+        sender.heartbeat_encode(10, 3, 0, 0, 0).pack(sender),
+        sender.raw_imu_encode(1, 1, 2, 3, 4, 5, 6, 7, 8, 9).pack(sender),
+        sender.vfr_hud_encode(0.0, 1.0, 2, 3, 4.0, 5.0).pack(sender),
+    ]
+
+
+def test_raw_forwarded_frames_are_not_skipped():
+    parser = FrameParser(_Connection(), {HEARTBEAT})
+    forwarder = _Forwarder({RAW_IMU})
+    parser.raw_forwarder = forwarder
+
+    parser.parse(b"".join(_frames()))
+
+    assert len(forwarder.frames) == 1
+    assert parser.skipped == 2
+    assert parser.skipped_message_ids() == {VFR_HUD}
+
+
+def test_skipped_ids_are_kept_per_source_system():
+    parser = FrameParser(_Connection(), {HEARTBEAT, RAW_IMU})
+
+    parser.parse(b"".join(_frames(system=1)[:2] + _frames(system=2)))
+
+    assert parser.skipped_message_ids(1) == frozenset()
+    assert parser.skipped_message_ids(2) == {VFR_HUD}
+    assert parser.skipped_message_ids(3) == frozenset()
+    assert parser.skipped_message_ids() == {VFR_HUD}
+
+
+def test_only_wanted_frames_are_decoded(monkeypatch):
+    connection = _Connection()
+    decoded = []
+    decode = connection.mav.decode
+    monkeypatch.setattr(
+        connection.mav, "decode", lambda frame: decoded.append(frame) or decode(frame)
+    )
+    parser = FrameParser(connection, {VFR_HUD})
+
+    messages = parser.parse(b"".join(_frames()))
+
+    assert [msg.get_type() for msg in messages] == ["VFR_HUD"]
+    assert connection.posted == messages
+    assert len(decoded) == 1
+    assert (parser.decoded, parser.skipped, parser.errors) == (1, 2, 0)
+
+
+def test_frames_failing_their_crc_are_dropped():
+    frames = _frames()
+    corrupted = bytearray(frames[2])
+    corrupted[-3] ^= 0xFF
+    skipped = bytearray(frames[1])
+    skipped[-1] ^= 0xFF
+    parser = FrameParser(_Connection(), {HEARTBEAT, VFR_HUD})
+
+    messages = parser.parse(frames[0] + bytes(skipped) + bytes(corrupted) + frames[0])
+
+    assert [msg.get_type() for msg in messages] == ["HEARTBEAT", "HEARTBEAT"]
+    assert parser.errors == 2
+    assert parser.skipped == 0
+    assert parser.skipped_message_ids() == frozenset()
+
+
+def test_frames_split_across_reads_are_reassembled():
+    data = b"".join(_frames(dialect=mavlink1) + _frames(dialect=mavlink2))
+    parser = FrameParser(_Connection())
+
+    messages = []
+    for offset in range(0, len(data), 5):
+        messages += parser.parse(data[offset : offset + 5])
+
+    assert [msg.get_type() for msg in messages] == [
+        "HEARTBEAT",
+        "RAW_IMU",
+        "VFR_HUD",
+    ] * 2
+    assert [msg.get_msgbuf()[0] for msg in messages] == [0xFE] * 3 + [0xFD] * 3
+    assert parser.errors == 0
+
+
+def test_sequence_gaps_are_counted_as_lost():
+    sender = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    frames = []
+    for seq in range(300):
+        # pack leaves the sequence number to send, count it as send would
+        sender.seq = seq % 256
+        frames.append(sender.vfr_hud_encode(0.0, 1.0, 2, 3, 4.0, 5.0).pack(sender))
+    parser = FrameParser(_Connection(), set())
+
+    # frames 10 to 12 lost, the sequence number wraps around at 255
+    parser.parse(b"".join(frames[:10] + frames[13:]))
+
+    assert parser.sequence_stats() == {
+        (1, 1): {"received": 297, "lost": 3, "bytes": 297 * len(frames[0])}
+    }
+    assert parser.sequence_stats(2) == {}
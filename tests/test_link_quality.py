@@ -0,0 +1,154 @@
+"""
+Link quality must only be driven by valid frames: corrupted frames, line noise and stray start markers
+neither count as received nor hide loss, and never show up as sources of their own.
+"""
+
+import os
+import random
+import sys
+
+os.environ.setdefault("MAVLINK20", "1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+# pylint: disable=wrong-import-position
+import pytest
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+
+from framing import FrameParser
+from link_quality import LinkQualityMonitor, OutboundBackoff
+
+RAW_IMU = mavlink2.MAVLINK_MSG_ID_RAW_IMU
+
+
+class _Commands:
+    """The parts of a CommandManager OutboundBackoff uses."""
+
+    timeout = None
+
+    def set_timeout(self, timeout):
+        self.timeout = timeout
+
+
+class _Connection:
+    """The parts of a mavutil connection FrameParser uses."""
+
+    first_byte = False
+
+    def __init__(self):
+        self.mav = mavlink2.MAVLink(None)
+
+    def post_message(self, msg):
+        pass
+
+
+def _frames(count, first_seq=0):
+    sender = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    frames = []
+    for i in range(count):
+        sender.seq = (first_seq + i) & 0xFF
+        if i % 2:
+            msg = sender.raw_imu_encode(i, 1, 2, 3, 4, 5, 6, 7, 8, 9)
+        else:
+            msg = sender.vfr_hud_encode(0.0, 1.0, 2, 3, 4.0, 5.0)
+        frames.append(msg.pack(sender))
+    return frames
+
+
+def _corrupted(frame):
+    frame = bytearray(frame)
+    frame[12] ^= 0xFF
+    return bytes(frame)
+
+
+def _flush(parser):
+    # a stray marker near the end may claim more bytes than arrived so far, the parser waits for them
+    # before it can reject it, as on a live link that keeps streaming
+    parser.parse(bytes(300))
+
+
+def _noise(seed):
+    rnd = random.Random(seed)
+    # a stray MAVLink 2 marker claiming a full payload from a system 42, then random bytes
+    return bytes((0xFD, 255, 0, 0, 0, 42, 42)) + bytes(
+        rnd.randrange(256) for _ in range(64)
+    )
+
+
+@pytest.fixture(params=[None, {RAW_IMU}], ids=["decode-all", "filtered"])
+def parser(request):
+    return FrameParser(_Connection(), request.param)
+
+
+def test_noise_and_corrupted_frames_leave_counters_unchanged(parser):
+    frames = _frames(40)
+    parser.parse(b"".join(frames[:20]))
+    before = parser.sequence_stats()
+
+    garbage = b"".join(_noise(seed) for seed in range(5)) + _corrupted(frames[20])
+    parser.parse(garbage)
+    _flush(parser)
+
+    assert parser.sequence_stats() == before
+    assert parser.errors > 0
+
+
+def test_corrupted_frame_counts_as_lost_not_received(parser):
+    frames = _frames(40)
+    stream = []
+    for i, frame in enumerate(frames):
+        if i % 10 == 0:
+            stream.append(_noise(i))
+        stream.append(_corrupted(frame) if i in (5, 17, 31) else frame)
+
+    parser.parse(b"".join(stream))
+    _flush(parser)
+
+    assert parser.sequence_stats() == {
+        (1, 1): {
+            "received": 37,
+            "lost": 3,
+            "bytes": sum(len(frame) for frame in frames)
+            - sum(len(frames[i]) for i in (5, 17, 31)),
+        }
+    }
+
+
+def test_bogus_length_does_not_swallow_following_frames(parser):
+    frames = _frames(20)
+    messages = parser.parse(_noise(0) + b"".join(frames))
+
+    assert parser.decoded + parser.skipped == 20
+    assert len(messages) == parser.decoded
+
+
+def test_link_quality_reports_the_loss_of_corrupted_frames(parser):
+    monitor = LinkQualityMonitor(window=10.0)
+    frames = _frames(100)
+    parser.parse(b"".join(frames[:50]))
+    monitor.sample({"sequence": parser.sequence_stats()}, now=0.0)
+
+    rest = [
+        _corrupted(frame) if i % 10 == 0 else frame
+        for i, frame in enumerate(frames[50:])
+    ]
+    parser.parse(b"".join(_noise(i) + frame for i, frame in enumerate(rest)))
+    _flush(parser)
+    health = monitor.sample({"sequence": parser.sequence_stats()}, now=1.0)
+
+    assert list(health["sources"]) == ["1/1"]
+    assert health["sources"]["1/1"]["loss_pct"] == 10.0
+    assert health["sources"]["1/1"]["frames_per_s"] == 45.0
+
+
+def test_backoff_applied_from_sampling_reports_the_last_txbuf(caplog):
+    monitor = LinkQualityMonitor()
+    commands = _Commands()
+    outbound = OutboundBackoff(monitor, 50.0, commands, 1.0)
+    sender = mavlink2.MAVLink(None)
+    monitor.observe_radio(sender.radio_status_encode(100, 100, 10, 30, 30, 0, 0))
+
+    outbound.apply()
+
+    assert outbound.min_override_interval == pytest.approx(2.0 / 50.0)
+    assert commands.timeout == pytest.approx(2.0)
+    assert "10% of its buffer free" in caplog.text
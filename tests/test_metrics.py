@@ -0,0 +1,63 @@
+"""
+The telemetry metrics time decoding, encoding and puts per message type, the decode time being taken by
+the FrameParser for every decoded frame.
+"""
+
+import json
+import os
+import sys
+
+os.environ.setdefault("MAVLINK20", "1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+# pylint: disable=wrong-import-position
+import pytest
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+
+from framing import FrameParser
+from metrics import MetricsReport, TelemetryMetrics, prometheus_text
+
+
+class _Connection:
+    """The parts of a mavutil connection FrameParser uses."""
+
+    first_byte = False
+
+    def __init__(self):
+        self.mav = mavlink2.MAVLink(None)
+
+    def post_message(self, msg):
+        pass
+
+
+def _received_and_published(count=10):
+    sender = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    frames = b"".join(
+        sender.vfr_hud_encode(0.0, 1.0, 2, 3, 4.0, 5.0).pack(sender)
+        for _ in range(count)
+    )
+    metrics = TelemetryMetrics()
+    for msg in FrameParser(_Connection()).parse(frames):
+        metrics.received(msg)
+        metrics.published(msg, 0.001, 0.002)
+    return metrics
+
+
+def test_decode_time_is_taken_by_the_parser():
+    metrics = _received_and_published()
+
+    stream = metrics.snapshot()["VFR_HUD"]
+    assert stream["received"] == 10
+    assert stream["decode_seconds"] > 0.0
+    assert stream["encode_seconds"] == pytest.approx(0.01)
+
+
+def test_decode_time_is_reported():
+    metrics = _received_and_published()
+    report = MetricsReport(metrics, lambda: None, lambda summary: None, 1.0)
+
+    summary = json.loads(json.dumps(report.summary()))
+    text = prometheus_text([({"entity": "boat"}, metrics, lambda: None)])
+
+    assert summary["streams"]["VFR_HUD"]["decode_ms"] > 0.0
+    assert 'keelson_mavlink_decode_seconds_total{entity="boat",type="VFR_HUD"}' in text
@@ -0,0 +1,132 @@
+"""
+The Mixer turns control inputs into RC channel values: weighted sums around the center, per-side inputs
+following their combined input until set themselves, clamped to the channel limits and slew rate limited.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+# pylint: disable=wrong-import-position
+import pytest
+
+from mixer import PWM_CENTER, Mixer, load_mixer_config, parse_rc_channel
+
+
+def test_default_matrix_maps_rudder_and_engines():
+    mixer = Mixer()
+
+    mixer.set_inputs(Mixer.expand({"rudder": 1700, "throttle": 1600}))
+
+    assert mixer.mix(now=0.0) == [1700, 1600, 1600, 0, 0, 0, 0, 0]
+
+
+def test_unset_inputs_stay_centered():
+    assert Mixer().mix(now=0.0)[:3] == [PWM_CENTER] * 3
+
+
+def test_per_side_input_overrides_its_combined_input_until_it_is_set_again():
+    mixer = Mixer()
+    mixer.set_inputs(Mixer.expand({"throttle": 1600}))
+    mixer.set_inputs({"throttle_starboard": 1400})
+    assert mixer.mix(now=0.0)[1:3] == [1600, 1400]
+
+    mixer.set_inputs(Mixer.expand({"throttle": 1700}))
+    assert mixer.mix(now=0.0)[1:3] == [1700, 1700]
+
+
+def test_weighted_inputs_are_summed_around_the_center():
+    mixer = Mixer(
+        matrix={
+            2: {"throttle_port": 1.0, "rudder": 0.5},
+            3: {"throttle_starboard": 1.0, "rudder": -0.5},
+        }
+    )
+
+    mixer.set_inputs(Mixer.expand({"throttle": 1600, "rudder": 1700}))
+
+    assert mixer.mix(now=0.0)[1:3] == [1700, 1500]
+
+
+def test_channels_are_clamped_to_their_limits():
+    mixer = Mixer(
+        matrix={1: {"rudder": 1.0}, 2: {"throttle": 1.0, "rudder": 1.0}},
+        limits={1: (1200, 1800)},
+    )
+
+    mixer.set_inputs({"rudder": 1900, "throttle": 1900})
+
+    assert mixer.mix(now=0.0)[:2] == [1800, 1900]
+    mixer.set_inputs({"rudder": 1100, "throttle": 1100})
+    assert mixer.mix(now=0.0)[:2] == [1200, 1100]
+
+
+def test_slew_rate_limits_the_change_per_tick_until_settled():
+    mixer = Mixer(matrix={1: {"rudder": 1.0}}, slew_rates={1: 1000}, tick_interval=0.1)
+
+    mixer.set_inputs({"rudder": 1800})
+    assert mixer.mix(now=10.0)[0] == 1600
+    assert not mixer.settled
+    assert mixer.mix(now=10.1)[0] == 1700
+    assert mixer.mix(now=10.15)[0] == 1750
+    assert mixer.mix(now=10.3)[0] == 1800
+    assert mixer.settled
+
+
+def test_slewing_starts_with_one_tick_after_settling():
+    mixer = Mixer(matrix={1: {"rudder": 1.0}}, slew_rates={1: 1000}, tick_interval=0.1)
+    mixer.set_inputs({"rudder": 1600})
+    mixer.mix(now=0.0)
+    assert mixer.settled
+
+    # the time spent settled does not count, the step is one tick long
+    mixer.set_inputs({"rudder": 1400})
+    assert mixer.mix(now=60.0)[0] == 1500
+
+
+def test_uses_knows_combined_inputs_of_mixed_per_side_inputs():
+    mixer = Mixer(matrix={2: {"throttle_port": 1.0}})
+
+    assert mixer.uses("throttle_port")
+    assert mixer.uses("throttle")
+    assert not mixer.uses("throttle_starboard")
+    assert not mixer.uses("rudder")
+
+
+def test_channel_out_of_range_is_rejected():
+    with pytest.raises(ValueError):
+        Mixer(matrix={9: {"rudder": 1.0}})
+
+
+def test_rc_channel_mapping_moves_an_input_to_its_own_channel():
+    config = load_mixer_config(["thruster_bow=4", "throttle_starboard=0"])
+
+    assert config["matrix"] == {
+        1: {"rudder": 1.0},
+        2: {"throttle_port": 1.0},
+        4: {"thruster_bow": 1.0},
+    }
+    assert parse_rc_channel(" rudder=5") == ("rudder", 5)
+    with pytest.raises(ValueError):
+        parse_rc_channel("rudder")
+
+
+def test_applied_values_are_clamped_by_the_most_limiting_channel():
+    mixer = Mixer(
+        matrix={
+            1: {"rudder": 1.0},
+            2: {"throttle_port": 0.5},
+            3: {"throttle_starboard": 1.0},
+        },
+        limits={1: (1200, 1800), 2: (1300, 1700), 3: (1400, 1650)},
+    )
+
+    assert mixer.applied({"rudder": 1900, "throttle": 1900}) == {
+        "rudder": 1800,
+        "throttle": 1650,
+    }
+    assert mixer.applied({"rudder": 1600, "throttle_port": 1100}) == {
+        "rudder": 1600,
+        "throttle_port": 1100,
+    }
@@ -0,0 +1,47 @@
+"""
+The rate limit of a publishing policy holds the configured rate, not a lower one, when samples arrive
+between its slots, and does not let a burst through after a gap in the stream.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+# pylint: disable=wrong-import-position
+import pytest
+
+from policies import RateLimiter
+
+
+def _passed(limiter, rate_hz, seconds, start=0.0):
+    samples = int(rate_hz * seconds)
+    return [
+        start + i / rate_hz
+        for i in range(samples)
+        if limiter.allow(now=start + i / rate_hz)
+    ]
+
+
+@pytest.mark.parametrize("input_hz, max_hz", [(50, 15), (200, 15), (50, 20), (10, 4)])
+def test_rate_limit_holds_the_max_rate(input_hz, max_hz):
+    limiter = RateLimiter(max_hz)
+    passed = _passed(limiter, input_hz, 10.0)
+
+    assert len(passed) == pytest.approx(max_hz * 10, abs=1)
+
+
+def test_rate_limit_passes_a_slower_stream_untouched():
+    limiter = RateLimiter(15)
+
+    assert len(_passed(limiter, 10, 10.0)) == 100
+    assert limiter.dropped == 0
+
+
+def test_no_burst_after_a_gap():
+    limiter = RateLimiter(10)
+    _passed(limiter, 50, 1.0)
+
+    passed = _passed(limiter, 50, 1.0, start=5.0)
+
+    assert min(b - a for a, b in zip(passed, passed[1:])) >= 0.1 - 1e-9
@@ -0,0 +1,67 @@
+"""
+The heartbeat age of a VehicleState tells whether the autopilot is still there: heartbeats from a ground
+station, a companion computer or another vehicle on the link neither keep it fresh nor change the mode.
+"""
+
+import os
+import sys
+
+os.environ.setdefault("MAVLINK20", "1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+# pylint: disable=wrong-import-position
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+
+from vehicle_state import VehicleState
+
+
+def _heartbeat(system, autopilot=mavlink2.MAV_AUTOPILOT_ARDUPILOTMEGA, custom_mode=0):
+    sender = mavlink2.MAVLink(None, srcSystem=system, srcComponent=1)
+    msg = sender.heartbeat_encode(
+        mavlink2.MAV_TYPE_SURFACE_BOAT, autopilot, 0, custom_mode, 0
+    )
+    # decode the packed frame, so the source system is set as on a received message
+    return mavlink2.MAVLink(None).decode(bytearray(msg.pack(sender)))
+
+
+def test_gcs_heartbeat_does_not_count_as_autopilot_heartbeat():
+    state = VehicleState()
+
+    state.update(_heartbeat(255, autopilot=mavlink2.MAV_AUTOPILOT_INVALID))
+
+    assert state.last_seen("HEARTBEAT") is None
+    assert state.custom_mode is None
+
+
+def test_gcs_heartbeat_does_not_keep_a_lost_autopilot_fresh():
+    state = VehicleState()
+    state.update(_heartbeat(1, custom_mode=10))
+    last_seen = state.last_seen("HEARTBEAT")
+
+    state.update(_heartbeat(255, autopilot=mavlink2.MAV_AUTOPILOT_INVALID))
+
+    assert state.last_seen("HEARTBEAT") == last_seen
+    assert state.custom_mode == 10
+
+
+def test_only_heartbeats_of_the_target_system_count():
+    state = VehicleState(src_system=2)
+
+    state.update(_heartbeat(1, custom_mode=10))
+    assert state.last_seen("HEARTBEAT") is None
+
+    state.update(_heartbeat(2, custom_mode=4))
+    state.update(_heartbeat(1, custom_mode=10))
+    assert state.last_seen("HEARTBEAT") is not None
+    assert state.custom_mode == 4
+
+
+def test_first_autopilot_heartbeat_picks_the_system():
+    state = VehicleState()
+    state.update(_heartbeat(1, custom_mode=4))
+    last_seen = state.last_seen("HEARTBEAT")
+
+    state.update(_heartbeat(2, custom_mode=10))
+
+    assert state.last_seen("HEARTBEAT") == last_seen
+    assert state.custom_mode == 4